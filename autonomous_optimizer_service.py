@@ -7,6 +7,7 @@ import json
 import requests
 from prometheus_api_client import PrometheusConnect
 from kafka import KafkaProducer
+from canary_evaluator import PrometheusCanarySampler, CanaryDecision, evaluate_canary, PROMOTE, ROLLBACK
 
 # --- CONFIGURATION ---
 # PROMETHEUS_URL = "http://prometheus:9090" # URL corrigée pour Docker Compose
@@ -15,6 +16,7 @@ STRATEGY_FILE = "model_strategy.json"
 
 # Endpoint de l'API K8s ou d'un service de déploiement pour déclencher un Canary
 CANARY_DEPLOY_ENDPOINT = "http://deployment-service/deploy-canary" 
+CANARY_ROLLBACK_ENDPOINT = "http://deployment-service/rollback-canary"
 
 # Kafka pour l'archivage
 KAFKA_BOOTSTRAP_SERVERS = 'kafka:9092'
@@ -81,9 +83,9 @@ def generate_new_strategy(current_strategy, perf_data):
     print("👍 Stratégie actuelle jugée optimale. Aucun changement.")
     return None
 
-def trigger_canary_and_commit(new_strategy, producer):
-    """Déclenche un déploiement Canary, et si réussi, commit les changements sur GitHub."""
-    print(f" canary pour la stratégie v{new_strategy['version']}...")
+def trigger_canary_and_commit(new_strategy, producer, prom):
+    """Déclenche un déploiement Canary, l'évalue statistiquement, puis promeut ou annule la stratégie."""
+    print(f"🐤 Lancement du canary pour la stratégie v{new_strategy['version']}...")
     
     # Étape A: Sauvegarder la nouvelle stratégie dans un fichier temporaire
     new_strategy_file = "model_strategy.canary.json"
@@ -91,34 +93,55 @@ def trigger_canary_and_commit(new_strategy, producer):
         json.dump(new_strategy, f, indent=2)
 
     # Étape B: Appeler le service de déploiement pour lancer le Canary
-    # Ce service déploierait une nouvelle version de l'app C# qui lit `model_strategy.canary.json`
-    # et surveillerait les métriques (erreurs, latence).
-    # response = requests.post(CANARY_DEPLOY_ENDPOINT, json={"strategy_file": new_strategy_file})
-    # is_canary_successful = response.json().get("success")
-    is_canary_successful = True # Simulation d'un succès
-
-    if is_canary_successful:
-        print("✅ Déploiement Canary réussi. L'amélioration est validée.")
+    # Ce service déploie une nouvelle version de l'app C# qui lit `model_strategy.canary.json`
+    # et expose ses métriques avec le label deployment_track="canary".
+    try:
+        response = requests.post(CANARY_DEPLOY_ENDPOINT, json={"strategy_file": new_strategy_file}, timeout=30)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Impossible de lancer le Canary: {e}. Annulation de la nouvelle stratégie.")
+        os.remove(new_strategy_file)
+        return
+
+    # Étape C: Évaluation séquentielle baseline vs canary (arrêt anticipé dès que la preuve suffit)
+    try:
+        decision = evaluate_canary(PrometheusCanarySampler(prom))
+    except Exception as e:
+        # Le canary ne doit jamais rester déployé sans décision: toute erreur d'évaluation vaut rollback
+        decision = CanaryDecision(ROLLBACK, f"Évaluation du Canary interrompue: {e}", {})
+    evidence = dict(decision.evidence, version=new_strategy['version'])
+
+    if decision.verdict == PROMOTE:
+        print(f"✅ Déploiement Canary réussi. L'amélioration est validée. ({decision.reason})")
         
-        # Étape C: Rendre le changement permanent et le commiter sur GitHub
+        # Étape D: Rendre le changement permanent et le commiter sur GitHub
         print("💾 Application de la nouvelle stratégie et commit sur GitHub...")
-        os.rename(new_strategy_file, STRATEGY_FILE)
+        os.replace(new_strategy_file, STRATEGY_FILE)
 
         # --- PUBLICATION VERS L'ARCHIVE COGNITIVE ---
-        archive_event = {'type': 'AUTO_AMELIORATION', 'service': 'AutonomousOptimizer', 'message': 'Nouvelle stratégie de modèle validée et appliquée.', 'details': {'version': new_strategy['version'], 'solution': "Le modèle 'gemini-1.5-flash' a été promu comme modèle par défaut pour optimiser les coûts et la latence."}}
+        archive_event = {'type': 'AUTO_AMELIORATION', 'service': 'AutonomousOptimizer', 'message': 'Nouvelle stratégie de modèle validée et appliquée.', 'details': {'version': new_strategy['version'], 'solution': "Le modèle 'gemini-1.5-flash' a été promu comme modèle par défaut pour optimiser les coûts et la latence.", 'evidence': evidence}}
         producer.send(EVENTS_TOPIC, value=archive_event)
+        producer.flush()
         # --- Fin de la publication ---
         
         # Utilisation de l'API GitHub pour créer un commit
         # (Nécessite un GITHUB_TOKEN avec les permissions appropriées)
         # ... logique d'appel à l'API GitHub pour créer un commit et un push ...
-        print("✅ COMMIT AUTOMATISÉ: 'feat(ai): Auto-optimisation de la stratégie de modèle v{new_strategy['version']}'")
+        print(f"✅ COMMIT AUTOMATISÉ: 'feat(ai): Auto-optimisation de la stratégie de modèle v{new_strategy['version']}'")
         print("   Le pipeline CI/CD va maintenant déployer cette amélioration de manière permanente.")
 
     else:
-        print("❌ Déploiement Canary échoué. Annulation de la nouvelle stratégie.")
+        print(f"❌ Déploiement Canary échoué ({decision.reason}). Annulation de la nouvelle stratégie.")
+        try:
+            requests.post(CANARY_ROLLBACK_ENDPOINT, json={"strategy_file": new_strategy_file}, timeout=30).raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"   [WARN] Échec de l'appel de rollback du Canary: {e}")
         os.remove(new_strategy_file)
 
+        archive_event = {'type': 'CANARY_ROLLBACK', 'service': 'AutonomousOptimizer', 'message': f"Stratégie v{new_strategy['version']} annulée après évaluation du Canary.", 'details': {'version': new_strategy['version'], 'error': decision.reason, 'evidence': evidence}}
+        producer.send(EVENTS_TOPIC, value=archive_event)
+        producer.flush()
+
 def main():
     print("🤖 Démarrage de l'Optimiseur de Performance Autonome...")
     prom = None
@@ -140,7 +163,7 @@ def main():
         if perf_data:
             new_strategy = generate_new_strategy(dict(current_strategy), perf_data)
             if new_strategy:
-                trigger_canary_and_commit(new_strategy, producer)
+                trigger_canary_and_commit(new_strategy, producer, prom)
         
         print("😴 Attente de 1 heure avant le prochain cycle d'optimisation...")
         time.sleep(3600)
@@ -0,0 +1,254 @@
+# Fichier: canary_evaluator.py
+# Description: Évaluation statistique séquentielle d'un déploiement Canary (stratégie de modèle).
+#              Compare latence et taux d'erreur baseline/canary avec un test SPRT de Wald
+#              et s'arrête dès que la preuve est suffisante (promotion ou rollback).
+#              La latence est testée sur les écarts canary - baseline d'une même collecte (test apparié):
+#              aucune moyenne de référence n'est supposée connue.
+
+import math
+import time
+from dataclasses import dataclass, field
+
+# --- CONFIGURATION ---
+ALPHA = 0.05                     # Risque de rollback à tort (faux positif de régression)
+BETA = 0.10                      # Risque de promouvoir une régression (faux négatif)
+ERROR_RATE_DELTA = 0.02          # Hausse absolue du taux d'erreur considérée comme une régression
+LATENCY_REGRESSION_RATIO = 0.10  # Hausse relative de latence considérée comme une régression (+10%)
+MIN_LATENCY_SAMPLES = 10         # Collectes appariées minimum avant de juger la latence (variance estimée)
+MIN_REQUESTS = 50                # Requêtes minimum par bras avant de juger le taux d'erreur
+POLL_INTERVAL_SECONDS = 30
+MAX_DURATION_SECONDS = 1800      # Au-delà, le test est déclaré non concluant
+MAX_CONSECUTIVE_SAMPLER_ERRORS = 5 # Prometheus injoignable trop longtemps: rollback par prudence
+
+# Requêtes Prometheus: fenêtre = intervalle de collecte, les points successifs ne se chevauchent pas
+TRACK_LABEL = "deployment_track"
+LATENCY_QUERY = 'sum(increase(gemini_duration_seconds_sum{%s="%s"}[%ds])) / sum(increase(gemini_duration_seconds_count{%s="%s"}[%ds]))'
+REQUESTS_QUERY = 'sum(increase(gemini_duration_seconds_count{%s="%s"}[%ds]))'
+ERRORS_QUERY = 'sum(increase(gemini_errors_total{%s="%s"}[%ds]))'
+
+PROMOTE = "PROMOTE"
+ROLLBACK = "ROLLBACK"
+CONTINUE = "CONTINUE"
+
+
+@dataclass
+class ArmSamples:
+    """Échantillons cumulés d'un bras (baseline ou canary)."""
+    log_latencies: list = field(default_factory=list)
+    requests: int = 0
+    errors: int = 0
+
+    def add(self, latency_s=None, requests=0, errors=0):
+        if latency_s is not None and latency_s > 0:
+            self.log_latencies.append(math.log(latency_s))
+        self.requests += max(int(requests), 0)
+        self.errors += min(max(int(errors), 0), max(int(requests), 0))
+
+    def error_rate(self):
+        # Lissage de Laplace pour éviter les log(0) dans le SPRT
+        return (self.errors + 1) / (self.requests + 2)
+
+    def summary(self):
+        latencies = [math.exp(x) for x in self.log_latencies]
+        return {
+            "latency_samples": len(latencies),
+            "latency_geomean_ms": round(math.exp(_mean(self.log_latencies)) * 1000, 2) if latencies else None,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 5) if self.requests else None,
+        }
+
+
+@dataclass
+class CanaryDecision:
+    verdict: str
+    reason: str
+    evidence: dict
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+def _variance(values):
+    if len(values) < 2:
+        return 0.0
+    m = _mean(values)
+    return sum((v - m) ** 2 for v in values) / (len(values) - 1)
+
+
+class SequentialCanaryTest:
+    """
+    Test séquentiel (SPRT de Wald) sur deux métriques:
+    - taux d'erreur: H0 p_canary = p_baseline, H1 p_canary = p_baseline + ERROR_RATE_DELTA. Le rollback
+      repose sur un test conditionnel à deux échantillons: sachant les erreurs d'une collecte, chacune
+      vient du canary avec la probabilité pi0 = n_canary / (n_baseline + n_canary) sous H0 (p_baseline
+      n'intervient que dans H1, estimé sur les collectes précédentes). Ce test ne voit que les erreurs:
+      sans erreur il reste à 0. L'acceptation de H0 repose donc sur un SPRT binomial des erreurs du canary
+      parmi ses requêtes contre le taux lissé de la baseline, qui accumule aussi les requêtes réussies
+      (il ne peut que promouvoir: seul beta en dépend, alpha reste tenu par le test conditionnel);
+    - latence: écarts appariés D_i = log(latence canary) - log(latence baseline) de chaque collecte,
+      H0 E[D] = 0, H1 E[D] = log(1 + LATENCY_REGRESSION_RATIO) (gaussien, variance des écarts estimée).
+    ROLLBACK dès qu'une métrique accepte H1, PROMOTE quand toutes acceptent H0. Le risque alpha est
+    partagé entre les deux métriques (Bonferroni) pour tenir sur l'ensemble du canary.
+    """
+
+    def __init__(self, alpha=ALPHA, beta=BETA, error_rate_delta=ERROR_RATE_DELTA,
+                 latency_regression_ratio=LATENCY_REGRESSION_RATIO,
+                 min_latency_samples=MIN_LATENCY_SAMPLES, min_requests=MIN_REQUESTS):
+        self.upper = math.log((1 - beta) / (alpha / 2)) # Seuil d'acceptation de H1 (régression), alpha/2 par métrique
+        self.lower = math.log(beta / (1 - alpha))   # Seuil d'acceptation de H0 (pas de régression)
+        self.alpha = alpha
+        self.beta = beta
+        self.error_rate_delta = error_rate_delta
+        self.latency_shift = math.log(1 + latency_regression_ratio)
+        self.min_latency_samples = max(min_latency_samples, 4) # La correction de variance exige n > 3
+        self.min_requests = min_requests
+        self.baseline = ArmSamples()
+        self.canary = ArmSamples()
+        self.latency_differences = []
+        self._error_llr = 0.0
+        self._error_acceptance_llr = 0.0
+
+    def add_poll(self, baseline_point, canary_point):
+        """Ajoute une collecte des deux bras; l'écart de latence n'est retenu que si les deux bras en ont une."""
+        self._error_llr += self._poll_error_llr(baseline_point, canary_point)
+        self._error_acceptance_llr += self._poll_canary_binomial_llr(canary_point)
+        for arm, point in ((self.baseline, baseline_point), (self.canary, canary_point)):
+            arm.add(point.get("latency_s"), point.get("requests", 0), point.get("errors", 0))
+        base, can = baseline_point.get("latency_s"), canary_point.get("latency_s")
+        if base and can and base > 0 and can > 0:
+            self.latency_differences.append(math.log(can) - math.log(base))
+
+    def _poll_error_llr(self, baseline_point, canary_point):
+        n_b, n_c = max(int(baseline_point.get("requests", 0)), 0), max(int(canary_point.get("requests", 0)), 0)
+        if not n_b or not n_c:
+            return 0.0
+        e_b = min(max(int(baseline_point.get("errors", 0)), 0), n_b)
+        e_c = min(max(int(canary_point.get("errors", 0)), 0), n_c)
+        p0 = self.baseline.error_rate() # Collectes précédentes uniquement: le LLR reste une martingale sous H0
+        p1 = min(p0 + self.error_rate_delta, 0.999)
+        pi0 = n_c / (n_b + n_c)
+        pi1 = n_c * p1 / (n_c * p1 + n_b * p0)
+        return e_c * math.log(pi1 / pi0) + e_b * math.log((1 - pi1) / (1 - pi0))
+
+    def _poll_canary_binomial_llr(self, canary_point):
+        n_c = max(int(canary_point.get("requests", 0)), 0)
+        if not n_c:
+            return 0.0
+        e_c = min(max(int(canary_point.get("errors", 0)), 0), n_c)
+        # Taux de la baseline minoré d'un écart-type: une baseline surestimée en début de canary
+        # rendrait une régression indiscernable (promotion à tort)
+        rate, n_b = self.baseline.error_rate(), self.baseline.requests + 2
+        p0 = max(rate - math.sqrt(rate * (1 - rate) / n_b), 1 / n_b)
+        p1 = min(p0 + self.error_rate_delta, 0.999)
+        return e_c * math.log(p1 / p0) + (n_c - e_c) * math.log((1 - p1) / (1 - p0))
+
+    def _enough_requests(self):
+        return self.baseline.requests >= self.min_requests and self.canary.requests >= self.min_requests
+
+    def error_llr(self):
+        """Log-rapport H1/H0 du test conditionnel (décide le rollback), ou None si trop peu de données."""
+        return self._error_llr if self._enough_requests() else None
+
+    def error_acceptance_llr(self):
+        """Log-rapport H1/H0 du SPRT binomial du canary (décide l'acceptation de H0), ou None si trop peu de données."""
+        return self._error_acceptance_llr if self._enough_requests() else None
+
+    def latency_llr(self):
+        """Log-rapport de vraisemblance H1/H0 de la latence du canary, ou None si trop peu de données."""
+        diffs = self.latency_differences
+        if len(diffs) < self.min_latency_samples:
+            return None
+        # Variance des écarts appariés, gonflée pour les petits échantillons (elle est estimée, pas connue)
+        # et avec un plancher pour les séries quasi constantes
+        n = len(diffs)
+        sigma2 = max(_variance(diffs) * (n + 1) / (n - 3), 1e-4)
+        d = self.latency_shift
+        return (d / sigma2) * sum(x - d / 2 for x in diffs)
+
+    def decide(self):
+        llrs = {"error_rate": self.error_llr(), "latency": self.latency_llr()}
+        acceptance_llrs = {"error_rate": self.error_acceptance_llr(), "latency": llrs["latency"]}
+        evidence = {
+            "test": "SPRT (latence appariée)",
+            "latency_pairs": len(self.latency_differences),
+            "alpha": self.alpha,
+            "beta": self.beta,
+            "thresholds": {"accept_h0": round(self.lower, 4), "accept_h1": round(self.upper, 4)},
+            "llr": {k: (round(v, 4) if v is not None else None) for k, v in llrs.items()},
+            "acceptance_llr": {k: (round(v, 4) if v is not None else None) for k, v in acceptance_llrs.items()},
+            "baseline": self.baseline.summary(),
+            "canary": self.canary.summary(),
+        }
+
+        regressions = [name for name, llr in llrs.items() if llr is not None and llr >= self.upper]
+        if regressions:
+            return CanaryDecision(ROLLBACK, f"Régression significative détectée: {', '.join(regressions)}.", evidence)
+        if all(llr is not None and llr <= self.lower for llr in acceptance_llrs.values()):
+            return CanaryDecision(PROMOTE, "Aucune régression: latence et taux d'erreur équivalents à la baseline.", evidence)
+        return CanaryDecision(CONTINUE, "Preuve insuffisante, collecte en cours.", evidence)
+
+
+class PrometheusCanarySampler:
+    """Collecte un point (latence moyenne, requêtes, erreurs) par bras depuis Prometheus."""
+
+    def __init__(self, prom, window_seconds=POLL_INTERVAL_SECONDS):
+        self.prom = prom
+        self.window_seconds = window_seconds
+
+    def _scalar(self, query):
+        result = self.prom.custom_query(query=query)
+        if not result:
+            return None
+        value = float(result[0]['value'][1])
+        return None if math.isnan(value) else value
+
+    def sample(self, track):
+        latency = self._scalar(LATENCY_QUERY % (TRACK_LABEL, track, self.window_seconds, TRACK_LABEL, track, self.window_seconds))
+        requests = self._scalar(REQUESTS_QUERY % (TRACK_LABEL, track, self.window_seconds)) or 0
+        errors = self._scalar(ERRORS_QUERY % (TRACK_LABEL, track, self.window_seconds)) or 0
+        return {"latency_s": latency, "requests": round(requests), "errors": round(errors)}
+
+
+def evaluate_canary(sampler, test=None, poll_interval=POLL_INTERVAL_SECONDS,
+                    max_duration=MAX_DURATION_SECONDS, sleep=time.sleep, clock=time.monotonic,
+                    max_consecutive_errors=MAX_CONSECUTIVE_SAMPLER_ERRORS):
+    """
+    Collecte des échantillons jusqu'à une décision. Un test non concluant à l'échéance
+    est traité comme un échec: on ne promeut jamais sans preuve. Une collecte en erreur
+    compte comme un échantillon manquant; trop d'erreurs consécutives entraînent un rollback.
+    """
+    test = test or SequentialCanaryTest()
+    started = clock()
+    polls = 0
+    sampler_errors = consecutive_errors = 0
+
+    while True:
+        try:
+            points = sampler.sample("baseline"), sampler.sample("canary")
+        except Exception as e:
+            sampler_errors += 1
+            consecutive_errors += 1
+            print(f"   [CANARY] Collecte impossible ({consecutive_errors}/{max_consecutive_errors}): {e}")
+            if consecutive_errors >= max_consecutive_errors:
+                evidence = dict(test.decide().evidence, polls=polls, sampler_errors=sampler_errors,
+                                elapsed_seconds=round(clock() - started, 1))
+                return CanaryDecision(ROLLBACK, f"Métriques indisponibles ({e}). Rollback par prudence.", evidence)
+            points = None
+        if points is not None:
+            consecutive_errors = 0
+            test.add_poll(*points)
+            polls += 1
+
+        decision = test.decide()
+        elapsed = clock() - started
+        decision.evidence.update({"polls": polls, "sampler_errors": sampler_errors, "elapsed_seconds": round(elapsed, 1)})
+        if points is not None:
+            print(f"   [CANARY] Collecte #{polls}: {decision.verdict} (llr={decision.evidence['llr']})")
+
+        if decision.verdict != CONTINUE:
+            return decision
+        if elapsed + poll_interval > max_duration:
+            return CanaryDecision(ROLLBACK, f"Test non concluant après {round(elapsed)}s. Rollback par prudence.", decision.evidence)
+        sleep(poll_interval)
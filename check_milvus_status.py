@@ -1,39 +1,294 @@
 # Fichier: check_milvus_status.py
-# Description: Script pour interroger l'état de la base de données vectorielle Milvus.
+# Description: Outil de diagnostic de la base de données vectorielle Milvus.
+#              Rapporte l'index, l'état de chargement, les segments, partitions et la mémoire,
+#              mesure la latence de recherche (sonde à plusieurs k et nprobe/ef), recommande
+#              des paramètres d'index et détecte les régressions de latence par rapport à une référence.
 
-from pymilvus import utility, connections
+import sys
+import json
+import math
+import time
+import random
+import argparse
+from pymilvus import utility, connections, Collection, DataType
 
 # --- CONFIGURATION ---
 MILVUS_HOST = "localhost"
 MILVUS_PORT = "19530"
 COLLECTION_NAME = "medical_knowledge_base"
+PROBE_QUERIES = 20           # Requêtes aléatoires par combinaison (k, paramètre)
+PROBE_TOP_K = (1, 10, 50)
+PROBE_NPROBE = (8, 32, 128)  # Index IVF_*
+PROBE_EF = (32, 64, 128)     # Index HNSW (ef est relevé à k si nécessaire)
+REGRESSION_RATIO = 1.5       # p99 > 1.5x la référence = régression
+VECTOR_TYPES = (DataType.FLOAT_VECTOR, DataType.FLOAT16_VECTOR, DataType.BFLOAT16_VECTOR)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Diagnostic et sonde de performance Milvus.")
+    parser.add_argument("--host", default=MILVUS_HOST)
+    parser.add_argument("--port", default=MILVUS_PORT)
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--format", choices=("text", "json", "prometheus"), default="text")
+    parser.add_argument("--no-probe", action="store_true", help="N'exécute pas la sonde de latence.")
+    parser.add_argument("--load", action="store_true", help="Charge la collection en mémoire si nécessaire avant la sonde.")
+    parser.add_argument("--queries", type=int, default=PROBE_QUERIES)
+    parser.add_argument("--k", type=int, nargs="+", default=list(PROBE_TOP_K))
+    parser.add_argument("--nprobe", type=int, nargs="+", default=list(PROBE_NPROBE))
+    parser.add_argument("--ef", type=int, nargs="+", default=list(PROBE_EF))
+    parser.add_argument("--baseline", default=None, help="Rapport JSON de référence pour détecter les régressions.")
+    parser.add_argument("--save-baseline", default=None, help="Écrit le rapport courant comme nouvelle référence.")
+    return parser.parse_args()
+
+def _index_description(index):
+    """Normalise `Index.params` ({index_type, metric_type, params} imbriqués ou à plat selon la version)."""
+    raw = dict(index.params)
+    params = raw.pop("params", {}) or {}
+    if isinstance(params, str):
+        params = json.loads(params)
+    index_type = raw.pop("index_type", "UNKNOWN")
+    metric_type = raw.pop("metric_type", "L2")
+    params.update({k: v for k, v in raw.items() if k not in ("index_name", "field_name")})
+    return {"field": index.field_name, "index_type": index_type, "metric_type": metric_type, "params": params}
+
+def _vector_field(collection):
+    for field in collection.schema.fields:
+        if field.dtype in VECTOR_TYPES:
+            return field.name, int(field.params["dim"])
+    raise ValueError("Aucun champ vectoriel dense dans la collection.")
+
+def estimate_memory_bytes(rows, dim, index_type, params):
+    """Estimation grossière de l'empreinte mémoire de l'index chargé (vecteurs float32 + structures)."""
+    raw = rows * dim * 4
+    if index_type == "HNSW":
+        return int(raw + rows * int(params.get("M", 16)) * 2 * 4)
+    if index_type == "IVF_PQ":
+        m, nbits = int(params.get("m", max(1, dim // 8))), int(params.get("nbits", 8))
+        return int(rows * m * nbits / 8 + int(params.get("nlist", 1)) * dim * 4)
+    if index_type == "IVF_SQ8":
+        return int(rows * dim)
+    return int(raw)
+
+def collect_status(collection):
+    name = collection.name
+    vector_field, dim = _vector_field(collection)
+    rows = collection.num_entities
+    indexes = [_index_description(index) for index in collection.indexes]
+    vector_index = next((i for i in indexes if i["field"] == vector_field), None)
+    load_state = utility.load_state(name)
+
+    segments = []
+    if load_state.name == "Loaded":
+        try:
+            segments = utility.get_query_segment_info(name)
+        except Exception as e: # Non implémenté par Milvus Lite: diagnostic partiel plutôt qu'échec
+            print(f"⚠️  Informations de segments indisponibles: {type(e).__name__}", file=sys.stderr)
+            segments = None
+    loaded_memory = sum(getattr(s, "mem_size", 0) for s in segments or [])
+
+    return {
+        "collection": name,
+        "rows": rows,
+        "vector_field": vector_field,
+        "dim": dim,
+        "load_state": load_state.name,
+        "index": vector_index,
+        "scalar_indexes": [i for i in indexes if i["field"] != vector_field],
+        "partitions": [{"name": p.name, "rows": p.num_entities} for p in collection.partitions],
+        "segments": None if segments is None else {"count": len(segments), "rows": sum(getattr(s, "num_rows", 0) for s in segments)},
+        "memory_bytes": {
+            "loaded": loaded_memory or None, # Rapporté par les query nodes (collection chargée seulement)
+            "estimated": estimate_memory_bytes(rows, dim, vector_index["index_type"], vector_index["params"]) if vector_index else rows * dim * 4,
+        },
+    }
+
+def _search_params(index_type, k, value):
+    if index_type and index_type.startswith("IVF"):
+        return {"nprobe": value}, f"nprobe={value}"
+    if index_type == "HNSW":
+        ef = max(value, k) # HNSW exige ef >= k
+        return {"ef": ef}, f"ef={ef}"
+    return {}, "default"
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def probe_search_latency(collection, status, ks, nprobes, efs, queries):
+    """Recherches avec des vecteurs aléatoires normalisés; latences client (réseau compris) en ms."""
+    index = status["index"] or {}
+    index_type = index.get("index_type")
+    metric_type = index.get("metric_type", "L2")
+    values = nprobes if index_type and index_type.startswith("IVF") else efs if index_type == "HNSW" else [None]
+    results = []
+    rng = random.Random(0)
+    for k in ks:
+        seen = set()
+        for value in values:
+            params, label = _search_params(index_type, k, value)
+            if label in seen:
+                continue
+            seen.add(label)
+            latencies = []
+            for _ in range(queries):
+                vector = [rng.gauss(0, 1) for _ in range(status["dim"])]
+                norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+                started = time.perf_counter()
+                collection.search([[x / norm for x in vector]], status["vector_field"],
+                                  {"metric_type": metric_type, "params": params}, limit=k)
+                latencies.append((time.perf_counter() - started) * 1000)
+            results.append({
+                "k": k, "param": label,
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+            })
+    return results
+
+def recommend_index(status):
+    """Règles usuelles de dimensionnement selon la taille de la collection."""
+    rows, dim = max(status["rows"], 1), status["dim"]
+    nlist = int(min(65536, max(16, 4 * math.sqrt(rows))))
+    if rows < 1_000_000:
+        recommended = {"index_type": "HNSW", "params": {"M": 16, "efConstruction": 200}, "search": {"ef": 64},
+                       "reason": "Moins d'un million de vecteurs: HNSW offre le meilleur rappel à faible latence."}
+    elif rows < 10_000_000:
+        recommended = {"index_type": "IVF_FLAT", "params": {"nlist": nlist}, "search": {"nprobe": max(8, nlist // 64)},
+                       "reason": "Entre 1 et 10 millions de vecteurs: IVF_FLAT avec nlist ≈ 4·√n."}
+    else:
+        m = next(d for d in (dim // 8, dim // 4, dim // 2, dim) if d and dim % d == 0)
+        recommended = {"index_type": "IVF_PQ", "params": {"nlist": nlist, "m": m, "nbits": 8}, "search": {"nprobe": max(16, nlist // 32)},
+                       "reason": "Plus de 10 millions de vecteurs: IVF_PQ pour contenir l'empreinte mémoire."}
+    recommended["estimated_memory_bytes"] = estimate_memory_bytes(rows, dim, recommended["index_type"], recommended["params"])
+
+    warnings = []
+    current = status["index"]
+    if current is None:
+        warnings.append("Aucun index sur le champ vectoriel: chaque recherche est un scan exhaustif.")
+    else:
+        params = current["params"]
+        if current["index_type"].startswith("IVF") and "nlist" in params:
+            ratio = int(params["nlist"]) / nlist
+            if ratio < 0.25 or ratio > 4:
+                warnings.append(f"nlist={params['nlist']} éloigné de la valeur conseillée ({nlist}) pour {status['rows']} vecteurs.")
+        if current["index_type"] != recommended["index_type"]:
+            warnings.append(f"Index {current['index_type']} en place, {recommended['index_type']} conseillé à cette taille.")
+    if status["load_state"] != "Loaded":
+        warnings.append("Collection non chargée en mémoire: les recherches échoueront ou déclencheront un chargement.")
+    if status["partitions"] and len(status["partitions"]) > 1024:
+        warnings.append("Plus de 1024 partitions: le coût de planification des requêtes augmente.")
+    return {"recommended": recommended, "warnings": warnings}
+
+def compare_with_baseline(probe, baseline_path, ratio=REGRESSION_RATIO):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(p["k"], p["param"]): p for p in json.load(f).get("probe", [])}
+    regressions = []
+    for point in probe:
+        reference = baseline.get((point["k"], point["param"]))
+        if reference and reference["p99_ms"] and point["p99_ms"] > ratio * reference["p99_ms"]:
+            regressions.append({"k": point["k"], "param": point["param"],
+                                "p99_ms": point["p99_ms"], "baseline_p99_ms": reference["p99_ms"]})
+    return regressions
+
+def to_prometheus(report):
+    """Format texte d'exposition Prometheus (pour un textfile collector ou un push gateway)."""
+    status = report["status"]
+    label = f'collection="{status["collection"]}"'
+    lines = [
+        "# TYPE milvus_collection_rows gauge", f"milvus_collection_rows{{{label}}} {status['rows']}",
+        "# TYPE milvus_collection_loaded gauge", f"milvus_collection_loaded{{{label}}} {int(status['load_state'] == 'Loaded')}",
+        "# TYPE milvus_collection_partitions gauge", f"milvus_collection_partitions{{{label}}} {len(status['partitions'])}",
+        "# TYPE milvus_collection_memory_bytes gauge",
+        f"milvus_collection_memory_bytes{{{label},source=\"estimated\"}} {status['memory_bytes']['estimated']}",
+    ]
+    if status["segments"] is not None:
+        lines += ["# TYPE milvus_collection_segments gauge", f"milvus_collection_segments{{{label}}} {status['segments']['count']}"]
+    if status["memory_bytes"]["loaded"]:
+        lines.append(f"milvus_collection_memory_bytes{{{label},source=\"loaded\"}} {status['memory_bytes']['loaded']}")
+    if report.get("probe"):
+        lines.append("# TYPE milvus_search_latency_seconds gauge")
+        for point in report["probe"]:
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'milvus_search_latency_seconds{{{label},k="{point["k"]}",param="{point["param"]}",quantile="{quantile}"}} {point[key] / 1000:.6f}')
+    lines += ["# TYPE milvus_search_latency_regressions gauge",
+              f"milvus_search_latency_regressions{{{label}}} {len(report.get('regressions', []))}"]
+    return "\n".join(lines) + "\n"
+
+def print_text(report):
+    status, advice = report["status"], report["advice"]
+    index = status["index"]
+    print(f"✅ La base de connaissances '{status['collection']}' existe.")
+    print(f"🧠 Elle contient actuellement : {status['rows']} morceaux de connaissance (vecteurs de dimension {status['dim']}).")
+    if index:
+        print(f"🗂️  Index: {index['index_type']} ({index['metric_type']}) {json.dumps(index['params'])}")
+    else:
+        print("🗂️  Index: aucun")
+    segments = status["segments"]["count"] if status["segments"] is not None else "?"
+    print(f"📦 État: {status['load_state']} | {len(status['partitions'])} partition(s) | {segments} segment(s) chargé(s)")
+    memory = status["memory_bytes"]
+    loaded = f"{memory['loaded'] / 1024 ** 2:.1f} Mo chargés, " if memory["loaded"] else ""
+    print(f"💾 Mémoire: {loaded}{memory['estimated'] / 1024 ** 2:.1f} Mo estimés")
+    for point in report.get("probe", []):
+        print(f"⏱️  k={point['k']:<4} {point['param']:<12} p50 {point['p50_ms']} ms | p95 {point['p95_ms']} ms | p99 {point['p99_ms']} ms")
+    recommended = advice["recommended"]
+    print(f"💡 Conseillé: {recommended['index_type']} {json.dumps(recommended['params'])}, recherche {json.dumps(recommended['search'])}")
+    print(f"   {recommended['reason']}")
+    for warning in advice["warnings"]:
+        print(f"⚠️  {warning}")
+    for regression in report.get("regressions", []):
+        print(f"🚨 Régression de latence: k={regression['k']} {regression['param']} p99 {regression['p99_ms']} ms "
+              f"(référence {regression['baseline_p99_ms']} ms)")
 
 def main():
-    """Se connecte à Milvus et affiche le statut de la collection de connaissances."""
-    print(f"🔍 Interrogation de Milvus sur {MILVUS_HOST}:{MILVUS_PORT}...")
-    
+    """Se connecte à Milvus et produit le diagnostic de la collection de connaissances."""
+    args = parse_args()
+    quiet = args.format != "text"
+    if not quiet:
+        print(f"🔍 Interrogation de Milvus sur {args.host}:{args.port}...")
+
     try:
         # Se connecter à Milvus
-        connections.connect("default", host=MILVUS_HOST, port=MILVUS_PORT)
-        print("✅ Connexion à Milvus réussie.")
+        connections.connect("default", host=args.host, port=args.port)
+        if not quiet:
+            print("✅ Connexion à Milvus réussie.")
 
         # Vérifier si la collection existe
-        if not utility.has_collection(COLLECTION_NAME):
-            print(f"❌ La base de connaissances '{COLLECTION_NAME}' est VIDE.")
-            print("   Raison: La collection n'a même pas encore été créée.")
-            print("   💡 Lancez le script `scout_service.py` pour commencer à l'alimenter.")
-            return
+        if not utility.has_collection(args.collection):
+            print(f"❌ La base de connaissances '{args.collection}' est VIDE.", file=sys.stderr if quiet else sys.stdout)
+            if not quiet:
+                print("   Raison: La collection n'a même pas encore été créée.")
+                print("   💡 Lancez le script `scout_service.py` pour commencer à l'alimenter.")
+            return 1
 
-        # Obtenir les statistiques de la collection
-        stats = utility.get_collection_stats(COLLECTION_NAME)
-        entity_count = stats['row_count']
+        collection = Collection(args.collection)
+        if args.load and utility.load_state(args.collection).name != "Loaded":
+            collection.load()
+        status = collect_status(collection)
+        report = {"status": status, "advice": recommend_index(status)}
+        if not args.no_probe:
+            if status["load_state"] == "Loaded" and status["rows"]:
+                report["probe"] = probe_search_latency(collection, status, args.k, args.nprobe, args.ef, args.queries)
+            elif not quiet:
+                print("⚠️  Sonde de latence ignorée: collection vide ou non chargée.")
+        if args.baseline and report.get("probe"):
+            report["regressions"] = compare_with_baseline(report["probe"], args.baseline)
+    except Exception as e:
+        print(f"❌ ERREUR: Impossible de se connecter à Milvus: {e}", file=sys.stderr if quiet else sys.stdout)
+        if not quiet:
+            print("   Assurez-vous que votre stack Docker est bien démarrée (`docker-compose up -d`).")
+        return 2
 
-        print(f"✅ La base de connaissances '{COLLECTION_NAME}' existe.")
-        print(f"🧠 Elle contient actuellement : {entity_count} morceaux de connaissance (vecteurs).")
+    if args.format == "json":
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    elif args.format == "prometheus":
+        sys.stdout.write(to_prometheus(report))
+    else:
+        print_text(report)
 
-    except Exception as e:
-        print(f"❌ ERREUR: Impossible de se connecter à Milvus: {e}")
-        print("   Assurez-vous que votre stack Docker est bien démarrée (`docker-compose up -d`).")
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    # Code de sortie non nul en cas de régression: exploitable par cron/CI
+    return 3 if report.get("regressions") else 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# Fichier: chunk_dedup.py
+# Description: Élimination des morceaux quasi-dupliqués avant vectorisation.
+#              Signatures MinHash sur des shingles de mots et index LSH par bandes, persisté
+#              dans SQLite d'une exécution à l'autre (un même bulletin reçu plusieurs fois par un
+#              flux, ou les chevauchements du découpage, n'est vectorisé et stocké qu'une fois).
+#              L'index est cloisonné par source: un morceau n'est jamais écarté au profit de celui
+#              d'une autre source, qui vit dans une autre partition Milvus (filtres `--source`).
+#              Tient aussi le registre des documents entièrement insérés, qui ne fait foi que pour
+#              la collection Milvus à laquelle il est lié (voir bind_collection).
+
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import numpy as np
+
+# --- CONFIGURATION ---
+INDEX_PATH = "state/chunk_lsh.sqlite3"
+NUM_PERM = 128
+BANDS = 16             # 16 bandes x 8 lignes: candidats à partir d'une similarité de Jaccard ≈ 0.7
+SHINGLE_SIZE = 3       # Shingles de 3 mots
+THRESHOLD = 0.8        # Jaccard estimée au-delà de laquelle un morceau est un quasi-doublon
+SEED = 1               # Fixe: les signatures doivent rester comparables entre les exécutions
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+def _shingles(text, size=SHINGLE_SIZE):
+    words = re.sub(r"[^\w\s]", " ", text.lower()).split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+class MinHasher:
+    def __init__(self, num_perm=NUM_PERM, seed=SEED):
+        rng = np.random.RandomState(seed)
+        # a, b < 2^31 et hachés < 2^32: a*h + b tient dans un uint64 sans débordement
+        self.a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in _shingles(text)),
+            dtype=np.uint64,
+        )
+        permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+def _band_keys(signature, bands=BANDS, scope=""):
+    """Clés LSH des bandes; `scope` (la source) les préfixe pour cloisonner les candidats."""
+    rows = len(signature) // bands
+    prefix = scope.encode("utf-8") + b"\0"
+    return [
+        int.from_bytes(hashlib.blake2b(prefix + signature[i * rows:(i + 1) * rows].tobytes(), digest_size=8).digest(), "little", signed=True)
+        for i in range(bands)
+    ]
+
+def _scope(chunk):
+    return chunk.metadata.get("source") or ""
+
+def estimated_jaccard(sig_a, sig_b):
+    return float(np.mean(sig_a == sig_b))
+
+class ChunkDeduplicator:
+    """
+    `filter()` écarte les quasi-doublons (contre l'index persisté et entre eux) sans rien écrire;
+    `record()` n'enregistre les signatures qu'une fois les morceaux réellement stockés dans Milvus,
+    pour que l'index ne référence jamais un morceau absent de la base.
+    """
+
+    def __init__(self, path=INDEX_PATH, threshold=THRESHOLD, num_perm=NUM_PERM, bands=BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher(num_perm)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS signatures (id INTEGER PRIMARY KEY, doc_hash TEXT, chunk_index INTEGER, signature BLOB);
+            CREATE TABLE IF NOT EXISTS bands (band INTEGER, bucket INTEGER, signature_id INTEGER);
+            CREATE INDEX IF NOT EXISTS bands_lookup ON bands (band, bucket);
+            CREATE TABLE IF NOT EXISTS completed_documents (doc_hash TEXT PRIMARY KEY);
+        """)
+        params = json.dumps({"num_perm": num_perm, "bands": bands, "shingle_size": SHINGLE_SIZE, "seed": SEED, "scope": "source"})
+        stored = self.db.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if stored and stored[0] != params:
+            # Le registre des documents complets reste valable: il décrit Milvus, pas les signatures
+            print("♻️  [DEDUP] Paramètres MinHash modifiés: réinitialisation de l'index LSH.")
+            self._clear_signatures()
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('params', ?)", (params,))
+        self.db.commit()
+
+    def _clear_signatures(self):
+        self.db.execute("DELETE FROM signatures")
+        self.db.execute("DELETE FROM bands")
+        self.db.commit()
+
+    def reset(self):
+        """À appeler quand la collection Milvus est reconstruite."""
+        self._clear_signatures()
+        self.db.execute("DELETE FROM completed_documents")
+        self.db.execute("DELETE FROM meta WHERE key = 'collection_id'")
+        self.db.commit()
+
+    def bind_collection(self, collection_id, collection_is_empty):
+        """
+        Retourne True si le registre des documents complets fait foi pour cette collection: il lui est
+        déjà lié, ou elle est vide (il l'est alors trivialement et s'y lie). Un fichier perdu, recréé
+        ou venant d'une autre collection ne fait pas foi: aucun document ne doit être supprimé d'après lui.
+        """
+        stored = self.db.execute("SELECT value FROM meta WHERE key = 'collection_id'").fetchone()
+        if stored and stored[0] == collection_id:
+            return True
+        if not collection_is_empty:
+            return False
+        self.reset()
+        self.db.execute("INSERT INTO meta VALUES ('collection_id', ?)", (collection_id,))
+        self.db.commit()
+        return True
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def _stored_candidates(self, keys):
+        ids = set()
+        for band, bucket in enumerate(keys):
+            ids.update(row[0] for row in self.db.execute(
+                "SELECT signature_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)))
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        return [np.frombuffer(row[0], dtype=np.uint32)
+                for row in self.db.execute(f"SELECT signature FROM signatures WHERE id IN ({placeholders})", list(ids))]
+
+    def filter(self, chunks):
+        """Retourne (morceaux conservés, nombre de quasi-doublons écartés). Les signatures sont attachées aux métadonnées."""
+        kept, dropped = [], 0
+        pending = {} # (bande, bucket) -> signatures conservées pendant cette exécution
+        for chunk in chunks:
+            signature = self.hasher.signature(chunk.page_content)
+            keys = _band_keys(signature, self.bands, _scope(chunk))
+            candidates = self._stored_candidates(keys)
+            for band, bucket in enumerate(keys):
+                candidates.extend(pending.get((band, bucket), []))
+            if any(estimated_jaccard(signature, other) >= self.threshold for other in candidates):
+                dropped += 1
+                continue
+            for band, bucket in enumerate(keys):
+                pending.setdefault((band, bucket), []).append(signature)
+            chunk.metadata["_minhash"] = signature
+            kept.append(chunk)
+        return kept, dropped
+
+    def completed(self, doc_hashes):
+        """Sous-ensemble des documents dont tous les morceaux conservés ont été insérés."""
+        doc_hashes = list(doc_hashes)
+        found = set()
+        for i in range(0, len(doc_hashes), 500):
+            batch = doc_hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(row[0] for row in self.db.execute(
+                f"SELECT doc_hash FROM completed_documents WHERE doc_hash IN ({placeholders})", batch))
+        return found
+
+    def mark_completed(self, doc_hashes):
+        self.db.executemany("INSERT OR IGNORE INTO completed_documents VALUES (?)", [(h,) for h in doc_hashes])
+        self.db.commit()
+
+    def forget(self, doc_hashes):
+        """Retire les signatures de documents supprimés de Milvus (sinon leur réingestion serait vue comme doublon)."""
+        doc_hashes = list(doc_hashes)
+        for i in range(0, len(doc_hashes), 500):
+            batch = doc_hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            self.db.execute(f"DELETE FROM bands WHERE signature_id IN "
+                            f"(SELECT id FROM signatures WHERE doc_hash IN ({placeholders}))", batch)
+            self.db.execute(f"DELETE FROM signatures WHERE doc_hash IN ({placeholders})", batch)
+            self.db.execute(f"DELETE FROM completed_documents WHERE doc_hash IN ({placeholders})", batch)
+        self.db.commit()
+
+    def record(self, chunks):
+        """Enregistre les signatures des morceaux effectivement insérés dans Milvus."""
+        for chunk in chunks:
+            signature = chunk.metadata.pop("_minhash")
+            cursor = self.db.execute(
+                "INSERT INTO signatures (doc_hash, chunk_index, signature) VALUES (?, ?, ?)",
+                (chunk.metadata.get("doc_hash"), chunk.metadata.get("chunk_index"), signature.tobytes()))
+            self.db.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                                [(band, bucket, cursor.lastrowid) for band, bucket in enumerate(_band_keys(signature, self.bands, _scope(chunk)))])
+        self.db.commit()
@@ -1,8 +1,15 @@
 # Fichier: code_guardian_service.py
 # Description: Surveille les changements de code, valide, et automatise les commits sur GitHub.
 
+import os
+import re
+import json
 import time
+import hashlib
+import tempfile
+import threading
 import subprocess
+from functools import lru_cache
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
@@ -11,34 +18,220 @@ PROJECT_PATH = "." # Surveille le dossier courant
 GIT_REMOTE = "origin"
 GIT_BRANCH = "main"
 INACTIVITY_PERIOD_SECONDS = 300 # 5 minutes d'inactivité avant de déclencher
+BUILD_CACHE_FILE = ".guardian_build_cache.json" # Résultats de build par empreinte de l'arbre
+BUILD_CACHE_MAX_ENTRIES = 200
+
+# Dossiers toujours ignorés, en plus du .gitignore
+ALWAYS_IGNORED = [".git/", "bin/", "obj/", BUILD_CACHE_FILE]
+# Fichiers dont la modification impose une validation `dotnet build`
+BUILD_EXTENSIONS = {".cs", ".csproj", ".sln", ".props", ".targets", ".resx"}
+BUILD_FILENAMES = {"appsettings.json", "global.json", "nuget.config", "directory.build.props"}
+
+
+def _translate_gitignore_pattern(pattern):
+    """Convertit un motif .gitignore en expression régulière sur un chemin relatif POSIX."""
+    anchored = pattern.startswith("/") or "/" in pattern.rstrip("/")
+    pattern = pattern.strip("/")
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(pattern[i])
+                i += 1
+            else:
+                regex += "[" + pattern[i + 1:end].replace("!", "^", 1) + "]"
+                i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    prefix = "^" if anchored else "^(?:.*/)?"
+    # Un motif qui correspond à un dossier couvre aussi tout son contenu
+    return re.compile(prefix + regex + "(?:/.*)?$")
+
+
+class IgnoreMatcher:
+    """Matcher compilé une seule fois à partir du .gitignore (dernier motif correspondant gagnant)."""
+
+    def __init__(self, root, extra_patterns=()):
+        self.root = os.path.abspath(root)
+        lines = list(extra_patterns)
+        gitignore = os.path.join(self.root, ".gitignore")
+        if os.path.exists(gitignore):
+            with open(gitignore, "r", encoding="utf-8", errors="ignore") as f:
+                lines.extend(f.read().splitlines())
+
+        self.rules = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            self.rules.append((_translate_gitignore_pattern(line), negated))
+        self.is_ignored = lru_cache(maxsize=8192)(self._is_ignored)
+
+    def relative(self, path):
+        rel = os.path.relpath(os.path.abspath(path), self.root)
+        return rel.replace(os.sep, "/")
+
+    def _is_ignored(self, rel_path):
+        if rel_path.startswith(".."):
+            return True
+        ignored = False
+        for regex, negated in self.rules:
+            if regex.match(rel_path):
+                ignored = not negated
+        return ignored
+
+
+def needs_build(rel_path):
+    """Indique si une modification de ce fichier peut casser la build .NET."""
+    name = rel_path.rsplit("/", 1)[-1].lower()
+    return os.path.splitext(name)[1] in BUILD_EXTENSIONS or name in BUILD_FILENAMES
+
 
 class ChangeHandler(FileSystemEventHandler):
-    """Détecte les changements et gère le timer d'inactivité."""
-    def __init__(self):
-        self.last_modified = time.time()
+    """Regroupe les événements en un ensemble de changements dédupliqué et gère le timer d'inactivité."""
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.changes = set()
+        self.last_modified = None
+        self.condition = threading.Condition()
 
     def on_any_event(self, event):
-        # Ignorer les changements dans les dossiers de cache ou de build
-        if "/bin/" in event.src_path or "/obj/" in event.src_path or ".git" in event.src_path:
+        if event.is_directory:
             return
-        
-        print(f"   [GARDIEN] Changement détecté: {event.src_path}")
-        self.last_modified = time.time()
+        paths = [event.src_path, getattr(event, "dest_path", None)]
+        relevant = [rel for rel in (self.matcher.relative(p) for p in paths if p) if not self.matcher.is_ignored(rel)]
+        if not relevant:
+            return
+
+        with self.condition:
+            new_paths = [rel for rel in relevant if rel not in self.changes]
+            self.changes.update(relevant)
+            self.last_modified = time.time()
+            self.condition.notify()
+        # Les rafales de sauvegarde d'un éditeur ne sont journalisées qu'une fois par fichier
+        for rel in new_paths:
+            print(f"   [GARDIEN] Changement détecté: {rel}")
 
-def run_command(command):
-    """Exécute une commande shell et retourne le succès et la sortie."""
+    def wait_for_quiet_period(self, quiet_seconds):
+        """Bloque jusqu'à ce qu'un changement ait été suivi de `quiet_seconds` d'inactivité, puis vide l'ensemble."""
+        with self.condition:
+            while True:
+                if self.last_modified is None:
+                    # Attente bornée pour rester interruptible (Ctrl+C)
+                    self.condition.wait(timeout=60)
+                    continue
+                remaining = self.last_modified + quiet_seconds - time.time()
+                if remaining <= 0:
+                    changes = self.changes
+                    self.changes = set()
+                    self.last_modified = None
+                    return changes
+                self.condition.wait(timeout=remaining)
+
+def run_command(command, env=None):
+    """Exécute une commande (liste d'arguments, sans shell) et retourne le succès et la sortie."""
     print(f"   [GARDIEN] Exécution: '{' '.join(command)}'")
-    result = subprocess.run(command, capture_output=True, text=True, shell=True)
+    try:
+        # Pas de shell=True: sous POSIX, seul le premier élément de la liste serait exécuté
+        result = subprocess.run(command, capture_output=True, text=True, env=env)
+    except OSError as e:
+        print(f"   ❌ [GARDIEN] Commande introuvable ou non exécutable: {e}")
+        return False, str(e)
     if result.returncode != 0:
         print(f"   ❌ [GARDIEN] Échec de la commande. Erreur:\n{result.stderr}")
         return False, result.stderr
     return True, result.stdout
 
+def compute_build_key():
+    """
+    Empreinte des seuls fichiers influençant la build, calculée depuis l'arbre Git du
+    dossier de travail (via un index temporaire, donc sans toucher à l'index réel).
+    """
+    fd, index_path = tempfile.mkstemp(prefix="guardian_index_")
+    os.close(fd)
+    os.remove(index_path)
+    env = dict(os.environ, GIT_INDEX_FILE=index_path)
+    try:
+        ok, _ = run_command(["git", "add", "-A"], env=env)
+        ok_tree, tree = run_command(["git", "write-tree"], env=env) if ok else (False, "")
+        ok_ls, listing = run_command(["git", "ls-tree", "-r", tree.strip()], env=env) if ok_tree else (False, "")
+    finally:
+        if os.path.exists(index_path):
+            os.remove(index_path)
+    if not ok_ls:
+        print("   ⚠️ [GARDIEN] Empreinte de l'arbre Git impossible à calculer: cache de build désactivé pour cette validation.")
+        return None
+
+    digest = hashlib.sha256()
+    for line in sorted(listing.splitlines()):
+        # Format: "<mode> blob <sha>\t<chemin>"
+        path = line.split("\t", 1)[-1]
+        if needs_build(path):
+            digest.update(line.encode("utf-8"))
+            digest.update(b"\n")
+    return digest.hexdigest()
+
+def load_build_cache():
+    try:
+        with open(BUILD_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_build_cache(cache):
+    # Conserver uniquement les entrées les plus récentes
+    entries = sorted(cache.items(), key=lambda kv: kv[1].get("checked_at", 0))[-BUILD_CACHE_MAX_ENTRIES:]
+    tmp_path = BUILD_CACHE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(entries), f, indent=2)
+    os.replace(tmp_path, BUILD_CACHE_FILE)
+
+def validate_build(change_set, build_cache):
+    """Lance `dotnet build` seulement si nécessaire. Retourne True si le commit est autorisé."""
+    build_changes = sorted(p for p in change_set if needs_build(p))
+    if not build_changes:
+        print("   [GARDIEN] Aucun fichier de build modifié (docs, scripts...). Build ignorée.")
+        return True
+
+    build_key = compute_build_key()
+    cached = build_cache.get(build_key) if build_key else None
+    if cached is not None:
+        status = "réussie" if cached["success"] else "échouée"
+        print(f"   [GARDIEN] Arbre déjà vérifié ({build_key[:12]}): build {status} en cache.")
+        return cached["success"]
+
+    print(f"   [GARDIEN] Validation de la build .NET ({len(build_changes)} fichier(s) concerné(s))...")
+    build_success, _ = run_command(["dotnet", "build"])
+    if build_key:
+        build_cache[build_key] = {"success": build_success, "checked_at": time.time()}
+        save_build_cache(build_cache)
+    return build_success
+
 def main():
     """Boucle principale du Gardien du Code."""
     print("🛡️  Démarrage du Gardien Autonome du Code...")
-    
-    event_handler = ChangeHandler()
+
+    matcher = IgnoreMatcher(PROJECT_PATH, ALWAYS_IGNORED)
+    build_cache = load_build_cache()
+    event_handler = ChangeHandler(matcher)
     observer = Observer()
     observer.schedule(event_handler, PROJECT_PATH, recursive=True)
     observer.start()
@@ -48,48 +241,43 @@ def main():
 
     try:
         while True:
-            time_since_last_change = time.time() - event_handler.last_modified
-            
-            if time_since_last_change > INACTIVITY_PERIOD_SECONDS:
-                print("\n" + "="*50)
-                print("⏳ [GARDIEN] Période d'inactivité détectée. Démarrage du cycle de sauvegarde.")
-                
-                # 1. Vérifier s'il y a des changements à commiter
-                success, output = run_command(["git", "status", "--porcelain"])
-                if not success or not output:
-                    print("👍 [GARDIEN] Aucune modification détectée. Retour en mode surveillance.")
-                    event_handler.last_modified = time.time() # Reset timer
-                    time.sleep(60)
-                    continue
+            change_set = event_handler.wait_for_quiet_period(INACTIVITY_PERIOD_SECONDS)
 
-                # 2. Valider la build locale
-                print("   [GARDIEN] Validation de la build .NET...")
-                build_success, _ = run_command(["dotnet", "build"])
-                if not build_success:
-                    print("   ❌ [GARDIEN] Build échouée. Le commit est annulé pour préserver l'intégrité de la branche.")
-                    event_handler.last_modified = time.time() # Reset timer
-                    continue
-                
-                # 3. Ajouter, Commiter et Pousser
-                print("   [GARDIEN] Build réussie. Préparation du commit...")
-                run_command(["git", "add", "."])
-                
-                commit_message = f"feat(auto): Sauvegarde autonome du {time.strftime('%Y-%m-%d %H:%M:%S')}"
-                run_command(["git", "commit", "-m", commit_message])
-                
-                print("   [GARDIEN] Envoi des modifications vers GitHub...")
-                push_success, _ = run_command(["git", "push", GIT_REMOTE, GIT_BRANCH])
-                
-                if push_success:
-                    print("✅ [GARDIEN] Sauvegarde sur GitHub réussie. Retour en mode surveillance.")
-                
-                event_handler.last_modified = time.time() # Reset timer
-
-            time.sleep(10)
+            print("\n" + "="*50)
+            print(f"⏳ [GARDIEN] Période d'inactivité détectée ({len(change_set)} fichier(s) modifié(s)). Démarrage du cycle de sauvegarde.")
+
+            # 1. Vérifier s'il y a des changements à commiter
+            success, output = run_command(["git", "status", "--porcelain"])
+            if not success or not output:
+                print("👍 [GARDIEN] Aucune modification détectée. Retour en mode surveillance.")
+                continue
+            # Les changements non vus par le watcher (ex: avant démarrage) comptent aussi
+            for line in output.splitlines():
+                path = line[3:].split(" -> ")[-1].strip('"')
+                if not matcher.is_ignored(path):
+                    change_set.add(path)
+
+            # 2. Valider la build locale si le change set le requiert
+            if not validate_build(change_set, build_cache):
+                print("   ❌ [GARDIEN] Build échouée. Le commit est annulé pour préserver l'intégrité de la branche.")
+                continue
+
+            # 3. Ajouter, Commiter et Pousser
+            print("   [GARDIEN] Validation réussie. Préparation du commit...")
+            run_command(["git", "add", "."])
+
+            commit_message = f"feat(auto): Sauvegarde autonome du {time.strftime('%Y-%m-%d %H:%M:%S')}"
+            run_command(["git", "commit", "-m", commit_message])
+
+            print("   [GARDIEN] Envoi des modifications vers GitHub...")
+            push_success, _ = run_command(["git", "push", GIT_REMOTE, GIT_BRANCH])
+
+            if push_success:
+                print("✅ [GARDIEN] Sauvegarde sur GitHub réussie. Retour en mode surveillance.")
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
     print("\n🛡️  Gardien du Code arrêté.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -4,12 +4,17 @@
 import json
 from kafka import KafkaConsumer
 from datetime import datetime
+from instrumentation import get_logger, counter, span, start_metrics_server
 
 # --- CONFIGURATION ---
 KAFKA_BOOTSTRAP_SERVERS = 'kafka:9092' # Adresse interne Docker
 EVENTS_TOPIC = 'system_events'
 ARCHIVE_FILE = '/archive/cognitive_archive.md'
 
+log = get_logger("cognitive_archive")
+ARCHIVED_EVENTS = counter("archive_events", "Événements archivés par type.", ("type",))
+
+@span("archive_write")
 def write_to_archive(event_data):
     """Écrit un événement formaté dans le fichier d'archive."""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -29,13 +34,16 @@ def write_to_archive(event_data):
             f.write(f"- **Solution Appliquée:** {details['solution']}\n")
         if 'error' in details:
             f.write(f"- **Erreur Détaillée:** ```\n{details['error']}\n```\n")
+        if 'evidence' in details:
+            f.write(f"- **Preuves Statistiques:** ```json\n{json.dumps(details['evidence'], indent=2, ensure_ascii=False)}\n```\n")
             
         f.write("\n---\n\n")
 
 def main():
     """Point d'entrée du service d'archivage."""
-    print("📖 Démarrage du Cognitive Archive Service...")
-    
+    log.info("📖 Démarrage du Cognitive Archive Service...")
+    start_metrics_server()
+
     consumer = KafkaConsumer(
         EVENTS_TOPIC,
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
@@ -44,12 +52,14 @@ def main():
         value_deserializer=lambda v: json.loads(v.decode('utf-8'))
     )
 
-    print(f"✅ Abonné au topic d'événements '{EVENTS_TOPIC}'. En attente d'événements...")
+    log.info("✅ Abonné au topic d'événements. En attente d'événements...", topic=EVENTS_TOPIC)
 
     for message in consumer:
         event_data = message.value
-        print(f"✍️ Nouvel événement reçu: {event_data.get('type')}")
+        event_type = str(event_data.get('type', 'INCONNU')).upper()
+        log.info("✍️ Nouvel événement reçu.", type=event_type, service=event_data.get('service'))
         write_to_archive(event_data)
+        ARCHIVED_EVENTS.labels(type=event_type).inc()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
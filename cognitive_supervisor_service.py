@@ -4,10 +4,21 @@
 import time
 import json
 from kafka import KafkaProducer
+from ecosystem_health import (
+    HealthProbeEngine, KafkaLagProbe, MilvusProbe, HttpHealthProbe, HeartbeatFreshnessProbe, STATUS_OK, STATUS_DOWN,
+)
 
 # --- CONFIGURATION ---
 KAFKA_BOOTSTRAP_SERVERS = 'kafka:9092'
 META_PROMPT_TOPIC = 'meta_cognitive_prompts' # Topic pour envoyer les objectifs au Meta-Prompter
+MONITORED_CONSUMER_GROUPS = ['knowledge-ingester-group', 'cognitive-archive-group', 'meta-prompter-group']
+MILVUS_HOST = "milvus"
+MILVUS_PORT = "19530"
+COLLECTION_NAME = "medical_knowledge_base"
+CSHARP_HEALTH_URL = "http://gemini-consumer-app:8080/health"
+SCOUT_HEARTBEAT_FILE = "state/scout_heartbeat.json" # Écrit par scout_service.py à chaque cycle
+SCOUT_CYCLE_SECONDS = 300
+HEALTH_RETRY_SECONDS = 600 # Nouveau bilan si un composant est hors service
 
 # Liste des objectifs d'amélioration "Jamais Vus"
 GOAL_PIPELINE = [
@@ -18,18 +29,22 @@ GOAL_PIPELINE = [
     "Comment puis-je modifier le federated_aggregator_central.py pour utiliser un algorithme d'agrégation plus avancé que FedAvg, comme FedAdam, pour une convergence plus rapide du modèle global ?"
 ]
 
-def get_ecosystem_health_report():
-    """Simule une analyse complète de l'écosystème."""
-    # Dans un vrai système, ce module se connecterait à Docker, Kafka, Milvus, etc.
-    # pour obtenir leur statut.
+# Sondes créées une seule fois: leurs clients et leur cache TTL survivent d'un bilan à l'autre
+HEALTH_ENGINE = HealthProbeEngine([
+    MilvusProbe(MILVUS_HOST, MILVUS_PORT, COLLECTION_NAME, timeout=5.0, ttl=60.0),
+    KafkaLagProbe(KAFKA_BOOTSTRAP_SERVERS, MONITORED_CONSUMER_GROUPS, timeout=5.0, ttl=30.0),
+    HttpHealthProbe("csharp_api_service", CSHARP_HEALTH_URL, timeout=3.0, ttl=15.0),
+    HeartbeatFreshnessProbe("scout_service", SCOUT_HEARTBEAT_FILE, SCOUT_CYCLE_SECONDS),
+])
+
+def get_ecosystem_health_report(engine=HEALTH_ENGINE):
+    """Sonde tous les composants de l'écosystème en parallèle."""
     print("📊 [SUPERVISOR] Génération du bilan de santé complet de l'écosystème...")
-    report = {
-        "milvus_knowledge_base": {"status": "OK", "entities": 127},
-        "kafka_bus": {"status": "OK", "lag": 0},
-        "csharp_api_service": {"status": "OK", "version": "1.2.0"},
-        "scout_service": {"status": "OK", "last_run": "2025-11-07T14:00:00Z"}
-    }
-    print("✅ [SUPERVISOR] Bilan de santé: Tout est opérationnel.")
+    report = engine.sweep_sync()
+    for name, component in report["components"].items():
+        icon = "✅" if component["status"] == STATUS_OK else "⚠️ " if component["status"] != STATUS_DOWN else "❌"
+        print(f"   {icon} {name}: {component['status']} ({component['latency_ms']} ms) {json.dumps(component['details'], ensure_ascii=False)}")
+    print(f"{'✅' if report['overall'] == STATUS_OK else '⚠️ '} [SUPERVISOR] Bilan de santé: {report['overall']} (en {report['duration_ms']} ms).")
     return report
 
 def main():
@@ -45,6 +60,12 @@ def main():
     while True:
         # 1. Faire un bilan complet
         health_report = get_ecosystem_health_report()
+        down = [name for name, c in health_report["components"].items() if c["status"] == STATUS_DOWN]
+        if down:
+            # Pas de nouvel objectif d'amélioration sur un écosystème en panne
+            print(f"🛑 [SUPERVISOR] Composants hors service: {', '.join(down)}. Nouveau bilan dans {HEALTH_RETRY_SECONDS // 60} minutes.")
+            time.sleep(HEALTH_RETRY_SECONDS)
+            continue
         
         # 2. Se fixer un nouvel objectif
         if goal_index >= len(GOAL_PIPELINE):
@@ -58,7 +79,8 @@ def main():
         # 3. Envoyer l'objectif au Meta-Prompter pour qu'il demande de l'aide à Gemini
         prompt_event = {
             "goal_id": f"GOAL-{goal_index + 1}",
-            "prompt_for_gemini": new_goal
+            "prompt_for_gemini": new_goal,
+            "ecosystem_health": health_report
         }
         producer.send(META_PROMPT_TOPIC, value=prompt_event)
         producer.flush()
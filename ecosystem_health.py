@@ -0,0 +1,197 @@
+# Fichier: ecosystem_health.py
+# Description: Moteur de sondes de santé de l'écosystème (asyncio).
+#              Chaque sonde a son propre timeout et un petit cache TTL; un balayage complet
+#              exécute toutes les sondes en parallèle et dure environ le temps de la plus lente.
+
+import json
+import time
+import asyncio
+import concurrent.futures
+from datetime import datetime, timezone
+
+STATUS_OK = "OK"
+STATUS_UNKNOWN = "UNKNOWN"
+STATUS_DEGRADED = "DEGRADED"
+STATUS_DOWN = "DOWN"
+SEVERITY = {STATUS_OK: 0, STATUS_UNKNOWN: 1, STATUS_DEGRADED: 2, STATUS_DOWN: 3}
+
+# Les clients Kafka/Milvus sont bloquants: ils tournent dans ce pool, hors de la boucle asyncio
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="health-probe")
+
+def _utc_now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+class HealthProbe:
+    """Sonde de base. `check()` retourne (statut, détails); `run()` ajoute timeout, cache et mesure."""
+
+    def __init__(self, name, timeout=5.0, ttl=30.0):
+        self.name = name
+        self.timeout = timeout
+        self.ttl = ttl
+        self._cached = None
+        self._cached_at = 0.0
+
+    async def check(self):
+        raise NotImplementedError
+
+    async def run(self):
+        if self._cached is not None and time.monotonic() - self._cached_at < self.ttl:
+            return {**self._cached, "cached": True}
+
+        started = time.perf_counter()
+        try:
+            status, details = await asyncio.wait_for(self.check(), self.timeout)
+        except asyncio.TimeoutError:
+            status, details = STATUS_DOWN, {"error": f"Pas de réponse en {self.timeout}s."}
+        except Exception as e:
+            status, details = STATUS_DOWN, {"error": f"{type(e).__name__}: {e}"}
+
+        self._cached = {
+            "status": status,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "checked_at": _utc_now(),
+            "details": details,
+        }
+        self._cached_at = time.monotonic()
+        return {**self._cached, "cached": False}
+
+class BlockingProbe(HealthProbe):
+    """
+    Sonde dont la vérification est un appel bloquant exécuté dans le pool de threads.
+    Un appel qui a dépassé son timeout continue en arrière-plan: on le réattend au lieu
+    d'en relancer un second qui partagerait les mêmes clients.
+    """
+
+    def __init__(self, name, timeout=5.0, ttl=30.0):
+        super().__init__(name, timeout, ttl)
+        self._pending = None
+
+    def check_blocking(self):
+        raise NotImplementedError
+
+    async def check(self):
+        if self._pending is None or self._pending.done():
+            self._pending = _EXECUTOR.submit(self.check_blocking)
+        return await asyncio.shield(asyncio.wrap_future(self._pending))
+
+class KafkaLagProbe(BlockingProbe):
+    """Lag total (fin de partition - offset commité) de chaque groupe de consommateurs."""
+
+    def __init__(self, bootstrap_servers, group_ids, degraded_lag=1000, timeout=5.0, ttl=30.0):
+        super().__init__("kafka_bus", timeout, ttl)
+        self.bootstrap_servers = bootstrap_servers
+        self.group_ids = list(group_ids)
+        self.degraded_lag = degraded_lag
+        self._admin = None
+        self._consumer = None
+
+    def _clients(self):
+        if self._admin is None:
+            from kafka import KafkaAdminClient, KafkaConsumer
+            request_timeout_ms = int(self.timeout * 1000)
+            self._admin = KafkaAdminClient(bootstrap_servers=self.bootstrap_servers, request_timeout_ms=request_timeout_ms)
+            self._consumer = KafkaConsumer(bootstrap_servers=self.bootstrap_servers, request_timeout_ms=request_timeout_ms)
+        return self._admin, self._consumer
+
+    def check_blocking(self):
+        try:
+            admin, consumer = self._clients()
+            groups = {}
+            for group_id in self.group_ids:
+                committed = admin.list_consumer_group_offsets(group_id)
+                end_offsets = consumer.end_offsets(list(committed)) if committed else {}
+                groups[group_id] = sum(max(0, end_offsets[tp] - meta.offset) for tp, meta in committed.items() if meta.offset >= 0)
+        except Exception:
+            # Clients recréés au prochain essai (broker redémarré, connexion perdue...)
+            self._admin = self._consumer = None
+            raise
+        total = sum(groups.values())
+        return (STATUS_DEGRADED if total > self.degraded_lag else STATUS_OK), {"lag": total, "groups": groups}
+
+class MilvusProbe(BlockingProbe):
+    """Existence, taille et état de chargement de la collection de connaissances."""
+
+    def __init__(self, host, port, collection_name, timeout=5.0, ttl=60.0):
+        super().__init__("milvus_knowledge_base", timeout, ttl)
+        self.host = host
+        self.port = port
+        self.collection_name = collection_name
+        self._connected = False
+
+    def check_blocking(self):
+        from pymilvus import connections, utility, Collection
+        if not self._connected:
+            connections.connect("health", host=self.host, port=self.port, timeout=self.timeout)
+            self._connected = True
+        try:
+            if not utility.has_collection(self.collection_name, using="health", timeout=self.timeout):
+                return STATUS_DOWN, {"error": f"Collection '{self.collection_name}' absente."}
+            entities = Collection(self.collection_name, using="health").num_entities
+            load_state = utility.load_state(self.collection_name, using="health", timeout=self.timeout).name
+        except Exception:
+            self._connected = False
+            raise
+        status = STATUS_OK if load_state == "Loaded" and entities else STATUS_DEGRADED
+        return status, {"entities": entities, "load_state": load_state}
+
+class HttpHealthProbe(HealthProbe):
+    """Endpoint de health check ASP.NET Core: corps "Healthy", "Degraded" ou "Unhealthy"."""
+
+    def __init__(self, name, url, timeout=3.0, ttl=15.0):
+        super().__init__(name, timeout, ttl)
+        self.url = url
+
+    async def check(self):
+        import httpx
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(self.url)
+        body = response.text.strip()
+        if response.status_code == 200:
+            status = STATUS_DEGRADED if body == "Degraded" else STATUS_OK
+        else:
+            status = STATUS_DOWN
+        return status, {"http_status": response.status_code, "body": body[:200]}
+
+class HeartbeatFreshnessProbe(HealthProbe):
+    """Fraîcheur d'un fichier de battement de cœur JSON écrit par un service à chaque cycle."""
+
+    def __init__(self, name, path, expected_interval_s, timeout=1.0, ttl=15.0):
+        super().__init__(name, timeout, ttl)
+        self.path = path
+        self.expected_interval_s = expected_interval_s
+
+    async def check(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                heartbeat = json.load(f)
+        except FileNotFoundError:
+            return STATUS_UNKNOWN, {"error": f"Aucun battement de cœur dans '{self.path}'."}
+        last_run = datetime.fromisoformat(heartbeat["last_run"].replace("Z", "+00:00"))
+        age = (datetime.now(timezone.utc) - last_run).total_seconds()
+        if age > 6 * self.expected_interval_s:
+            status = STATUS_DOWN
+        elif age > 2 * self.expected_interval_s:
+            status = STATUS_DEGRADED
+        else:
+            status = STATUS_OK
+        return status, {**heartbeat, "age_seconds": round(age)}
+
+class HealthProbeEngine:
+    def __init__(self, probes):
+        self.probes = list(probes)
+
+    async def sweep(self):
+        """Exécute toutes les sondes en parallèle et agrège un rapport structuré."""
+        started = time.perf_counter()
+        results = await asyncio.gather(*(probe.run() for probe in self.probes))
+        components = {probe.name: result for probe, result in zip(self.probes, results)}
+        overall = max((c["status"] for c in components.values()), key=SEVERITY.__getitem__, default=STATUS_UNKNOWN)
+        return {
+            "generated_at": _utc_now(),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "overall": overall,
+            "components": components,
+        }
+
+    def sweep_sync(self):
+        return asyncio.run(self.sweep())
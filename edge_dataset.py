@@ -0,0 +1,134 @@
+# Fichier: edge_dataset.py
+# Description: Préparation des données d'entraînement Edge: tokenisation multiprocessus unique,
+#              cache Arrow memory-mappé indexé par (tokenizer, données, paramètres), puis
+#              packing à la longueur de contexte ou padding dynamique par longueur.
+
+import os
+import time
+import hashlib
+from datasets import load_dataset, load_from_disk
+from transformers import DataCollatorWithPadding, default_data_collator
+
+# --- CONFIGURATION ---
+CACHE_DIR = "./.cache/edge_datasets"
+PIPELINE_VERSION = "1" # À incrémenter si le formatage ou la tokenisation change
+NUM_PROC = max(1, min(8, (os.cpu_count() or 2) - 1))
+PAD_TO_MULTIPLE_OF = 8
+
+def format_example(example):
+    return f"### Diagnostic:\n{example['diagnostic_text']}\n\n### Recommandation:\n{example['ia_guidance']}"
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _tokenizer_digest(tokenizer):
+    # Le vocabulaire et les règles du tokenizer rapide suffisent à l'identifier
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    identity = backend.to_str() if backend is not None else f"{tokenizer.name_or_path}:{len(tokenizer)}"
+    identity += f"|eos={tokenizer.eos_token}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+def cache_key(tokenizer, data_path, max_length, pack):
+    parts = [PIPELINE_VERSION, _tokenizer_digest(tokenizer), _file_digest(data_path), str(max_length), "pack" if pack else "pad"]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:24]
+
+def _pack_blocks(batch, max_length):
+    """Concatène les séquences (séparées par EOS) et les découpe en blocs pleins de `max_length` tokens."""
+    concatenated = [token for ids in batch["input_ids"] for token in ids]
+    usable = (len(concatenated) // max_length) * max_length
+    blocks = [concatenated[i:i + max_length] for i in range(0, usable, max_length)]
+    return {"input_ids": blocks, "attention_mask": [[1] * max_length for _ in blocks], "labels": [list(b) for b in blocks]}
+
+def build_tokenized_dataset(tokenizer, data_path, max_length=512, pack=True, num_proc=NUM_PROC, cache_dir=CACHE_DIR):
+    """
+    Retourne le dataset tokenisé prêt pour le Trainer. Le premier appel tokenise et écrit
+    le cache Arrow; les suivants le rouvrent en memory-map (aucune retokenisation, RAM minimale).
+    """
+    path = os.path.join(cache_dir, cache_key(tokenizer, data_path, max_length, pack))
+    if os.path.exists(path):
+        dataset = load_from_disk(path)
+        print(f"⚡ Dataset tokenisé trouvé en cache ({len(dataset)} séquences): {path}")
+        return dataset
+
+    started = time.perf_counter()
+    raw = load_dataset("csv", data_files=data_path)["train"]
+    eos = tokenizer.eos_token or ""
+
+    def tokenize(batch):
+        texts = [format_example({"diagnostic_text": d, "ia_guidance": g}) + eos
+                 for d, g in zip(batch["diagnostic_text"], batch["ia_guidance"])]
+        # En mode packing on ne tronque pas: les longs exemples se répartissent sur plusieurs blocs
+        encoded = tokenizer(texts, truncation=not pack, max_length=None if pack else max_length)
+        encoded["length"] = [len(ids) for ids in encoded["input_ids"]]
+        return encoded
+
+    dataset = raw.map(tokenize, batched=True, num_proc=num_proc, remove_columns=raw.column_names,
+                      desc="Tokenisation")
+    total_tokens = sum(dataset["length"])
+
+    if pack:
+        dataset = dataset.map(_pack_blocks, batched=True, num_proc=num_proc, fn_kwargs={"max_length": max_length},
+                              remove_columns=dataset.column_names, desc="Packing")
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {total_tokens} tokens préparés en {elapsed:.1f}s ({total_tokens / max(elapsed, 1e-9):,.0f} tokens/s, {num_proc} processus).")
+    if pack:
+        kept = len(dataset) * max_length
+        print(f"   Packing: {len(dataset)} blocs de {max_length} tokens, 0 token de padding ({total_tokens - kept} tokens de fin écartés).")
+        if not len(dataset):
+            # Un dataset vide ne se relit pas depuis le disque: pas de mise en cache
+            print(f"   [WARN] Moins de {max_length} tokens au total: aucun bloc complet. Réduisez max_length ou désactivez le packing.")
+            return dataset
+
+    # Écriture puis réouverture: le dataset retourné est memory-mappé depuis le cache
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    dataset.save_to_disk(tmp_path)
+    os.replace(tmp_path, path)
+    return load_from_disk(path)
+
+class PaddingCollator:
+    """
+    Padding dynamique au plus long du batch. Les labels sont masqués d'après attention_mask et non
+    d'après pad_token_id: le pad_token vaut souvent EOS, qui doit rester appris pour savoir s'arrêter.
+    """
+
+    def __init__(self, tokenizer, pad_to_multiple_of=PAD_TO_MULTIPLE_OF):
+        self.padder = DataCollatorWithPadding(tokenizer, pad_to_multiple_of=pad_to_multiple_of, return_tensors="pt")
+
+    def __call__(self, features):
+        batch = self.padder([{"input_ids": f["input_ids"], "attention_mask": f["attention_mask"]} for f in features])
+        labels = batch["input_ids"].clone()
+        labels[batch["attention_mask"] == 0] = -100
+        batch["labels"] = labels
+        return batch
+
+def build_data_collator(tokenizer, pack):
+    """Blocs packés: simple empilement (labels déjà prêts). Sinon: padding dynamique au plus long du batch."""
+    if pack:
+        # Pas de masquage des labels: le pad_token vaut souvent EOS, qui sépare ici les exemples
+        return default_data_collator
+    return PaddingCollator(tokenizer)
+
+def count_tokens(dataset, pack):
+    """Nombre de tokens réellement vus par le modèle en une époque."""
+    if pack:
+        return len(dataset) * len(dataset[0]["input_ids"]) if len(dataset) else 0
+    return sum(dataset["length"])
+
+def padding_efficiency(dataset, batch_size, pack):
+    """Part de tokens utiles attendue par batch (1.0 en packing; estimée par tri en longueur sinon)."""
+    if pack:
+        return 1.0
+    lengths = sorted(dataset["length"])
+    useful = padded = 0
+    for i in range(0, len(lengths), batch_size):
+        group = lengths[i:i + batch_size]
+        longest = -(-max(group) // PAD_TO_MULTIPLE_OF) * PAD_TO_MULTIPLE_OF
+        useful += sum(group)
+        padded += longest * len(group)
+    return useful / padded if padded else 1.0
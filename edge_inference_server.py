@@ -0,0 +1,281 @@
+# Fichier: edge_inference_server.py
+# Description: Service d'inférence CPU pour le modèle Edge fine-tuné (./fine_tuned_gemma_medical).
+#              Modèle chargé une seule fois (fusion LoRA et quantification int8 dynamique optionnelles),
+#              requêtes concurrentes regroupées en micro-batchs dans un budget de latence,
+#              tokens streamés au fil du décodage incrémental (cache KV réutilisé à chaque pas).
+
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import statistics
+import torch
+from flask import Flask, Response, request, jsonify
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+# --- CONFIGURATION ---
+MODEL_DIR = "./fine_tuned_gemma_medical"
+MAX_BATCH_SIZE = 8          # Requêtes décodées ensemble
+MAX_BATCH_WAIT_MS = 15      # Attente maximale pour compléter un micro-batch après la 1re requête
+DEFAULT_MAX_NEW_TOKENS = 128
+MAX_PROMPT_TOKENS = 1024
+SERVER_PORT = 8090
+
+app = Flask(__name__)
+
+def load_model(model_dir, merge_lora=True, quantize_int8=False, threads=None):
+    """Charge le modèle une seule fois. Un dossier d'adaptateurs LoRA est chargé avec sa base."""
+    if threads:
+        torch.set_num_threads(threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left" # Les prompts se terminent tous au même index: décodage aligné
+
+    if os.path.exists(os.path.join(model_dir, "adapter_config.json")):
+        from peft import AutoPeftModelForCausalLM
+        model = AutoPeftModelForCausalLM.from_pretrained(model_dir, torch_dtype=torch.float32)
+        if merge_lora:
+            # Fusion des adaptateurs dans les poids de base: plus aucun surcoût LoRA à l'inférence
+            model = model.merge_and_unload()
+    else:
+        model = AutoModelForCausalLM.from_pretrained(model_dir, torch_dtype=torch.float32)
+    model.eval()
+
+    if quantize_int8:
+        # Quantification dynamique: poids des couches Linear en int8, activations quantifiées à la volée
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model, tokenizer
+
+class GenerationRequest:
+    def __init__(self, prompt, max_new_tokens):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.tokens = queue.Queue() # Morceaux de texte streamés, None en fin de génération
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.generated_tokens = 0
+        self.error = None # Renseigné si le micro-batch a échoué avant la fin de cette requête
+
+    def stream(self):
+        while True:
+            piece = self.tokens.get()
+            if piece is None:
+                if self.error:
+                    # En streaming, l'exception interrompt la réponse: le client voit un flux incomplet
+                    raise RuntimeError(self.error)
+                return
+            yield piece
+
+    def result(self):
+        return "".join(self.stream())
+
+class MicroBatchingEngine:
+    """
+    Un seul thread exécute le modèle. Il attend une requête, complète le micro-batch pendant
+    au plus `max_wait_ms`, puis décode tout le batch pas à pas en réutilisant le cache KV.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.pending = queue.Queue()
+        self.batch_sizes = []
+        threading.Thread(target=self._run, name="micro-batcher", daemon=True).start()
+
+    def submit(self, prompt, max_new_tokens=DEFAULT_MAX_NEW_TOKENS):
+        req = GenerationRequest(prompt, max(1, max_new_tokens))
+        self.pending.put(req)
+        return req
+
+    def _collect_batch(self):
+        batch = [self.pending.get()]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            self.batch_sizes.append(len(batch))
+            try:
+                self._generate(batch)
+            except Exception as e:
+                print(f"❌ [INFERENCE] Échec de génération du micro-batch: {e}")
+                for req in batch:
+                    if req.finished_at is None:
+                        req.error = f"Échec de génération: {e}"
+                        req.tokens.put(None)
+
+    @torch.inference_mode()
+    def _generate(self, batch):
+        enc = self.tokenizer([r.prompt for r in batch], return_tensors="pt", padding=True,
+                             truncation=True, max_length=MAX_PROMPT_TOKENS)
+        attention_mask = enc["attention_mask"]
+        # Avec le padding à gauche, les positions doivent ignorer les tokens de padding
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        out = self.model(input_ids=enc["input_ids"], attention_mask=attention_mask, position_ids=position_ids, use_cache=True)
+
+        eos_id = self.tokenizer.eos_token_id
+        generated = [[] for _ in batch]
+        emitted = [0] * len(batch)
+        active = [True] * len(batch)
+        max_steps = max(r.max_new_tokens for r in batch)
+
+        for step in range(max_steps):
+            next_tokens = out.logits[:, -1, :].argmax(dim=-1)
+            now = time.perf_counter()
+            for i, req in enumerate(batch):
+                if not active[i]:
+                    continue
+                token = int(next_tokens[i])
+                if token == eos_id:
+                    active[i] = False
+                else:
+                    generated[i].append(token)
+                    req.generated_tokens += 1
+                    # Détokenisation incrémentale: on n'émet que le nouveau suffixe de texte
+                    text = self.tokenizer.decode(generated[i], skip_special_tokens=True)
+                    if len(text) > emitted[i]:
+                        req.first_token_at = req.first_token_at or now
+                        req.tokens.put(text[emitted[i]:])
+                        emitted[i] = len(text)
+                    if len(generated[i]) >= req.max_new_tokens:
+                        active[i] = False
+                if not active[i]:
+                    req.finished_at = now
+                    req.tokens.put(None)
+            if not any(active):
+                return
+
+            # Pas suivant: seul le dernier token est calculé, le reste vient du cache KV
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(batch), 1))], dim=-1)
+            position_ids = position_ids[:, -1:] + 1
+            out = self.model(input_ids=next_tokens.unsqueeze(-1), attention_mask=attention_mask,
+                             position_ids=position_ids, past_key_values=out.past_key_values, use_cache=True)
+
+engine = None
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({"status": "OK" if engine else "STARTING"}), 200 if engine else 503
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    """Génère une réponse. Avec "stream": true, le texte est renvoyé au fil des tokens."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Corps JSON (objet) requis."}), 400
+    prompt = data.get("prompt")
+    # Un prompt invalide ferait échouer la tokenisation de tout le micro-batch, pas seulement cette requête
+    if not isinstance(prompt, str) or not prompt:
+        return jsonify({"status": "error", "message": "Le champ 'prompt' (texte non vide) est requis."}), 400
+    max_new_tokens = data.get("max_new_tokens", DEFAULT_MAX_NEW_TOKENS)
+    if not isinstance(max_new_tokens, int) or isinstance(max_new_tokens, bool):
+        return jsonify({"status": "error", "message": "Le champ 'max_new_tokens' doit être un entier."}), 400
+    max_new_tokens = max(1, min(max_new_tokens, 1024))
+
+    req = engine.submit(prompt, max_new_tokens)
+    if data.get("stream"):
+        return Response(req.stream(), mimetype="text/plain")
+
+    try:
+        text = req.result()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({
+        "text": text,
+        "generated_tokens": req.generated_tokens,
+        "latency_ms": round((req.finished_at - req.submitted_at) * 1000, 1) if req.finished_at else None,
+    }), 200
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def run_benchmark(model, tokenizer, concurrency, requests_per_client, max_new_tokens, batch_sizes):
+    """Mesure débit et latences (p50/p99) avec des clients concurrents, pour plusieurs tailles de micro-batch."""
+    prompt = "### Diagnostic:\nPatient de 54 ans, fièvre et toux depuis 3 jours.\n\n### Recommandation:\n"
+    results = []
+    for max_batch_size in batch_sizes:
+        bench_engine = MicroBatchingEngine(model, tokenizer, max_batch_size=max_batch_size)
+        bench_engine.submit(prompt, 2).result() # Préchauffage
+        bench_engine.batch_sizes.clear()
+        latencies, ttfts, tokens = [], [], []
+        lock = threading.Lock()
+
+        def client():
+            for _ in range(requests_per_client):
+                req = bench_engine.submit(prompt, max_new_tokens)
+                req.result()
+                with lock:
+                    latencies.append(req.finished_at - req.submitted_at)
+                    if req.first_token_at:
+                        ttfts.append(req.first_token_at - req.submitted_at)
+                    tokens.append(req.generated_tokens)
+
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(concurrency)]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        results.append({
+            "max_batch_size": max_batch_size,
+            "requests": len(latencies),
+            "tokens_per_second": round(sum(tokens) / elapsed, 1),
+            "requests_per_second": round(len(latencies) / elapsed, 2),
+            "latency_ms": {"p50": round(percentile(latencies, 50) * 1000, 1), "p99": round(percentile(latencies, 99) * 1000, 1)},
+            "ttft_ms_p50": round(statistics.median(ttfts) * 1000, 1) if ttfts else None,
+            "mean_batch_size": round(statistics.mean(bench_engine.batch_sizes), 2),
+        })
+        print(f"📊 [BENCH] batch≤{max_batch_size}: {results[-1]['tokens_per_second']} tokens/s, "
+              f"p50 {results[-1]['latency_ms']['p50']} ms, p99 {results[-1]['latency_ms']['p99']} ms")
+    return results
+
+def main():
+    global engine
+    parser = argparse.ArgumentParser(description="Serveur d'inférence CPU du modèle Edge.")
+    parser.add_argument("--model", default=MODEL_DIR)
+    parser.add_argument("--no-merge-lora", action="store_true")
+    parser.add_argument("--int8", action="store_true", help="Quantification dynamique int8 des couches Linear.")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=int, default=MAX_BATCH_WAIT_MS)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--benchmark", action="store_true", help="Mesure débit et p99 en local au lieu de servir.")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"🧠 Chargement du modèle Edge depuis '{args.model}'...")
+    model, tokenizer = load_model(args.model, merge_lora=not args.no_merge_lora, quantize_int8=args.int8, threads=args.threads)
+    print(f"✅ Modèle prêt (int8: {'oui' if args.int8 else 'non'}, {torch.get_num_threads()} threads).")
+
+    if args.benchmark:
+        batch_sizes = sorted({1, args.max_batch_size})
+        results = run_benchmark(model, tokenizer, args.concurrency, args.requests_per_client, args.max_new_tokens, batch_sizes)
+        print(json.dumps(results, indent=2))
+        return
+
+    engine = MicroBatchingEngine(model, tokenizer, args.max_batch_size, args.max_wait_ms)
+    print(f"🚀 Service d'inférence Edge à l'écoute sur le port {args.port} (micro-batchs ≤{args.max_batch_size}, {args.max_wait_ms} ms).")
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
+
+if __name__ == "__main__":
+    main()
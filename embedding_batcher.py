@@ -0,0 +1,227 @@
+# Fichier: embedding_batcher.py
+# Description: Exécuteur d'embeddings pour l'ingestion: plusieurs lots envoyés en parallèle sous un
+#              seau à jetons (quota de requêtes/min), taille de lot adaptée à la latence observée et
+#              aux réponses 429, reprises avec backoff exponentiel. Les lots sont restitués dans
+#              l'ordre des morceaux pendant que les suivants sont encore en vol (l'appelant insère
+#              dans Milvus en parallèle de la vectorisation).
+
+import os
+import math
+import time
+import random
+import threading
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import get_logger, counter, gauge, span
+
+# --- CONFIGURATION ---
+MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))          # Lots en vol simultanément
+REQUESTS_PER_MINUTE = float(os.environ.get("EMBEDDING_RPM", "1500"))          # Quota de l'API d'embedding
+QUOTA_UNIT = os.environ.get("EMBEDDING_QUOTA_UNIT", "requests")                # requests | tokens: unité comptée par le quota
+INITIAL_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+MIN_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 100        # Limite par requête de batchEmbedContents
+TEXTS_PER_REQUEST = 100     # GoogleGenerativeAIEmbeddings découpe chaque appel en requêtes d'au plus 100 textes
+TARGET_LATENCY_S = 2.0      # Au-delà, le lot est réduit; nettement en dessous, il est agrandi
+MAX_RETRIES = 6
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 60.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+log = get_logger("embedding_batcher")
+EMBED_REQUESTS = counter("embedding_requests", "Appels à l'API d'embedding par résultat.", ("outcome",))
+EMBED_BATCH_SIZE = gauge("embedding_batch_size", "Taille de lot courante choisie par le contrôleur adaptatif.")
+
+class TokenBucket:
+    """Seau à jetons partagé entre les threads: `rate` jetons/s, rafale jusqu'à `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self, tokens):
+        """Prend les jetons si possible; sinon retourne l'attente nécessaire (s). Appelé sous verrou."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def try_acquire(self, tokens=1.0):
+        with self._lock:
+            return self._take(tokens) == 0.0
+
+    def acquire(self, tokens=1.0):
+        while True:
+            with self._lock:
+                wait = self._take(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+
+    def pause(self, seconds):
+        """Bloque toutes les acquisitions (quota épuisé côté serveur): aucun thread ne relance trop tôt."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+class BatchSizeController:
+    """
+    +25% tant que la latence laisse de la marge, -25% au-delà de la cible. Sur un 429 d'un quota compté
+    en requêtes, le lot grossit: moins de requêtes pour le même volume, la latence restant le garde-fou.
+    Avec un quota compté en tokens, un plus gros lot consomme autant de quota: la taille ne bouge pas.
+    """
+
+    def __init__(self, initial=INITIAL_BATCH_SIZE, minimum=MIN_BATCH_SIZE, maximum=MAX_BATCH_SIZE, target_latency_s=TARGET_LATENCY_S,
+                 quota_unit=QUOTA_UNIT):
+        self.minimum, self.maximum = minimum, maximum
+        self.target_latency_s = target_latency_s
+        self.grow_on_rate_limit = quota_unit == "requests"
+        self.size = max(minimum, min(maximum, initial))
+        self._lock = threading.Lock()
+        EMBED_BATCH_SIZE.set(self.size)
+
+    def _set(self, size):
+        self.size = max(self.minimum, min(self.maximum, int(size)))
+        EMBED_BATCH_SIZE.set(self.size)
+
+    def on_success(self, batch_len, latency_s):
+        with self._lock:
+            if latency_s > self.target_latency_s:
+                self._set(min(self.size, batch_len) * 0.75)
+            elif latency_s < self.target_latency_s * 0.5 and batch_len >= self.size:
+                self._set(self.size + max(1, self.size // 4))
+
+    def on_rate_limited(self):
+        if not self.grow_on_rate_limit:
+            return
+        with self._lock:
+            self._set(self.size + max(1, self.size // 4))
+
+def _status_code(exc):
+    """Code HTTP d'une erreur de client (google.api_core, requests, httpx), y compris enveloppée par LangChain."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        code = getattr(exc, "code", None)
+        if isinstance(code, int):
+            return code
+        response = getattr(exc, "response", None)
+        if getattr(response, "status_code", None) is not None:
+            return response.status_code
+        text = str(exc)
+        if "429" in text or "ResourceExhausted" in text or "RESOURCE_EXHAUSTED" in text:
+            return 429
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+class HttpEmbeddings:
+    """Client d'un service d'embedding HTTP (`POST /embed`, ex: embedding_stub_server.py), interface LangChain."""
+
+    def __init__(self, endpoint, timeout=60):
+        self.endpoint = endpoint.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def embed_documents(self, texts):
+        response = self.session.post(f"{self.endpoint}/embed", json={"texts": texts}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class AdaptiveEmbedder:
+    """
+    `embed_documents`: callable liste de textes -> liste de vecteurs (client LangChain ou HTTP).
+    `map(items, text)` renvoie les couples (lot, vecteurs) dans l'ordre d'origine, au plus
+    `max_concurrency` lots étant vectorisés en avance pendant que l'appelant traite le précédent.
+    Chaque appel coûte au seau un jeton par requête sous-jacente (`texts_per_request` textes par
+    requête; None si le client envoie tout le lot en une requête).
+    """
+
+    def __init__(self, embed_documents, max_concurrency=MAX_CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE,
+                 controller=None, max_retries=MAX_RETRIES, texts_per_request=TEXTS_PER_REQUEST):
+        self.embed_documents = embed_documents
+        self.max_concurrency = max_concurrency
+        self.max_rate = requests_per_minute / 60.0
+        self.controller = controller or BatchSizeController()
+        self.texts_per_request = texts_per_request
+        # La rafale doit pouvoir contenir le plus gros lot, sinon son acquisition n'aboutirait jamais
+        self.bucket = TokenBucket(self.max_rate, capacity=max(max_concurrency, self._request_count(self.controller.maximum)))
+        self.max_retries = max_retries
+
+    def _request_count(self, batch_len):
+        return math.ceil(batch_len / self.texts_per_request) if self.texts_per_request else 1
+
+    def _embed_batch(self, texts):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire(self._request_count(len(texts)))
+            started = time.perf_counter()
+            try:
+                with span("embedding_request"):
+                    vectors = self.embed_documents(texts)
+            except Exception as e:
+                status = _status_code(e)
+                retryable = status in RETRYABLE_STATUS or isinstance(e, (ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout))
+                if not retryable or attempt == self.max_retries:
+                    EMBED_REQUESTS.labels(outcome="error").inc()
+                    raise
+                delay = _retry_after(e) or min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if status == 429:
+                    EMBED_REQUESTS.labels(outcome="rate_limited").inc()
+                    self.controller.on_rate_limited()
+                    # Débit client divisé par deux, regagné progressivement à chaque succès (AIMD)
+                    self.bucket.set_rate(max(self.max_rate / 100, self.bucket.rate / 2))
+                    self.bucket.pause(delay)
+                else:
+                    EMBED_REQUESTS.labels(outcome="retried").inc()
+                log.warning("Lot d'embedding en échec, nouvelle tentative.", status=status, attempt=attempt + 1,
+                            batch=len(texts), delay_s=round(delay, 2), error=str(e)[:200])
+                time.sleep(delay)
+                continue
+            if len(vectors) != len(texts):
+                raise ValueError(f"{len(vectors)} vecteurs reçus pour {len(texts)} textes")
+            EMBED_REQUESTS.labels(outcome="ok").inc()
+            if self.bucket.rate < self.max_rate:
+                self.bucket.set_rate(min(self.max_rate, self.bucket.rate + self.max_rate / 50))
+            self.controller.on_success(len(texts), time.perf_counter() - started)
+            return vectors
+
+    def map(self, items, text=lambda item: item):
+        items = list(items)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") as pool:
+            in_flight = deque()
+            position = 0
+            try:
+                while position < len(items) or in_flight:
+                    # Les lots sont découpés au moment de l'envoi: la taille suit le contrôleur en continu
+                    while position < len(items) and len(in_flight) < self.max_concurrency:
+                        batch = items[position:position + self.controller.size]
+                        position += len(batch)
+                        in_flight.append((batch, pool.submit(self._embed_batch, [text(item) for item in batch])))
+                    batch, future = in_flight.popleft()
+                    yield batch, future.result()
+            finally:
+                for _, future in in_flight:
+                    future.cancel()
@@ -0,0 +1,101 @@
+# Fichier: embedding_stub_server.py
+# Description: Faux service d'embedding (POST /embed) pour régler le débit d'ingestion hors ligne:
+#              latence fixe + proportionnelle à la taille du lot, quota de requêtes/min renvoyant
+#              des 429 (Retry-After), vecteurs déterministes de dimension 768.
+#              `--benchmark` compare l'envoi série à lot fixe et l'exécuteur adaptatif concurrent.
+#              Pour ingérer contre ce serveur: EMBEDDING_ENDPOINT=http://localhost:8091 python ingest.py
+
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import numpy as np
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+from embedding_batcher import AdaptiveEmbedder, BatchSizeController, HttpEmbeddings, TokenBucket, EMBED_REQUESTS, MAX_BATCH_SIZE
+
+# --- CONFIGURATION ---
+SERVER_PORT = 8091
+EMBEDDING_DIM = 768           # Même dimension que text-embedding-004 (schéma Milvus)
+BASE_LATENCY_MS = 300         # Aller-retour réseau + file d'attente côté API
+PER_TEXT_LATENCY_MS = 8
+REQUESTS_PER_MINUTE = 600
+MAX_TEXTS_PER_REQUEST = 100 # Comme batchEmbedContents
+
+app = Flask(__name__)
+logging.getLogger("werkzeug").setLevel(logging.WARNING) # Pas de ligne de log par requête
+settings = {"base_ms": BASE_LATENCY_MS, "per_text_ms": PER_TEXT_LATENCY_MS, "max_texts": MAX_TEXTS_PER_REQUEST}
+quota = TokenBucket(REQUESTS_PER_MINUTE / 60.0, capacity=10)
+
+def fake_vector(text):
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+@app.route("/embed", methods=["POST"])
+def embed():
+    texts = (request.get_json(silent=True) or {}).get("texts")
+    if not isinstance(texts, list):
+        return jsonify({"error": "Champ 'texts' (liste) requis."}), 400
+    if len(texts) > settings["max_texts"]:
+        return jsonify({"error": f"Au plus {settings['max_texts']} textes par requête."}), 400
+    if not quota.try_acquire():
+        return jsonify({"error": "RESOURCE_EXHAUSTED"}), 429, {"Retry-After": "1"}
+    time.sleep((settings["base_ms"] + settings["per_text_ms"] * len(texts)) / 1000)
+    return jsonify({"embeddings": [fake_vector(text) for text in texts]})
+
+def start_server(port, host="127.0.0.1"):
+    """Serveur dans un thread (benchmark dans le même processus)."""
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_benchmark(endpoint, chunks, concurrency, client_rpm, initial_batch_size):
+    """Débit série à lot fixe (l'ancien comportement de ingest.py, ramené à la limite par requête) contre l'exécuteur adaptatif."""
+    client = HttpEmbeddings(endpoint)
+    texts = [f"Morceau {i}: " + "texte médical " * 60 for i in range(chunks)]
+    configurations = {
+        f"série, lot fixe {MAX_BATCH_SIZE}": AdaptiveEmbedder(client.embed_documents, max_concurrency=1, requests_per_minute=client_rpm,
+                                                controller=BatchSizeController(initial=MAX_BATCH_SIZE, minimum=MAX_BATCH_SIZE,
+                                                                               maximum=MAX_BATCH_SIZE)),
+        f"adaptatif, {concurrency} en vol": AdaptiveEmbedder(client.embed_documents, max_concurrency=concurrency,
+                                                           requests_per_minute=client_rpm,
+                                                           controller=BatchSizeController(initial=initial_batch_size)),
+    }
+    print(f"\n📊 Benchmark: {chunks} morceaux vers {endpoint}")
+    for name, embedder in configurations.items():
+        before = {outcome: EMBED_REQUESTS.labels(outcome=outcome).value for outcome in ("ok", "rate_limited", "retried")}
+        started = time.perf_counter()
+        received = []
+        for batch, vectors in embedder.map(texts):
+            received.extend(batch)
+        elapsed = time.perf_counter() - started
+        assert received == texts, "ordre des morceaux non préservé"
+        calls = {outcome: int(EMBED_REQUESTS.labels(outcome=outcome).value - before[outcome]) for outcome in before}
+        print(f"   {name:<24} {chunks / elapsed:8.1f} morceaux/s  ({elapsed:.1f}s, {calls['ok']} requêtes, "
+              f"{calls['rate_limited']} x 429, lot final {embedder.controller.size})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Faux service d'embedding pour les réglages de débit.")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--base-latency-ms", type=float, default=BASE_LATENCY_MS)
+    parser.add_argument("--per-text-latency-ms", type=float, default=PER_TEXT_LATENCY_MS)
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="Quota du serveur (requêtes/min) avant 429.")
+    parser.add_argument("--max-texts", type=int, default=MAX_TEXTS_PER_REQUEST)
+    parser.add_argument("--benchmark", action="store_true", help="Démarre le serveur et mesure le débit des deux stratégies.")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--client-rpm", type=float, default=1500, help="Limite du seau à jetons côté client.")
+    parser.add_argument("--initial-batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    settings.update(base_ms=args.base_latency_ms, per_text_ms=args.per_text_latency_ms, max_texts=args.max_texts)
+    quota = TokenBucket(args.rpm / 60.0, capacity=10)
+    if args.benchmark:
+        server = start_server(args.port)
+        run_benchmark(f"http://127.0.0.1:{args.port}", args.chunks, args.concurrency, args.client_rpm, args.initial_batch_size)
+        server.shutdown()
+    else:
+        print(f"🧪 Faux service d'embedding sur le port {args.port} (quota {args.rpm:.0f} req/min).")
+        make_server("0.0.0.0", args.port, app, threaded=True).serve_forever()
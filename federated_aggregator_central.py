@@ -1,48 +1,493 @@
 # Fichier: federated_aggregator_central.py
 # Description: Service central qui reçoit les mises à jour de poids de tous les hôpitaux
 #              et les agrège pour améliorer le modèle global.
+#              Agrégation asynchrone (tampon de mises à jour, pondération par obsolescence)
+#              avec optimiseur serveur FedAvg / FedAdam / FedYogi.
 
-from flask import Flask, request, jsonify
+import os
+import re
+import json
+import uuid
+import queue
+import struct
+import hashlib
+import threading
+from functools import lru_cache
+from flask import Flask, Response, request, jsonify
 import torch
+from safetensors.torch import save as safetensors_save, load as safetensors_load
+from federated_transport import decode_update, encode_update, read_metadata, sha256_hex, CHECKSUM_HEADER, CHUNK_SIZE_BYTES, QUANTIZATIONS
 
 app = Flask(__name__)
 
-# --- Stockage en mémoire (pour la démo) ---
-# Dans un vrai projet, on utiliserait une base de données ou un stockage de fichiers.
-global_model_weights = None
-received_weights_buffer = []
+# --- CONFIGURATION ---
+UPDATES_PER_STEP = 3 # Nombre de mises à jour (de n'importe quels hôpitaux) par pas d'optimiseur serveur
+GLOBAL_MODEL_DIR = "./global_models" # Versions successives du modèle global
+LATEST_POINTER_FILE = "latest.json"
+OPTIMIZER_STATE_FILE = "server_optimizer.safetensors"
+UPLOAD_DIR = os.path.join(GLOBAL_MODEL_DIR, "uploads") # Uploads en morceaux en cours (reprise possible)
+MAX_UPDATE_SIZE_BYTES = 4 * 1024 ** 3
+MAX_QUEUED_UPDATES = 16 # Au-delà, les hôpitaux reçoivent un 503 et réessaient plus tard
+MAX_HEADER_SIZE_BYTES = 100 * 1024 ** 2 # En-tête safetensors (limite du format)
+
+# Asynchronisme: une mise à jour calculée sur la version v, reçue alors que le global est en v+s,
+# est pondérée par 1 / (1 + s)^STALENESS_EXPONENT et rejetée au-delà de MAX_STALENESS.
+STALENESS_EXPONENT = 0.5
+MAX_STALENESS = 10
+
+# Optimiseur serveur appliqué au pseudo-gradient (moyenne pondérée des deltas)
+SERVER_OPTIMIZER = "fedadam" # fedavg | fedadam | fedyogi
+SERVER_LR = 1.0 if SERVER_OPTIMIZER == "fedavg" else 0.01
+SERVER_BETA1 = 0.9
+SERVER_BETA2 = 0.99
+SERVER_TAU = 1e-3 # Degré d'adaptativité (epsilon de FedAdam/FedYogi)
+
+class StreamingFedAvg:
+    """
+    Moyenne pondérée calculée en flux: chaque mise à jour est repliée tenseur par tenseur
+    dans une somme courante puis libérée. La mémoire reste proportionnelle à UN modèle,
+    quel que soit le nombre d'hôpitaux.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.weighted_sum = {}   # nom -> somme des (tenseur * poids), en float32
+        self.total_weight = 0.0
+        self.total_samples = 0
+        self.contributors = []
+
+    def add_update(self, hospital_id, state_dict, weight, num_samples):
+        """Replie une mise à jour dans la moyenne courante. Le state_dict est vidé au passage."""
+        if weight <= 0:
+            raise ValueError("Le poids d'une mise à jour doit être strictement positif.")
+        with self.lock:
+            if self.weighted_sum:
+                if set(state_dict) != set(self.weighted_sum):
+                    raise ValueError("Les paramètres reçus ne correspondent pas à ceux du round en cours.")
+                for name, tensor in state_dict.items():
+                    if tensor.shape != self.weighted_sum[name].shape:
+                        raise ValueError(f"Forme inattendue pour '{name}': {tuple(tensor.shape)}.")
+
+            for name in list(state_dict):
+                tensor = state_dict.pop(name)
+                if name in self.weighted_sum:
+                    self.weighted_sum[name].add_(tensor.to(torch.float32), alpha=weight)
+                else:
+                    self.weighted_sum[name] = tensor.to(torch.float32).mul_(weight)
+                del tensor
+            self.total_weight += weight
+            self.total_samples += num_samples
+            self.contributors.append(hospital_id)
+            return len(self.contributors)
+
+    def pop_average(self):
+        """
+        Retourne la moyenne du tampon et réinitialise l'accumulateur. La somme est divisée par le nombre
+        d'échantillons et non par la somme des poids: l'obsolescence réduit alors réellement le pas,
+        même quand toutes les mises à jour du tampon sont aussi anciennes.
+        """
+        with self.lock:
+            if not self.contributors:
+                return None, [], 0
+            average = {name: acc.div_(self.total_samples) for name, acc in self.weighted_sum.items()}
+            contributors, total_samples = self.contributors, self.total_samples
+            self.weighted_sum, self.total_weight, self.total_samples, self.contributors = {}, 0.0, 0, []
+            return average, contributors, total_samples
+
+class ServerOptimizer:
+    """
+    Optimiseurs serveur de "Adaptive Federated Optimization" (Reddi et al.): le delta moyen
+    des hôpitaux est traité comme un pseudo-gradient. FedAvg avec SERVER_LR=1 revient à
+    remplacer le global par la moyenne des modèles locaux.
+    """
+
+    def __init__(self, kind=SERVER_OPTIMIZER, lr=SERVER_LR, beta1=SERVER_BETA1, beta2=SERVER_BETA2, tau=SERVER_TAU):
+        if kind not in ("fedavg", "fedadam", "fedyogi"):
+            raise ValueError(f"Optimiseur serveur inconnu: {kind}")
+        self.kind, self.lr, self.beta1, self.beta2, self.tau = kind, lr, beta1, beta2, tau
+        self.m, self.v = {}, {}
+
+    def step(self, weights, delta):
+        """Applique le pseudo-gradient `delta` aux poids globaux (modifiés sur place)."""
+        for name, d in delta.items():
+            if self.kind == "fedavg":
+                weights[name].add_(d, alpha=self.lr)
+                continue
+            m = self.m.setdefault(name, torch.zeros_like(d))
+            v = self.v.setdefault(name, torch.full_like(d, self.tau ** 2))
+            m.mul_(self.beta1).add_(d, alpha=1 - self.beta1)
+            d2 = d * d
+            if self.kind == "fedadam":
+                v.mul_(self.beta2).add_(d2, alpha=1 - self.beta2)
+            else: # fedyogi: v augmente ou diminue de façon additive, jamais d'explosion soudaine
+                v.sub_(torch.sign(v - d2).mul_(d2), alpha=1 - self.beta2)
+            weights[name].add_(m / (v.sqrt() + self.tau), alpha=self.lr)
+
+    def state_dict(self):
+        state = {f"m.{k}": t for k, t in self.m.items()}
+        state.update({f"v.{k}": t for k, t in self.v.items()})
+        return state
+
+    def load_state_dict(self, state):
+        self.m = {k[2:]: t for k, t in state.items() if k.startswith("m.")}
+        self.v = {k[2:]: t for k, t in state.items() if k.startswith("v.")}
+
+def atomic_write(path, write_fn):
+    """Écrit dans un fichier temporaire du même dossier puis le renomme: jamais de fichier à moitié écrit."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class GlobalModelStore:
+    """Versions successives du modèle global sur disque, publiées atomiquement."""
+
+    def __init__(self, root=GLOBAL_MODEL_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.load = lru_cache(maxsize=4)(self._load)
+        self.read_blob = lru_cache(maxsize=2)(self._read_blob)
+        self.latest = self._read_pointer()
+
+    def _read_pointer(self):
+        pointer = os.path.join(self.root, LATEST_POINTER_FILE)
+        if not os.path.exists(pointer):
+            return {"version": 0}
+        with open(pointer, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @property
+    def version(self):
+        return self.latest["version"]
+
+    def path(self, version):
+        return os.path.join(self.root, f"global_v{version}.safetensors")
+
+    def _read_blob(self, version):
+        path = self.path(version)
+        if not os.path.exists(path):
+            raise ValueError(f"Version globale v{version} inconnue.")
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _load(self, version):
+        """Charge une version du modèle global (référence des deltas envoyés par les hôpitaux)."""
+        return safetensors_load(self.read_blob(version))
+
+    def publish(self, weights, contributors, total_samples):
+        """Sauvegarde atomiquement une nouvelle version du modèle global et met à jour le pointeur."""
+        version = self.version + 1
+        blob = safetensors_save({k: v.contiguous() for k, v in weights.items()})
+        atomic_write(self.path(version), lambda f: f.write(blob))
+
+        pointer = {"version": version, "path": os.path.basename(self.path(version)), "sha256": sha256_hex(blob),
+                   "contributors": contributors, "total_samples": total_samples}
+        atomic_write(os.path.join(self.root, LATEST_POINTER_FILE), lambda f: f.write(json.dumps(pointer, indent=2).encode("utf-8")))
+        self.latest = pointer
+        return version
+
+    def etag(self, version=None, variant=""):
+        version = self.version if version is None else version
+        digest = self.latest.get("sha256", "")[:16] if version == self.version else ""
+        return f'"v{version}-{digest}{variant}"'
+
+# --- État du serveur ---
+store = GlobalModelStore()
+aggregator = StreamingFedAvg()
+server_optimizer = ServerOptimizer()
+update_queue = queue.Queue(maxsize=MAX_QUEUED_UPDATES)
+
+def staleness_weight(staleness):
+    return 1.0 / (1.0 + staleness) ** STALENESS_EXPONENT
+
+def fold_update(blob):
+    """Décode une mise à jour vérifiée et la replie dans le tampon sous forme de delta pondéré."""
+    current = store.version
+    metadata, state_dict = decode_update(blob, as_delta=True)
+    hospital_id, num_samples = metadata["hospital_id"], int(metadata["num_samples"])
+
+    if current == 0:
+        # Amorçage: aucun modèle global, on moyenne directement les poids complets
+        if metadata["encoding"] == "delta":
+            raise ValueError("Delta reçu alors qu'aucun modèle global n'a encore été publié.")
+        base_version, staleness = 0, 0
+    elif metadata["encoding"] == "delta":
+        base_version = int(metadata["base_version"])
+        staleness = current - base_version
+        if staleness < 0:
+            raise ValueError(f"Version de base v{base_version} postérieure au global v{current}.")
+    else:
+        # Poids complets: delta par rapport à leur version de départ (ou la courante si inconnue)
+        base_version = int(metadata["base_version"]) or current
+        staleness = current - base_version
+        base = store.load(base_version)
+        for name, tensor in state_dict.items():
+            tensor.sub_(base[name].to(torch.float32))
+
+    weight = num_samples * staleness_weight(staleness)
+    pending = aggregator.add_update(hospital_id, state_dict, weight, num_samples)
+    print(f"📥 Mise à jour de {hospital_id} intégrée (base v{base_version}, obsolescence {staleness}, poids {weight:.1f}).")
+    return pending
+
+def server_step():
+    """Transforme le tampon en une nouvelle version du modèle global."""
+    average, contributors, total_samples = aggregator.pop_average()
+    if average is None:
+        return None
+
+    print("🔄 Agrégation des poids pour créer une nouvelle version du modèle global...")
+    if store.version == 0:
+        new_weights = average
+    else:
+        new_weights = {name: t.clone() for name, t in store.load(store.version).items()}
+        server_optimizer.step(new_weights, average)
+
+    version = store.publish(new_weights, contributors, total_samples)
+    atomic_write(os.path.join(store.root, OPTIMIZER_STATE_FILE),
+                 lambda f: f.write(safetensors_save({k: t.contiguous() for k, t in server_optimizer.state_dict().items()})))
+    print(f"✅ Nouveau modèle global v{version} créé ! ({SERVER_OPTIMIZER}, {len(contributors)} mises à jour, {total_samples} échantillons)")
+    return version
+
+def aggregation_worker():
+    """
+    Thread d'agrégation: les requêtes HTTP ne font que vérifier et mettre en file le chemin du blob
+    écrit dans UPLOAD_DIR. Un seul blob est lu en mémoire à la fois (mémoire en O(modèle)).
+    Les fichiers repliés dans le tampon ne sont supprimés qu'une fois le global publié: après un
+    redémarrage, start_aggregation_worker les rejoue.
+    """
+    buffered = []
+    while True:
+        path = update_queue.get()
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            folded = fold_update(blob)
+            del blob
+            buffered.append(path)
+        except Exception as e:
+            # Toute erreur (blob malformé, métadonnées incohérentes): seule cette mise à jour est perdue
+            print(f"❌ Mise à jour rejetée par l'agrégateur: {type(e).__name__}: {e}")
+            _remove_file(path)
+            update_queue.task_done()
+            continue
+        try:
+            if folded >= UPDATES_PER_STEP:
+                server_step()
+                for done in buffered:
+                    _remove_file(done)
+                buffered = []
+        except Exception as e:
+            # Le tampon est vidé mais ses fichiers restent sur disque: ils seront rejoués au redémarrage
+            print(f"❌ Échec de publication du modèle global: {type(e).__name__}: {e}")
+            buffered = []
+        finally:
+            update_queue.task_done()
+
+def _remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def start_aggregation_worker():
+    state_path = os.path.join(store.root, OPTIMIZER_STATE_FILE)
+    if os.path.exists(state_path):
+        with open(state_path, "rb") as f:
+            server_optimizer.load_state_dict(safetensors_load(f.read()))
+    threading.Thread(target=aggregation_worker, name="aggregation-worker", daemon=True).start()
+    # Mises à jour acceptées (202) mais pas encore agrégées avant un redémarrage
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    pending = sorted((os.path.join(UPLOAD_DIR, name) for name in os.listdir(UPLOAD_DIR) if name.endswith(".queued")),
+                     key=os.path.getmtime)
+    for path in pending:
+        update_queue.put(path)
+    print(f"🧵 Worker d'agrégation démarré (global v{store.version}, optimiseur {SERVER_OPTIMIZER}, "
+          f"{len(pending)} mise(s) à jour reprise(s)).")
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_header(path):
+    """Longueur + en-tête JSON safetensors d'un blob sur disque (suffisant pour read_metadata)."""
+    with open(path, "rb") as f:
+        prefix = f.read(8)
+        if len(prefix) < 8:
+            raise ValueError("Blob de mise à jour tronqué.")
+        (header_len,) = struct.unpack("<Q", prefix)
+        if header_len > MAX_HEADER_SIZE_BYTES:
+            raise ValueError("En-tête de mise à jour invalide.")
+        return prefix + f.read(header_len)
+
+def ingest_update(path, expected_sha256):
+    """
+    Vérifie une mise à jour binaire écrite sur disque et confie son chemin au worker d'agrégation.
+    Retourne une réponse Flask. Avec un 202, le fichier a été déplacé dans la file (le worker le
+    supprimera); sinon il est laissé en place et l'appelant décide de le garder (503) ou non.
+    """
+    expected_sha256 = expected_sha256.lower()
+    if _file_sha256(path) != expected_sha256:
+        return jsonify({"status": "rejected", "message": "Somme de contrôle SHA-256 invalide: mise à jour corrompue."}), 400
+    try:
+        metadata = read_metadata(_read_header(path))
+        base_version = int(metadata["base_version"])
+        staleness = store.version - base_version if metadata["encoding"] == "delta" else 0
+    except (ValueError, KeyError) as e:
+        return jsonify({"status": "rejected", "message": str(e)}), 400
+    if base_version > store.version:
+        return jsonify({"status": "rejected", "message": f"Version de base v{base_version} inconnue (global v{store.version})."}), 400
+    if staleness > MAX_STALENESS:
+        return jsonify({"status": "stale", "message": "Mise à jour trop ancienne, récupérez le dernier modèle global.",
+                        "global_version": store.version}), 409
+
+    queued_path = os.path.join(UPLOAD_DIR, f"{expected_sha256}.queued")
+    if os.path.exists(queued_path):
+        # Même blob déjà accepté (réponse 202 perdue côté client): pas de double agrégation
+        os.remove(path)
+        return jsonify({"status": "received", "global_version": store.version}), 202
+    size = os.path.getsize(path)
+    os.replace(path, queued_path)
+    try:
+        update_queue.put_nowait(queued_path)
+    except queue.Full:
+        os.replace(queued_path, path) # Conservé: le client peut réessayer sans renvoyer les données
+        return jsonify({"status": "busy", "message": "File d'agrégation pleine, réessayez plus tard."}), 503
+    print(f"📦 Poids reçus de l'hôpital: {metadata['hospital_id']} ({metadata['num_samples']} échantillons, "
+          f"{size / 1e6:.1f} Mo, {metadata['encoding']}/{metadata['quantization']})")
+    return jsonify({"status": "received", "global_version": store.version}), 202
 
 @app.route('/submit_weights', methods=['POST'])
 def submit_weights():
-    """Point d'entrée pour recevoir les poids des hôpitaux Edge."""
-    data = request.get_json()
-    hospital_id = data.get('hospital_id')
-    weights_data = data.get('weights_data') # Les poids sérialisés
-    
-    print(f"📦 Poids reçus de l'hôpital: {hospital_id}")
-    
-    # Désérialiser et stocker les poids
-    # ... logique de désérialisation ...
-    received_weights_buffer.append(weights_data)
-    
-    # Si on a reçu assez de mises à jour, on lance l'agrégation
-    if len(received_weights_buffer) >= 3: # Ex: agréger après 3 mises à jour
-        aggregate_weights()
-        
-    return jsonify({"status": "received"}), 200
-
-def aggregate_weights():
-    """Agrège les poids reçus pour mettre à jour le modèle global."""
-    print("🔄 Agrégation des poids pour créer une nouvelle version du modèle global...")
-    
-    # Algorithme d'agrégation (ex: Federated Averaging - FedAvg)
-    # 1. Charger le modèle global actuel.
-    # 2. Calculer la moyenne des poids reçus de chaque hôpital.
-    # 3. Appliquer cette moyenne au modèle global.
-    # 4. Sauvegarder le nouveau modèle global.
-    
-    print("✅ Nouveau modèle global v1.2 créé !")
-    received_weights_buffer.clear() # Vider le buffer
+    """Point d'entrée pour recevoir en un seul envoi une mise à jour binaire (voir federated_transport)."""
+    expected_sha256 = request.headers.get(CHECKSUM_HEADER)
+    if not expected_sha256:
+        return jsonify({"status": "error", "message": f"En-tête {CHECKSUM_HEADER} requis."}), 400
+
+    # Corps écrit directement sur disque par morceaux: jamais le blob entier en mémoire
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    spool_path = os.path.join(UPLOAD_DIR, f"submit-{uuid.uuid4().hex}.part")
+    try:
+        received = 0
+        with open(spool_path, "wb") as f:
+            for chunk in iter(lambda: request.stream.read(CHUNK_SIZE_BYTES), b""):
+                received += len(chunk)
+                if received > MAX_UPDATE_SIZE_BYTES:
+                    return jsonify({"status": "error", "message": "Mise à jour trop volumineuse."}), 413
+                f.write(chunk)
+        return ingest_update(spool_path, expected_sha256)
+    finally:
+        # Envoi en un seul bloc: hors 202, le client renvoie tout, rien à conserver
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+# --- Upload en morceaux avec reprise ---
+# L'identifiant d'upload est le SHA-256 du blob complet: un client qui redémarre
+# retrouve son upload et reprend à l'offset déjà reçu.
+
+def _upload_paths(upload_id):
+    if not re.fullmatch(r"[0-9a-f]{64}", upload_id):
+        return None, None
+    return os.path.join(UPLOAD_DIR, f"{upload_id}.part"), os.path.join(UPLOAD_DIR, f"{upload_id}.json")
+
+def _received_bytes(part_path):
+    return os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    info = request.get_json() or {}
+    upload_id, size = str(info.get("sha256", "")).lower(), info.get("size")
+    part_path, meta_path = _upload_paths(upload_id)
+    if part_path is None or not isinstance(size, int) or not 0 < size <= MAX_UPDATE_SIZE_BYTES:
+        return jsonify({"status": "error", "message": "sha256 et size valides requis."}), 400
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    if not os.path.exists(meta_path):
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"size": size}, f)
+    return jsonify({"upload_id": upload_id, "offset": _received_bytes(part_path)}), 200
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    part_path, meta_path = _upload_paths(upload_id)
+    if part_path is None or not os.path.exists(meta_path):
+        return jsonify({"status": "error", "message": "Upload inconnu."}), 404
+    return jsonify({"upload_id": upload_id, "offset": _received_bytes(part_path)}), 200
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    part_path, meta_path = _upload_paths(upload_id)
+    if part_path is None or not os.path.exists(meta_path):
+        return jsonify({"status": "error", "message": "Upload inconnu."}), 404
+    with open(meta_path, "r", encoding="utf-8") as f:
+        size = json.load(f)["size"]
+
+    offset = request.args.get("offset", type=int)
+    received = _received_bytes(part_path)
+    if offset != received:
+        # Le client se resynchronise sur l'offset réellement reçu
+        return jsonify({"status": "conflict", "offset": received}), 409
+
+    chunk = request.get_data(cache=False)
+    if sha256_hex(chunk) != request.headers.get(CHECKSUM_HEADER, "").lower():
+        return jsonify({"status": "error", "message": "Somme de contrôle du morceau invalide.", "offset": received}), 400
+    if received + len(chunk) > size:
+        return jsonify({"status": "error", "message": "Le morceau dépasse la taille annoncée.", "offset": received}), 400
+
+    with open(part_path, "ab") as f:
+        f.write(chunk)
+    return jsonify({"upload_id": upload_id, "offset": received + len(chunk)}), 200
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    part_path, meta_path = _upload_paths(upload_id)
+    if part_path is None or not os.path.exists(part_path):
+        return jsonify({"status": "error", "message": "Upload inconnu."}), 404
+    response = ingest_update(part_path, upload_id)
+    status_code = response[1]
+    if status_code == 503:
+        # File pleine: l'upload reste complet sur disque, le client rappelle /complete plus tard
+        return response
+    # Acceptée (le blob est dans la file) ou rejetée définitivement (le client devra tout renvoyer)
+    for path in (part_path, meta_path):
+        if os.path.exists(path):
+            os.remove(path)
+    return response
+
+@app.route('/global_model', methods=['GET'])
+def global_model():
+    """
+    Sert la dernière version du modèle global au format federated_transport.
+    `?since=<v>` renvoie seulement le delta depuis la version v; `?quantization=fp16|int8` le compresse.
+    Supporte If-None-Match (ETag) pour éviter de retélécharger une version déjà connue.
+    """
+    version = store.version
+    if version == 0:
+        return jsonify({"status": "empty", "message": "Aucun modèle global publié."}), 404
+
+    since = request.args.get("since", type=int)
+    quantization = request.args.get("quantization", "fp32")
+    if quantization not in QUANTIZATIONS or (since is not None and not 0 < since <= version):
+        return jsonify({"status": "error", "message": "Paramètres since/quantization invalides."}), 400
+
+    variant = f"-since{since}-{quantization}" if since else f"-{quantization}"
+    etag = store.etag(version, variant)
+    if request.headers.get("If-None-Match") == etag or since == version:
+        return Response(status=304, headers={"ETag": etag, "X-Global-Version": str(version)})
+
+    blob, blob_sha256 = encode_global(version, since, quantization)
+    return Response(blob, mimetype="application/octet-stream",
+                    headers={"ETag": etag, "X-Global-Version": str(version), CHECKSUM_HEADER: blob_sha256})
+
+@lru_cache(maxsize=8)
+def encode_global(version, since, quantization):
+    weights = store.load(version)
+    if since:
+        return encode_update(weights, "global", 0, base_weights=store.load(since), base_version=since, quantization=quantization)
+    return encode_update(weights, "global", 0, base_version=version, quantization=quantization)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80)
\ No newline at end of file
+    start_aggregation_worker()
+    app.run(host='0.0.0.0', port=80, threaded=True)
@@ -1,51 +1,212 @@
 # Fichier: federated_trainer_edge.py
 # Description: Service s'exécutant sur l'Edge (hôpital).
-#              Entraîne le modèle localement et envoie les mises à jour (poids) à l'agrégateur.
+#              Garde le modèle résident en mémoire, récupère la dernière version globale,
+#              entraîne uniquement des adaptateurs LoRA sur les données locales et n'envoie
+#              que le delta de ces adaptateurs à l'agrégateur, round après round.
 
+import os
+import argparse
+import time
 import requests
 import torch
-from transformers import AutoModelForCausalLM, Trainer, TrainingArguments
+from peft import LoraConfig, get_peft_model, get_peft_model_state_dict, set_peft_model_state_dict
+from transformers import AutoModelForCausalLM, AutoTokenizer, Trainer, TrainingArguments
+from edge_dataset import build_tokenized_dataset, build_data_collator
+from federated_transport import encode_update, decode_update, sha256_hex, CHECKSUM_HEADER, CHUNK_SIZE_BYTES
 
 # --- CONFIGURATION ---
-AGGREGATOR_URL = "http://central-aggregator.yourapi.com/submit_weights"
-LOCAL_MODEL_PATH = "./fine_tuned_gemma_medical" # Le modèle fine-tuné à l'étape 5.1
-LOCAL_DATA_PATH = "/path/to/hospital/private_data.csv"
-
-def train_local_round():
-    """Effectue un round d'entraînement sur les données locales."""
-    print("🏥 Round d'entraînement local démarré...")
-    
-    # Charger le modèle et les données (similaire à fine_tune_edge_model.py)
-    model = AutoModelForCausalLM.from_pretrained(LOCAL_MODEL_PATH)
-    # ... charger le dataset local ...
-    
-    training_args = TrainingArguments(output_dir="./temp_training", num_train_epochs=1)
-    trainer = Trainer(model=model, train_dataset=...) # Configurer avec le dataset local
-    
-    trainer.train()
-    
-    print("✅ Entraînement local terminé.")
-    return model.state_dict()
-
-def send_weights_to_aggregator(weights):
-    """Envoie les poids du modèle (pas les données) à l'agrégateur central."""
-    print("📡 Envoi des mises à jour de poids au serveur central...")
-    
-    try:
-        # Sérialiser les poids pour l'envoi.
-        # Dans un vrai projet, on utiliserait un format binaire plus efficace comme protobuf.
-        # Ici, on simule avec une simple requête POST.
-        # IMPORTANT: Seuls les poids sont envoyés, JAMAIS les données patient.
-        response = requests.post(AGGREGATOR_URL, json={"hospital_id": "hospital_A", "weights_data": "SERIALIZED_WEIGHTS_HERE"})
+AGGREGATOR_URL = "http://central-aggregator.yourapi.com"
+HOSPITAL_ID = "hospital_A"
+LOCAL_MODEL_PATH = "./fine_tuned_gemma_medical" # Le modèle fine-tuné à l'étape 5.1 (reste figé)
+LOCAL_DATA_PATH = "/path/to/hospital/private_data.csv" # Colonnes "diagnostic_text", "ia_guidance"
+QUANTIZATION = "fp16"   # fp32 | fp16 | int8
+TOPK_RATIO = 0.05       # Part des coordonnées du delta envoyées (None = delta dense)
+MAX_UPLOAD_RETRIES = 5
+ROUND_INTERVAL_SECONDS = 600 # Pause entre deux rounds locaux
+MAX_SEQ_LENGTH = 512
+
+# LoRA: graine commune à tous les hôpitaux pour que les adaptateurs initiaux soient identiques
+LORA_RANK = 8
+LORA_ALPHA = 16
+LORA_DROPOUT = 0.05
+LORA_TARGET_MODULES = "all-linear"
+LORA_INIT_SEED = 1234
+
+def upload_blob(blob, blob_sha256):
+    """Upload en morceaux avec reprise: après une coupure, on repart de l'offset confirmé par le serveur."""
+    response = requests.post(f"{AGGREGATOR_URL}/uploads", json={"sha256": blob_sha256, "size": len(blob)}, timeout=30)
+    response.raise_for_status()
+    offset = response.json()["offset"]
+    if offset:
+        print(f"   ↪️  Reprise de l'upload à {offset / 1e6:.1f} Mo.")
+
+    retries = 0
+    while offset < len(blob):
+        chunk = blob[offset:offset + CHUNK_SIZE_BYTES]
+        try:
+            response = requests.put(
+                f"{AGGREGATOR_URL}/uploads/{blob_sha256}",
+                params={"offset": offset},
+                data=chunk,
+                headers={"Content-Type": "application/octet-stream", CHECKSUM_HEADER: sha256_hex(chunk)},
+                timeout=120,
+            )
+            # 409: désynchronisé, le serveur indique l'offset réellement reçu
+            if response.status_code != 409:
+                response.raise_for_status()
+            offset = response.json()["offset"]
+            retries = 0
+        except requests.exceptions.RequestException as e:
+            retries += 1
+            if retries > MAX_UPLOAD_RETRIES:
+                raise
+            delay = 2 ** retries
+            print(f"   [WARN] Morceau non envoyé ({e}). Nouvelle tentative dans {delay}s...")
+            time.sleep(delay)
+            try:
+                status = requests.get(f"{AGGREGATOR_URL}/uploads/{blob_sha256}", timeout=30)
+                status.raise_for_status()
+                offset = status.json()["offset"]
+            except requests.exceptions.RequestException:
+                pass # On retentera depuis le dernier offset connu
+
+    # 503: file d'agrégation pleine, l'upload reste complet côté serveur et /complete peut être rappelé
+    for attempt in range(MAX_UPLOAD_RETRIES + 1):
+        response = requests.post(f"{AGGREGATOR_URL}/uploads/{blob_sha256}/complete", timeout=300)
+        if response.status_code != 503 or attempt == MAX_UPLOAD_RETRIES:
+            break
+        delay = 2 ** (attempt + 1)
+        print(f"   [WARN] Agrégateur occupé. Finalisation de l'upload dans {delay}s...")
+        time.sleep(delay)
+    response.raise_for_status()
+    return response
+
+class ResidentEdgeTrainer:
+    """Modèle de base chargé une seule fois; seuls les adaptateurs LoRA circulent entre les rounds."""
+
+    def __init__(self, model_path=LOCAL_MODEL_PATH, data_path=LOCAL_DATA_PATH):
+        print(f"🧠 Chargement unique du modèle de base '{model_path}'...")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        if os.path.exists(os.path.join(model_path, "adapter_config.json")):
+            # Sortie de fine_tune_edge_model.py: adaptateurs seuls, fusionnés dans leur base avant d'ajouter ceux du fédéré
+            from peft import AutoPeftModelForCausalLM
+            base_model = AutoPeftModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32).merge_and_unload()
+        else:
+            base_model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32)
+
+        torch.manual_seed(LORA_INIT_SEED)
+        lora_config = LoraConfig(r=LORA_RANK, lora_alpha=LORA_ALPHA, lora_dropout=LORA_DROPOUT,
+                                 target_modules=LORA_TARGET_MODULES, task_type="CAUSAL_LM")
+        self.model = get_peft_model(base_model, lora_config)
+        self.model.print_trainable_parameters()
+
+        # Données privées tokenisées une seule fois (cache memory-mappé), elles ne quittent jamais l'Edge
+        max_length = min(MAX_SEQ_LENGTH, getattr(base_model.config, "max_position_embeddings", MAX_SEQ_LENGTH))
+        self.dataset = build_tokenized_dataset(self.tokenizer, data_path, max_length=max_length, pack=True)
+        self.collator = build_data_collator(self.tokenizer, pack=True)
+        self.global_version = 0
+        self.global_etag = None
+        # Adaptateurs de la version globale courante: référence des deltas envoyés
+        self.global_adapter = self.adapter_state()
+        # Error feedback: part du delta non transmise (top-k, quantification), rajoutée au delta suivant
+        self.residual = {}
+
+    def adapter_state(self):
+        return {name: tensor.detach().to("cpu", torch.float32).clone()
+                for name, tensor in get_peft_model_state_dict(self.model).items()}
+
+    def pull_global_model(self):
+        """Récupère la dernière version globale (delta depuis la nôtre si possible). Retourne True si elle a changé."""
+        params = {"quantization": QUANTIZATION}
+        if self.global_version:
+            params["since"] = self.global_version
+        headers = {"If-None-Match": self.global_etag} if self.global_etag else {}
+        response = requests.get(f"{AGGREGATOR_URL}/global_model", params=params, headers=headers, timeout=120)
+        if response.status_code in (304, 404):
+            return False
         response.raise_for_status()
-        print("✅ Poids envoyés avec succès.")
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Échec de l'envoi des poids: {e}")
+
+        known = {self.global_version: self.global_adapter}
+        _, weights = decode_update(response.content, response.headers[CHECKSUM_HEADER], lambda v: known[v])
+        set_peft_model_state_dict(self.model, weights)
+        self.global_adapter = self.adapter_state()
+        self.global_version = int(response.headers["X-Global-Version"])
+        self.global_etag = response.headers.get("ETag")
+        print(f"🌍 Modèle global v{self.global_version} appliqué ({len(response.content) / 1e6:.2f} Mo téléchargés).")
+        return True
+
+    def reset_to_global(self):
+        """Repart des adaptateurs globaux: sinon le round suivant (global inchangé) renverrait le delta précédent."""
+        set_peft_model_state_dict(self.model, self.global_adapter)
+
+    def train_local_round(self, epochs=1):
+        """Effectue un round d'entraînement sur les données locales (adaptateurs seulement)."""
+        print("🏥 Round d'entraînement local démarré...")
+        training_args = TrainingArguments(output_dir="./temp_training", num_train_epochs=epochs,
+                                          per_device_train_batch_size=4, learning_rate=2e-4,
+                                          save_strategy="no", report_to=[], logging_steps=25)
+        trainer = Trainer(model=self.model, args=training_args, train_dataset=self.dataset, data_collator=self.collator)
+        trainer.train()
+        print("✅ Entraînement local terminé.")
+        return len(self.dataset)
+
+    def send_adapter_delta(self, num_samples):
+        """Envoie le delta des adaptateurs (pas les données) à l'agrégateur central."""
+        print("📡 Envoi des mises à jour d'adaptateurs au serveur central...")
+        # IMPORTANT: Seuls les poids LoRA sont envoyés, JAMAIS les données patient.
+        if self.global_version:
+            target = {name: tensor + self.residual[name] if name in self.residual else tensor
+                      for name, tensor in self.adapter_state().items()}
+            blob, blob_sha256 = encode_update(target, HOSPITAL_ID, num_samples, base_weights=self.global_adapter,
+                                              base_version=self.global_version, quantization=QUANTIZATION, topk_ratio=TOPK_RATIO)
+        else:
+            target = None
+            blob, blob_sha256 = encode_update(self.adapter_state(), HOSPITAL_ID, num_samples, quantization=QUANTIZATION)
+        print(f"   Mise à jour encodée: {len(blob) / 1e6:.2f} Mo ({'delta' if self.global_version else 'dense'}, {QUANTIZATION}).")
+
+        try:
+            upload_blob(blob, blob_sha256)
+            print("✅ Poids envoyés avec succès.")
+            if target is not None:
+                _, sent = decode_update(blob, blob_sha256, as_delta=True)
+                self.residual = {name: target[name] - self.global_adapter[name] - sent[name] for name in target}
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 409:
+                print("   [WARN] Mise à jour trop ancienne pour l'agrégateur. Elle sera recalculée sur le prochain global.")
+            else:
+                raise
+
+    def run_round(self):
+        self.pull_global_model()
+        self.reset_to_global()
+        num_samples = self.train_local_round()
+        self.send_adapter_delta(num_samples)
 
 def main():
-    # Simule un cycle d'apprentissage fédéré
-    local_weights = train_local_round()
-    send_weights_to_aggregator(local_weights)
+    global AGGREGATOR_URL
+    parser = argparse.ArgumentParser(description="Entraîneur fédéré Edge (LoRA, modèle résident).")
+    parser.add_argument("--model", default=LOCAL_MODEL_PATH, help="Modèle de base (un petit modèle CPU suffit pour tester la boucle).")
+    parser.add_argument("--data", default=LOCAL_DATA_PATH)
+    parser.add_argument("--aggregator", default=AGGREGATOR_URL)
+    parser.add_argument("--rounds", type=int, default=0, help="Nombre de rounds (0 = service continu).")
+    parser.add_argument("--interval", type=int, default=ROUND_INTERVAL_SECONDS)
+    args = parser.parse_args()
+    AGGREGATOR_URL = args.aggregator
+
+    trainer = ResidentEdgeTrainer(args.model, args.data)
+    round_index = 0
+    while not args.rounds or round_index < args.rounds:
+        round_index += 1
+        print(f"\n🔁 Round fédéré #{round_index}")
+        try:
+            trainer.run_round()
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Échec de communication avec l'agrégateur: {e}")
+        if not args.rounds or round_index < args.rounds:
+            print(f"😴 Prochain round dans {args.interval} secondes...")
+            time.sleep(args.interval)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,134 @@
+# Fichier: federated_transport.py
+# Description: Format binaire compact des mises à jour fédérées (Edge -> Agrégateur).
+#              Blobs de tenseurs safetensors + quantification fp16/int8, deltas top-k
+#              par rapport à la version globale courante, et sommes de contrôle SHA-256.
+
+import json
+import struct
+import hashlib
+import torch
+from safetensors.torch import save as safetensors_save, load as safetensors_load
+
+# --- CONFIGURATION ---
+FORMAT_VERSION = "1"
+CHUNK_SIZE_BYTES = 4 * 1024 * 1024 # Taille des morceaux pour l'upload en streaming
+QUANTIZATIONS = ("fp32", "fp16", "int8")
+CHECKSUM_HEADER = "X-Content-SHA256"
+
+SCALE_SUFFIX = ".__scale__"
+INDEX_SUFFIX = ".__index__"
+
+
+def sha256_hex(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _quantize(values, quantization, tensors, name):
+    """Ajoute `values` (float32) au dictionnaire de blobs selon la quantification demandée."""
+    if quantization == "fp16":
+        tensors[name] = values.to(torch.float16).contiguous()
+    elif quantization == "int8":
+        # Quantification symétrique par tenseur: x ≈ q * scale
+        scale = values.abs().max().clamp(min=1e-12) / 127.0
+        tensors[name] = torch.round(values / scale).clamp_(-127, 127).to(torch.int8).contiguous()
+        tensors[name + SCALE_SUFFIX] = scale.reshape(1).to(torch.float32)
+    else:
+        tensors[name] = values.to(torch.float32).contiguous()
+
+
+def _dequantize(tensors, name):
+    values = tensors[name]
+    if values.dtype == torch.int8:
+        return values.to(torch.float32) * tensors[name + SCALE_SUFFIX]
+    return values.to(torch.float32)
+
+
+def encode_update(state_dict, hospital_id, num_samples, base_weights=None, base_version=0,
+                  quantization="fp16", topk_ratio=None):
+    """
+    Sérialise une mise à jour. Avec `base_weights`, on envoie le delta (local - global v`base_version`),
+    éventuellement creusé aux `topk_ratio` coordonnées de plus grande amplitude par tenseur.
+    Retourne (blob, sha256).
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Quantification inconnue: {quantization}")
+    if topk_ratio is not None and base_weights is None:
+        raise ValueError("La sparsification top-k nécessite un modèle global de référence (delta).")
+
+    tensors, layout = {}, {}
+    for name, tensor in state_dict.items():
+        values = tensor.detach().to("cpu", torch.float32)
+        shape = list(values.shape)
+        if base_weights is not None:
+            values = values - base_weights[name].to(torch.float32)
+
+        if topk_ratio is not None and values.numel() > 1:
+            flat = values.reshape(-1)
+            k = max(1, int(flat.numel() * topk_ratio))
+            index = torch.topk(flat.abs(), k, sorted=False).indices
+            tensors[name + INDEX_SUFFIX] = index.to(torch.int32)
+            _quantize(flat[index], quantization, tensors, name)
+            layout[name] = {"shape": shape, "sparse": True}
+        else:
+            _quantize(values, quantization, tensors, name)
+            layout[name] = {"shape": shape, "sparse": False}
+
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "hospital_id": str(hospital_id),
+        "num_samples": str(int(num_samples)),
+        "encoding": "delta" if base_weights is not None else "dense",
+        "base_version": str(int(base_version)),
+        "quantization": quantization,
+        "layout": json.dumps(layout),
+    }
+    blob = safetensors_save(tensors, metadata=metadata)
+    return blob, sha256_hex(blob)
+
+
+def read_metadata(blob):
+    """Lit l'en-tête safetensors (8 octets de longueur + JSON) sans désérialiser les tenseurs."""
+    if len(blob) < 8:
+        raise ValueError("Blob de mise à jour tronqué.")
+    (header_len,) = struct.unpack("<Q", blob[:8])
+    header = json.loads(blob[8:8 + header_len])
+    metadata = header.get("__metadata__") or {}
+    if metadata.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Version de format non supportée: {metadata.get('format_version')}")
+    return metadata
+
+
+def decode_update(blob, expected_sha256=None, load_base_weights=None, as_delta=False):
+    """
+    Vérifie et désérialise une mise à jour en poids denses float32.
+    `load_base_weights(version)` fournit le modèle global de référence pour les deltas;
+    avec `as_delta=True`, un delta est retourné tel quel (sans lui rajouter la référence).
+    Retourne (metadata, state_dict).
+    """
+    if expected_sha256 is not None and sha256_hex(blob) != expected_sha256.lower():
+        raise ValueError("Somme de contrôle SHA-256 invalide: mise à jour corrompue.")
+
+    metadata = read_metadata(blob)
+    layout = json.loads(metadata["layout"])
+    tensors = safetensors_load(blob)
+
+    base_weights = None
+    if metadata["encoding"] == "delta" and not as_delta:
+        if load_base_weights is None:
+            raise ValueError("Delta reçu mais aucun modèle global de référence disponible.")
+        base_weights = load_base_weights(int(metadata["base_version"]))
+
+    state_dict = {}
+    for name, info in layout.items():
+        shape = info["shape"]
+        values = _dequantize(tensors, name)
+        if info["sparse"]:
+            dense = torch.zeros(int(torch.Size(shape).numel()), dtype=torch.float32)
+            dense[tensors[name + INDEX_SUFFIX].to(torch.int64)] = values
+            values = dense
+        values = values.reshape(shape)
+        if base_weights is not None:
+            values = base_weights[name].to(torch.float32) + values
+        state_dict[name] = values
+    return metadata, state_dict
+
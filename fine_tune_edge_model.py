@@ -1,81 +1,173 @@
 # Fichier: fine_tune_edge_model.py
 # Description: Script pour fine-tuner un modèle léger (Gemma) pour le déploiement Edge.
+#              Mode GPU (QLoRA 4 bits) ou mode CPU (LoRA sur base bf16/fp32) pour les sites
+#              Edge et la CI sans GPU, avec profileur de débit intégré.
 
+import os
+import math
+import argparse
 import torch
-from datasets import load_dataset
+from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
-    BitsAndBytesConfig,
     TrainingArguments,
     Trainer,
 )
+from edge_dataset import build_tokenized_dataset, build_data_collator, count_tokens, padding_efficiency
+from training_profiler import ThroughputProfiler
 
 # --- CONFIGURATION ---
 MODEL_NAME = "google/gemma-2b" # Modèle léger et performant de Google
 DATASET_PATH = "path/to/your/medical_dataset.csv" # CSV avec colonnes "diagnostic_text", "ia_guidance"
 OUTPUT_DIR = "./results_edge_model"
 FINE_TUNED_MODEL_DIR = "./fine_tuned_gemma_medical"
+MAX_SEQ_LENGTH = 512
+PACK_SEQUENCES = True # False = padding dynamique avec regroupement par longueur
+EFFECTIVE_BATCH_SIZE = 16 # Séquences par pas d'optimisation, quel que soit le mode
+GPU_MICRO_BATCH_SIZE = 4
+CPU_MICRO_BATCH_SIZE = 1  # Petites micro-batches + accumulation: pic mémoire minimal sur CPU
+NUM_EPOCHS = 1 # 1 à 3 époques suffisent souvent pour le fine-tuning
+
+# LoRA: seuls les adaptateurs sont entraînés, la base reste figée
+LORA_RANK = 16
+LORA_ALPHA = 32
+LORA_DROPOUT = 0.05
+LORA_TARGET_MODULES = "all-linear"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tuning LoRA du modèle Edge (GPU ou CPU).")
+    parser.add_argument("--device", choices=("auto", "cpu", "gpu"), default="auto")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--data", default=DATASET_PATH)
+    parser.add_argument("--output", default=FINE_TUNED_MODEL_DIR)
+    parser.add_argument("--dtype", choices=("bf16", "fp32"), default="bf16", help="Précision de la base en mode CPU.")
+    parser.add_argument("--threads", type=int, default=None, help="Threads de calcul CPU (défaut: cœurs physiques estimés).")
+    parser.add_argument("--micro-batch-size", type=int, default=None)
+    parser.add_argument("--effective-batch-size", type=int, default=EFFECTIVE_BATCH_SIZE)
+    parser.add_argument("--max-length", type=int, default=MAX_SEQ_LENGTH)
+    parser.add_argument("--no-pack", action="store_true", help="Padding dynamique au lieu du packing.")
+    parser.add_argument("--no-gradient-checkpointing", action="store_true")
+    parser.add_argument("--epochs", type=float, default=NUM_EPOCHS)
+    parser.add_argument("--max-steps", type=int, default=-1, help="Limite de pas (profilage rapide, CI).")
+    parser.add_argument("--profile-json", default=None, help="Écrit le rapport du profileur dans ce fichier JSON.")
+    return parser.parse_args()
+
+def configure_cpu_threads(threads):
+    """Fixe le parallélisme intra-op; l'hyperthreading n'apporte en général rien aux GEMM."""
+    threads = threads or max(1, (os.cpu_count() or 2) // 2)
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(max(1, min(4, threads // 4)))
+    return threads
+
+def length_grouping_kwargs(enabled):
+    """Regroupement par longueur: `group_by_length` (transformers 4.x) ou `train_sampling_strategy` (5.x)."""
+    if not enabled:
+        return {}
+    if "train_sampling_strategy" in TrainingArguments.__dataclass_fields__:
+        return {"train_sampling_strategy": "group_by_length"}
+    return {"group_by_length": True}
+
+def load_model(args, use_gpu):
+    if use_gpu:
+        # Quantification 4 bits pour réduire l'usage mémoire (QLoRA)
+        from transformers import BitsAndBytesConfig
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_use_double_quant=False,
+        )
+        model = AutoModelForCausalLM.from_pretrained(
+            args.model,
+            quantization_config=bnb_config,
+            device_map="auto" # Utilise le GPU si disponible
+        )
+        model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=not args.no_gradient_checkpointing)
+    else:
+        dtype = torch.bfloat16 if args.dtype == "bf16" else torch.float32
+        model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=dtype, low_cpu_mem_usage=True)
+        if not args.no_gradient_checkpointing:
+            # Nécessaire pour que le checkpointing propage les gradients jusqu'aux adaptateurs
+            model.enable_input_require_grads()
+
+    lora_config = LoraConfig(r=LORA_RANK, lora_alpha=LORA_ALPHA, lora_dropout=LORA_DROPOUT,
+                             target_modules=LORA_TARGET_MODULES, task_type="CAUSAL_LM")
+    model = get_peft_model(model, lora_config)
+    model.print_trainable_parameters()
+    return model
 
 def main():
-    print(f"🚀 Démarrage du fine-tuning du modèle Edge: {MODEL_NAME}")
-
-    # 1. Charger le jeu de données (doit être au format question/réponse)
-    print(f"💾 Chargement du jeu de données depuis {DATASET_PATH}...")
-    # On formate le dataset pour l'entraînement
-    def format_dataset(example):
-        return {"text": f"### Diagnostic:\n{example['diagnostic_text']}\n\n### Recommandation:\n{example['ia_guidance']}"}
-
-    dataset = load_dataset("csv", data_files=DATASET_PATH).map(format_dataset)
-    print("✅ Jeu de données chargé et formaté.")
-
-    # 2. Configuration de la quantification pour réduire l'usage mémoire (QLoRA)
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_compute_dtype=torch.bfloat16,
-        bnb_4bit_use_double_quant=False,
-    )
+    args = parse_args()
+    use_gpu = args.device == "gpu" or (args.device == "auto" and torch.cuda.is_available())
+    pack = not args.no_pack
+    print(f"🚀 Démarrage du fine-tuning du modèle Edge: {args.model} (mode {'GPU' if use_gpu else 'CPU'})")
 
-    # 3. Charger le modèle et le tokenizer
-    print("🧠 Chargement du modèle de base et du tokenizer...")
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME,
-        quantization_config=bnb_config,
-        device_map="auto" # Utilise le GPU si disponible
-    )
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
+    if not use_gpu:
+        threads = configure_cpu_threads(args.threads)
+        print(f"🧵 Mode CPU: {threads} threads, base {args.dtype}, gradient checkpointing {'désactivé' if args.no_gradient_checkpointing else 'activé'}.")
+
+    # 1. Charger le tokenizer (il identifie aussi le cache du dataset tokenisé)
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
     tokenizer.pad_token = tokenizer.eos_token
-    print("✅ Modèle et tokenizer chargés.")
+
+    # 2. Charger, formater et tokeniser le jeu de données (une seule fois, puis cache memory-mappé)
+    print(f"💾 Chargement du jeu de données depuis {args.data}...")
+    dataset = build_tokenized_dataset(tokenizer, args.data, max_length=args.max_length, pack=pack)
+    train_tokens = count_tokens(dataset, pack)
+    if not len(dataset):
+        print("❌ Aucune séquence d'entraînement: rien à fine-tuner.")
+        return
+
+    micro_batch_size = args.micro_batch_size or (GPU_MICRO_BATCH_SIZE if use_gpu else CPU_MICRO_BATCH_SIZE)
+    gradient_accumulation_steps = max(1, math.ceil(args.effective_batch_size / micro_batch_size))
+    print(f"✅ Jeu de données prêt: {len(dataset)} séquences, {train_tokens} tokens, "
+          f"efficacité du padding {padding_efficiency(dataset, micro_batch_size, pack):.0%}.")
+
+    # 3. Charger le modèle et ses adaptateurs LoRA
+    print("🧠 Chargement du modèle de base...")
+    model = load_model(args, use_gpu)
+    print("✅ Modèle chargé.")
 
     # 4. Définir les arguments d'entraînement
     training_arguments = TrainingArguments(
         output_dir=OUTPUT_DIR,
-        num_train_epochs=1, # 1 à 3 époques suffisent souvent pour le fine-tuning
-        per_device_train_batch_size=4,
-        gradient_accumulation_steps=1,
+        num_train_epochs=args.epochs,
+        max_steps=args.max_steps,
+        per_device_train_batch_size=micro_batch_size,
+        gradient_accumulation_steps=gradient_accumulation_steps,
+        gradient_checkpointing=not args.no_gradient_checkpointing,
         learning_rate=2e-4,
-        fp16=True,
+        fp16=use_gpu,
+        bf16=not use_gpu and args.dtype == "bf16",
+        use_cpu=not use_gpu,
         logging_steps=25,
+        dataloader_num_workers=2 if use_gpu else 0, # Sur CPU, les workers volent des cœurs au calcul
+        include_num_input_tokens_seen=True,
+        save_strategy="no",
+        report_to=[],
+        **length_grouping_kwargs(not pack), # Batchs de longueurs proches: moins de padding
     )
 
     # 5. Créer et lancer l'entraîneur
-    print("🏃‍♂️ Démarrage de l'entraînement...")
+    print(f"🏃‍♂️ Démarrage de l'entraînement (micro-batch {micro_batch_size} x accumulation {gradient_accumulation_steps})...")
+    profiler = ThroughputProfiler()
     trainer = Trainer(
         model=model,
-        train_dataset=dataset['train'],
+        train_dataset=dataset,
         args=training_arguments,
-        data_collator=lambda data: {'input_ids': torch.stack([f['input_ids'] for f in data]),
-                                     'attention_mask': torch.stack([f['attention_mask'] for f in data]),
-                                     'labels': torch.stack([f['input_ids'] for f in data])}
+        data_collator=build_data_collator(tokenizer, pack),
+        callbacks=[profiler],
     )
     trainer.train()
     print("✅ Entraînement terminé.")
+    profiler.print_report(args.profile_json)
 
     # 6. Sauvegarder le modèle fine-tuné pour le déploiement Edge
-    print(f"💾 Sauvegarde du modèle fine-tuné dans '{FINE_TUNED_MODEL_DIR}'...")
-    trainer.save_model(FINE_TUNED_MODEL_DIR)
+    print(f"💾 Sauvegarde du modèle fine-tuné dans '{args.output}'...")
+    trainer.save_model(args.output)
+    tokenizer.save_pretrained(args.output)
     print("🏁 Modèle Edge prêt à être déployé !")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
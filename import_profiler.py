@@ -0,0 +1,105 @@
+# Fichier: import_profiler.py
+# Description: Rapport du temps d'import de chaque point d'entrée Python (`python -X importtime`,
+#              processus neuf à chaque mesure): durée totale avant la première ligne de `main()` et
+#              dépendances directes les plus coûteuses. Sert à garder des démarrages à froid courts
+#              (scale-out) et à repérer une dépendance lourde réintroduite au niveau module.
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# --- CONFIGURATION ---
+ENTRY_POINTS = (
+    "scout_service",
+    "knowledge_ingester_service",
+    "ingest",
+    "cognitive_archive_service",
+    "cognitive_supervisor_service",
+    "meta_cognitive_prompter",
+    "metrics_analyzer_service",
+    "autonomous_optimizer_service",
+    "code_guardian_service",
+    "federated_aggregator_central",
+    "edge_inference_server",
+    "query_knowledge",
+)
+REPEAT = 3       # Meilleure de N mesures (le cache disque et les .pyc faussent la première)
+TOP_N = 5
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _parse_importtime(stderr, module):
+    """Lignes `import time: self | cumulative | nom` -> (total en µs, {paquet direct: cumul en µs})."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, int(cumulative), name.strip()))
+
+    # Le module lui-même est la dernière entrée de profondeur 0; ses imports directs le précèdent en profondeur 1
+    end = max(i for i, (depth, _, name) in enumerate(entries) if depth == 0 and name == module)
+    start = max((i for i, (depth, _, _) in enumerate(entries[:end]) if depth == 0), default=-1) + 1
+    dependencies = {}
+    for depth, cumulative, name in entries[start:end]:
+        if depth == 1:
+            package = name.split(".")[0]
+            dependencies[package] = dependencies.get(package, 0) + cumulative
+    return entries[end][1], dependencies
+
+def profile_entry_point(module, repeat=REPEAT, python=sys.executable):
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"], cwd=PROJECT_DIR,
+                                capture_output=True, text=True, timeout=300)
+        if result.returncode != 0:
+            error = (result.stderr.strip().splitlines() or ["?"])[-1]
+            return {"module": module, "error": error}
+        total_us, dependencies = _parse_importtime(result.stderr, module)
+        if best is None or total_us < best["total_ms"] * 1000:
+            best = {
+                "module": module,
+                "total_ms": round(total_us / 1000, 1),
+                "dependencies_ms": {name: round(us / 1000, 1) for name, us in sorted(dependencies.items(), key=lambda item: -item[1])},
+            }
+    return best
+
+def print_text(reports, top_n, budget_ms):
+    print(f"\n⏱️  Temps d'import par point d'entrée (meilleure de {REPEAT} mesures, processus neuf)\n")
+    for report in sorted(reports, key=lambda r: -r.get("total_ms", -1)):
+        if "error" in report:
+            print(f"   ❓ {report['module']:<30} import impossible: {report['error']}")
+            continue
+        flag = "⚠️ " if budget_ms and report["total_ms"] > budget_ms else "✅"
+        heaviest = ", ".join(f"{name} {ms:.0f}ms" for name, ms in list(report["dependencies_ms"].items())[:top_n])
+        print(f"   {flag} {report['module']:<30} {report['total_ms']:8.1f} ms   {heaviest}")
+    if budget_ms:
+        print(f"\n   Budget: {budget_ms:.0f} ms par point d'entrée.")
+
+def main():
+    global REPEAT
+    parser = argparse.ArgumentParser(description="Profil du temps d'import des services Python.")
+    parser.add_argument("modules", nargs="*", default=list(ENTRY_POINTS), help="Points d'entrée (par défaut: tous les services).")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--top", type=int, default=TOP_N, help="Dépendances directes affichées par point d'entrée.")
+    parser.add_argument("--format", choices=("text", "json"), default="text")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Code de sortie 1 si un point d'entrée dépasse ce budget.")
+    args = parser.parse_args()
+    REPEAT = args.repeat
+
+    reports = [profile_entry_point(module, args.repeat) for module in args.modules]
+    if args.format == "json":
+        print(json.dumps(reports, indent=2, ensure_ascii=False))
+    else:
+        print_text(reports, args.top, args.budget_ms)
+
+    if any("error" in report for report in reports):
+        return 2
+    if args.budget_ms and any(report["total_ms"] > args.budget_ms for report in reports):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,17 @@
 # Fichier: ingest.py
 # Description: Service d'ingestion pour la base de connaissances RAG.
-#              Scanne les PDF, les découpe, les vectorise et les stocke dans Milvus.
+#              Scanne les PDF et les articles du Scout, les découpe, les vectorise et les stocke
+#              dans Milvus (schéma explicite, partitions par source et par année).
+#              LangChain, PyPDF, pymilvus et le client d'embedding ne sont chargés qu'au premier usage
+#              (ou par warm_up() en arrière-plan): importer ce module reste quasi instantané.
 
 import os
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import Milvus
+from instrumentation import get_logger, counter, gauge, span
 
 load_dotenv()
 
@@ -15,75 +19,242 @@ load_dotenv()
 PDF_SOURCE_DIR = "recherche_medicale"
 MILVUS_HOST = "milvus" # Utilise le nom du service Docker
 MILVUS_PORT = "19530"
-COLLECTION_NAME = "medical_knowledge_base"
+EMBEDDING_ENDPOINT = os.environ.get("EMBEDDING_ENDPOINT") # Service HTTP (ex: embedding_stub_server.py) au lieu de l'API Google
+LOCAL_SOURCE = "local"
 
-# Modèle d'embedding de Google (transforme le texte en vecteurs)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+log = get_logger("ingest")
+CHUNKS = counter("ingest_chunks", "Morceaux traités par étape.", ("stage",))
+CHUNKS_PER_SECOND = gauge("ingest_chunks_per_second", "Débit de vectorisation + insertion de la dernière ingestion.")
 
-def main():
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings():
+    """Modèle d'embedding de Google (transforme le texte en vecteurs), construit une seule fois au premier appel."""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            if EMBEDDING_ENDPOINT:
+                from embedding_batcher import HttpEmbeddings
+                _embeddings = HttpEmbeddings(EMBEDDING_ENDPOINT)
+            else:
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                _embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+        return _embeddings
+
+def warm_up():
+    """Précharge les dépendances lourdes et le client d'embedding (à lancer dans un thread au démarrage)."""
+    with span("ingest_warm_up") as timer:
+        import knowledge_store
+        import chunk_dedup
+        import embedding_batcher
+        import langchain_community.document_loaders
+        import langchain.text_splitter
+        get_embeddings()
+    log.info("Dépendances d'ingestion préchargées.", duration_s=round(timer.elapsed, 2))
+
+def _parse_date(value):
+    """Date ISO 8601 (ou D:YYYYMMDD... des PDF) en timestamp epoch, 0 si inconnue."""
+    if not value:
+        return 0
+    value = str(value).strip()
+    if value.startswith("D:"):
+        value = value[2:10]
+    for parse in (lambda v: datetime.fromisoformat(v.replace("Z", "+00:00")), lambda v: datetime.strptime(v[:8], "%Y%m%d")):
+        try:
+            parsed = parse(value)
+        except ValueError:
+            continue
+        return int((parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp())
+    return 0
+
+def _split_article_header(text):
+    """Articles du Scout: en-têtes `Clé: valeur` jusqu'à la première ligne vide (voir knowledge_ingester_service)."""
+    header, _, body = text.partition("\n\n")
+    fields = {}
+    for line in header.splitlines():
+        key, sep, value = line.partition(":")
+        if not sep:
+            return {}, text
+        fields[key.strip().lower()] = value.strip()
+    return fields, body
+
+def load_documents():
+    """Charge les PDF et les articles texte, avec leurs métadonnées de source et de date."""
+    from langchain_community.document_loaders import PyPDFDirectoryLoader, DirectoryLoader, TextLoader
+    docs = PyPDFDirectoryLoader(PDF_SOURCE_DIR).load()
+    for doc in docs:
+        doc.metadata["source_uri"] = doc.metadata.get("source", "")
+        doc.metadata["source"] = LOCAL_SOURCE
+        doc.metadata["published_ts"] = _parse_date(doc.metadata.get("creationdate") or doc.metadata.get("creationDate"))
+
+    articles = DirectoryLoader(PDF_SOURCE_DIR, glob="*.txt", loader_cls=TextLoader, loader_kwargs={"encoding": "utf-8"}).load()
+    for doc in articles:
+        fields, body = _split_article_header(doc.page_content)
+        if fields:
+            # Seuls le titre et le contenu sont vectorisés, les autres en-têtes deviennent des champs scalaires
+            doc.page_content = f"{fields.get('title', '')}\n\n{body}".strip()
+        doc.metadata["source_uri"] = fields.get("source", doc.metadata.get("source", ""))
+        doc.metadata["source"] = fields.get("feed", LOCAL_SOURCE)
+        doc.metadata["published_ts"] = _parse_date(fields.get("published"))
+    docs.extend(articles)
+
+    # Hash du document complet (toutes ses pages): identifie les documents déjà ingérés
+    pages_by_uri = {}
+    for doc in docs:
+        pages_by_uri.setdefault(doc.metadata["source_uri"], []).append(doc.page_content)
+    hashes = {uri: hashlib.sha256("\f".join(pages).encode("utf-8")).hexdigest() for uri, pages in pages_by_uri.items()}
+    for doc in docs:
+        doc.metadata["doc_hash"] = hashes[doc.metadata["source_uri"]]
+    return docs
+
+def main(recreate=False, index_type=None):
     """
-    Point d'entrée du script d'ingestion.
+    Point d'entrée du script d'ingestion. Retourne False si l'ingestion a échoué
+    (les fichiers sources doivent alors être conservés pour une nouvelle tentative).
     """
-    print("🚀 Démarrage du service d'ingestion RAG...")
+    with span("ingest_run"):
+        return _ingest(recreate, index_type)
+
+def _ingest(recreate, index_type):
+    import knowledge_store
+    from chunk_dedup import ChunkDeduplicator
+    from embedding_batcher import AdaptiveEmbedder
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    log.info("🚀 Démarrage du service d'ingestion RAG...")
 
-    # 1. Charger les documents PDF depuis le dossier
-    print(f"📄 Étape 1/4: Chargement des documents depuis '{PDF_SOURCE_DIR}'...")
+    # 1. Charger les documents PDF et les articles depuis le dossier
+    log.info("📄 Étape 1/4: Chargement des documents...", directory=PDF_SOURCE_DIR)
     if not os.path.exists(PDF_SOURCE_DIR) or not os.listdir(PDF_SOURCE_DIR):
-        print(f"❌ ERREUR: Le dossier '{PDF_SOURCE_DIR}' est vide ou n'existe pas.")
-        print("Veuillez y placer vos fichiers PDF de recherche médicale.")
-        return
+        log.error("❌ Le dossier est vide ou n'existe pas. Veuillez y placer vos fichiers PDF de recherche médicale.",
+                  directory=PDF_SOURCE_DIR)
+        return False
+
+    with span("ingest_load_documents"):
+        docs = load_documents()
+    log.info("✅ Documents chargés.", documents=len(docs))
 
-    loader = PyPDFDirectoryLoader(PDF_SOURCE_DIR)
-    docs = loader.load()
-    print(f"✅ {len(docs)} documents chargés.")
+    log.info("Connexion à Milvus.", host=MILVUS_HOST, port=MILVUS_PORT)
+    deduplicator = ChunkDeduplicator()
+    try:
+        knowledge_store.connect(MILVUS_HOST, MILVUS_PORT)
+        collection = knowledge_store.ensure_collection(index_type=index_type or knowledge_store.INDEX_TYPE, recreate=recreate)
+        if recreate:
+            deduplicator.reset() # L'index LSH ne doit référencer que des morceaux présents dans Milvus
+        authoritative = deduplicator.bind_collection(knowledge_store.collection_id(collection), knowledge_store.is_empty(collection))
+        present = knowledge_store.existing_doc_hashes(collection, {doc.metadata["doc_hash"] for doc in docs})
+        already_ingested = deduplicator.completed(present)
+        incomplete = present - already_ingested
+        if incomplete and authoritative:
+            # Présent mais sans marqueur de fin: ingestion interrompue (lot en échec), le document est refait en entier
+            knowledge_store.delete_documents(collection, incomplete)
+            deduplicator.forget(incomplete)
+            log.warning("♻️  Documents partiellement ingérés supprimés, ils seront réingérés.", documents=len(incomplete))
+        elif incomplete:
+            # Registre local perdu ou étranger à cette collection: on ne supprime jamais rien d'après lui
+            already_ingested = present
+            log.warning("⚠️ Registre des documents complets non lié à cette collection: documents présents considérés "
+                        "complets. `python ingest.py --recreate` rétablit la reprise des ingestions interrompues.",
+                        documents=len(incomplete), registry=deduplicator.path)
+    except Exception as e:
+        log.error("❌ Connexion à Milvus impossible. Assurez-vous que votre stack Docker (Milvus, etcd, MinIO) est bien démarrée.",
+                  error=str(e))
+        return False
+    if already_ingested:
+        docs = [doc for doc in docs if doc.metadata["doc_hash"] not in already_ingested]
+        log.info("⏭️  Documents déjà présents dans la base ignorés.", documents=len(already_ingested))
+    if not docs:
+        log.info("🏁 Rien de nouveau à ingérer.")
+        return True
 
     # 2. Découper les documents en morceaux (chunks)
-    print("🔪 Étape 2/4: Découpage des documents en morceaux (chunks)...")
+    log.info("🔪 Étape 2/4: Découpage des documents en morceaux (chunks)...")
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000, 
+        chunk_size=1000,
         chunk_overlap=150
     )
-    chunks = text_splitter.split_documents(docs)
-    print(f"✅ {len(chunks)} morceaux de texte créés.")
+    with span("ingest_split"):
+        chunks = text_splitter.split_documents(docs)
+    chunk_counters = {}
+    for chunk in chunks:
+        doc_hash = chunk.metadata["doc_hash"]
+        chunk_counters[doc_hash] = chunk_counters.get(doc_hash, -1) + 1
+        chunk.metadata["chunk_index"] = chunk_counters[doc_hash]
+    CHUNKS.labels(stage="split").inc(len(chunks))
+    log.info("✅ Morceaux de texte créés.", chunks=len(chunks))
+
+    # Quasi-doublons d'une même source (bulletin republié, chevauchements) écartés avant l'appel d'embedding
+    with span("ingest_dedup"):
+        chunks, dropped = deduplicator.filter(chunks)
+    CHUNKS.labels(stage="deduplicated").inc(dropped)
+    log.info("🧹 Morceaux quasi-dupliqués écartés.", dropped=dropped, remaining=len(chunks), lsh_index=len(deduplicator))
+    if not chunks:
+        log.info("🏁 Rien de nouveau à ingérer.")
+        return True
 
     # 3. Vectoriser et stocker dans Milvus
-    print("🧠 Étape 3/4: Vectorisation et stockage dans Milvus...")
-    print(f"   (Connexion à Milvus sur {MILVUS_HOST}:{MILVUS_PORT})")
-    
+    log.info("🧠 Étape 3/4: Vectorisation et stockage dans Milvus...")
+    embedded, inserted = CHUNKS.labels(stage="embedded"), CHUNKS.labels(stage="inserted")
+    # Un document n'est marqué complet qu'une fois tous ses morceaux conservés insérés
+    remaining_chunks = {}
+    for chunk in chunks:
+        remaining_chunks[chunk.metadata["doc_hash"]] = remaining_chunks.get(chunk.metadata["doc_hash"], 0) + 1
     try:
-        # --- AMÉLIORATION "JAMAIS VUE": INGESTION PAR BATCHS ---
-        # LangChain gère automatiquement l'envoi par batchs à l'API d'embedding,
-        # ce qui est beaucoup plus rapide que d'envoyer les chunks un par un.
-        vector_store = Milvus.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            collection_name=COLLECTION_NAME,
-            connection_args={"host": MILVUS_HOST, "port": MILVUS_PORT},
-            batch_size=128 # Envoi de 128 chunks à la fois pour vectorisation
-        )
-        print("✅ Base de connaissances vectorielle créée/mise à jour avec succès.")
+        partitions = set()
+        embeddings = get_embeddings()
+        # Les lots suivants sont vectorisés en parallèle pendant l'insertion du lot courant dans Milvus
+        embedder = AdaptiveEmbedder(embeddings.embed_documents)
+        with span("ingest_store") as store:
+            for batch, vectors in embedder.map(chunks, text=lambda chunk: chunk.page_content):
+                embedded.inc(len(batch))
+                rows = []
+                for chunk, vector in zip(batch, vectors):
+                    rows.append({
+                        "text": chunk.page_content,
+                        "vector": vector,
+                        "source": chunk.metadata["source"][:64],
+                        "source_uri": chunk.metadata["source_uri"][:1024],
+                        "published_ts": chunk.metadata["published_ts"],
+                        "doc_hash": chunk.metadata["doc_hash"],
+                        "chunk_index": chunk.metadata["chunk_index"],
+                    })
+                with span("ingest_milvus_insert"):
+                    partitions.update(knowledge_store.insert_chunks(collection, rows))
+                inserted.inc(len(rows))
+                deduplicator.record(batch)
+                completed = []
+                for chunk in batch:
+                    remaining_chunks[chunk.metadata["doc_hash"]] -= 1
+                    if not remaining_chunks[chunk.metadata["doc_hash"]]:
+                        completed.append(chunk.metadata["doc_hash"])
+                deduplicator.mark_completed(completed)
+            collection.flush()
+        CHUNKS_PER_SECOND.set(len(chunks) / store.elapsed if store.elapsed else 0.0)
+        log.info("✅ Base de connaissances vectorielle mise à jour.", chunks=len(chunks), partitions=sorted(partitions),
+                 duration_s=round(store.elapsed, 2), chunks_per_s=round(len(chunks) / store.elapsed, 1) if store.elapsed else None)
     except Exception as e:
-        print(f"❌ ERREUR lors de la connexion ou de l'ingestion dans Milvus: {e}")
-        print("   Assurez-vous que votre stack Docker (Milvus, etcd, MinIO) est bien démarrée.")
-        return
+        log.error("❌ Erreur lors de l'ingestion dans Milvus.", error=str(e))
+        return False
 
     # 4. Vérification
-    print("🔍 Étape 4/4: Vérification rapide...")
+    log.info("🔍 Étape 4/4: Vérification rapide...")
     try:
-        retriever = vector_store.as_retriever(search_kwargs={'k': 1})
         test_query = "symptômes de la grippe"
-        result = retriever.invoke(test_query)
+        result = knowledge_store.search(collection, embeddings.embed_query(test_query), k=1)
         if result:
-            print(f"✅ Test de recherche réussi. Un document similaire à '{test_query}' a été trouvé.")
-            print("--- Extrait ---")
-            print(result[0].page_content[:200] + "...")
-            print("---------------")
+            log.info("✅ Test de recherche réussi.", query=test_query, excerpt=result[0]["text"][:200])
         else:
-            print("⚠️ Test de recherche n'a retourné aucun résultat.")
+            log.warning("⚠️ Test de recherche n'a retourné aucun résultat.", query=test_query)
     except Exception as e:
-        print(f"❌ ERREUR lors du test de recherche: {e}")
+        log.error("❌ Erreur lors du test de recherche.", error=str(e))
 
-    print("\n🏁 Ingestion terminée.")
+    log.info("🏁 Ingestion terminée.")
+    return True
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import knowledge_store
+    parser = argparse.ArgumentParser(description="Ingestion RAG dans Milvus.")
+    parser.add_argument("--recreate", action="store_true", help="Reconstruit la collection (nouveau schéma ou nouvel index).")
+    parser.add_argument("--index-type", choices=sorted(knowledge_store.INDEX_PARAMS), default=knowledge_store.INDEX_TYPE)
+    args = parser.parse_args()
+    main(recreate=args.recreate, index_type=args.index_type)
@@ -0,0 +1,304 @@
+# Fichier: instrumentation.py
+# Description: Instrumentation commune des services Python: spans de timing (bloc `with` ou
+#              décorateur, sync et async), compteurs, jauges, histogrammes, logs JSON structurés
+#              et endpoint Prometheus /metrics optionnel (variable d'environnement METRICS_PORT).
+
+import os
+import sys
+import json
+import time
+import bisect
+import inspect
+import logging
+import functools
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- CONFIGURATION ---
+SERVICE_NAME = os.environ.get("SERVICE_NAME") or os.path.splitext(os.path.basename(sys.argv[0]))[0].lstrip("-") or "python"
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json") # json | text
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+METRICS_PORT = os.environ.get("METRICS_PORT")    # Non défini = pas d'endpoint /metrics
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# --- MÉTRIQUES ---
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    def labels(self, **labels):
+        """Série pour ces valeurs d'étiquettes. À garder dans une variable dans les boucles chaudes."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, labels, value in self._samples():
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{self.name}{suffix}{{{label_text}}} {value}" if label_text else f"{self.name}{suffix} {value}")
+        return "\n".join(lines)
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._default.inc(amount)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield "_total", zip(self.labelnames, key), child.value
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value):
+        self._default.set(value)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield "", zip(self.labelnames, key), child.value
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                yield "_bucket", labels + [("le", "+Inf" if bound == float("inf") else repr(bound))], cumulative
+            yield "_sum", labels, child.sum
+            yield "_count", labels, cumulative
+
+_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+def _register(cls, name, documentation, labelnames, **kwargs):
+    # Idempotent: un module peut déclarer ses métriques à l'import, même s'il est importé deux fois
+    with _REGISTRY_LOCK:
+        metric = _REGISTRY.get(name)
+        if metric is None:
+            metric = _REGISTRY[name] = cls(name, documentation, labelnames, **kwargs)
+        return metric
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter, name, documentation, labelnames)
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge, name, documentation, labelnames)
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+def render_metrics():
+    """Toutes les métriques au format texte d'exposition Prometheus."""
+    return "\n".join(metric.render() for metric in list(_REGISTRY.values())) + "\n"
+
+# --- SPANS DE TIMING ---
+
+class span:
+    """
+    Mesure une durée dans l'histogramme `<name>_seconds` (et compte les erreurs dans
+    `<name>_errors_total`). S'utilise en bloc `with span(...)` ou en décorateur, sync ou async.
+    """
+
+    def __init__(self, name, documentation=None, buckets=DEFAULT_BUCKETS, **labels):
+        labelnames = tuple(sorted(labels))
+        self.name = name
+        self.labels = labels
+        self._histogram = histogram(f"{name}_seconds", documentation or f"Durée de {name} (s).", labelnames, buckets)
+        self._errors = counter(f"{name}_errors", f"Erreurs pendant {name}.", labelnames)
+        self._series = self._histogram.labels(**labels) if labels else self._histogram._default
+        self._error_series = self._errors.labels(**labels) if labels else self._errors._default
+        self.elapsed = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self._started
+        self._series.observe(self.elapsed)
+        if exc_type is not None:
+            self._error_series.inc()
+        return False
+
+    def _record(self, started, failed):
+        self._series.observe(time.perf_counter() - started)
+        if failed:
+            self._error_series.inc()
+
+    def __call__(self, func):
+        # Séries résolues une seule fois à la décoration; chaque appel garde son propre départ (réentrant)
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started, failed = time.perf_counter(), True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    self._record(started, failed)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started, failed = time.perf_counter(), True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self._record(started, failed)
+        return wrapper
+
+# --- LOGS STRUCTURÉS ---
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "service": SERVICE_NAME,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        suffix = "  " + " ".join(f"{k}={v}" for k, v in fields.items()) if fields else ""
+        text = record.getMessage() + suffix
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+class StructuredLogger:
+    """`log.info("message", cle=valeur, ...)`: les champs nommés deviennent des clés JSON."""
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, msg, exc_info, fields):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, None, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, None, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, None, fields)
+
+    def error(self, msg, exc_info=None, **fields):
+        self._log(logging.ERROR, msg, exc_info, fields)
+
+_logging_configured = False
+
+def get_logger(name=None):
+    global _logging_configured
+    if not _logging_configured:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        root = logging.getLogger()
+        root.handlers[:] = [handler]
+        root.setLevel(LOG_LEVEL)
+        _logging_configured = True
+    return StructuredLogger(logging.getLogger(name or SERVICE_NAME))
+
+# --- ENDPOINT /metrics ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass # Pas de log par scrape
+
+_metrics_server = None
+
+def start_metrics_server(port=None):
+    """Démarre /metrics dans un thread si un port est donné ou si METRICS_PORT est défini."""
+    global _metrics_server
+    port = port or METRICS_PORT
+    if not port or _metrics_server is not None:
+        return _metrics_server
+    _metrics_server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    get_logger(__name__).info("Endpoint Prometheus /metrics démarré.", port=int(port))
+    return _metrics_server
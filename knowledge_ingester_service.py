@@ -4,8 +4,10 @@
 import json
 import time
 import os
+import threading
 from kafka import KafkaConsumer
-from ingest import main as run_ingestion
+from ingest import main as run_ingestion, warm_up as warm_up_ingestion
+from instrumentation import get_logger, counter, gauge, span, start_metrics_server
 
 # --- CONFIGURATION ---
 KAFKA_BOOTSTRAP_SERVERS = 'kafka:9092'
@@ -13,11 +15,26 @@ INGESTION_TOPIC = 'knowledge_ingestion_queue'
 INGESTION_DIR = "recherche_medicale"
 BATCH_SIZE = 100  # Nombre d'articles à accumuler avant d'ingérer
 BATCH_TIMEOUT_SECONDS = 300 # Ou ingérer toutes les 5 minutes
+RETRY_DELAY_SECONDS = 60 # Après un échec d'ingestion (Milvus ou API d'embedding indisponible)
+
+log = get_logger("knowledge_ingester")
+ARTICLES_RECEIVED = counter("ingester_articles_received", "Articles reçus depuis Kafka.")
+BUFFERED_ARTICLES = gauge("ingester_buffered_articles", "Articles en attente d'ingestion.")
+
+def _background_warm_up():
+    try:
+        warm_up_ingestion()
+    except Exception as e:
+        # Non bloquant: le premier lot retentera le chargement et signalera l'erreur
+        log.warning("Préchargement des dépendances d'ingestion impossible.", error=str(e))
 
 def main():
     """Boucle principale du service d'ingestion."""
-    print("📚 Démarrage du Knowledge Ingester Service...")
-    
+    log.info("📚 Démarrage du Knowledge Ingester Service...")
+    start_metrics_server()
+    # LangChain, pymilvus et le client d'embedding se chargent pendant que la consommation démarre
+    threading.Thread(target=_background_warm_up, name="ingest-warm-up", daemon=True).start()
+
     consumer = KafkaConsumer(
         INGESTION_TOPIC,
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
@@ -28,6 +45,7 @@ def main():
 
     article_buffer = []
     last_ingestion_time = time.time()
+    retry_at = 0.0
 
     while True:
         # Consommer les messages avec un timeout pour ne pas bloquer indéfiniment
@@ -36,20 +54,36 @@ def main():
         for topic_partition, records in messages.items():
             for record in records:
                 article_data = record.value
-                print(f"  -> Reçu article '{article_data['title'][:40]}...' pour ingestion.")
+                log.debug("Article reçu pour ingestion.", title=article_data['title'][:80])
                 
                 # Sauvegarder l'article dans le dossier d'ingestion
                 file_path = f"{INGESTION_DIR}/{article_data['title'].replace(' ', '_').replace(':', '')[:50]}.txt"
                 with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(f"Title: {article_data['title']}\n\n{article_data['content']}")
+                    # En-têtes relus par ingest.py (champs scalaires source/date de Milvus)
+                    f.write(f"Title: {article_data['title']}\n")
+                    f.write(f"Source: {article_data.get('source', '')}\n")
+                    f.write(f"Feed: {article_data.get('feed', 'unknown')}\n")
+                    f.write(f"Published: {article_data.get('published') or ''}\n\n")
+                    f.write(article_data['content'])
                 
                 article_buffer.append(article_data)
+                ARTICLES_RECEIVED.inc()
+        BUFFERED_ARTICLES.set(len(article_buffer))
 
         # Déclencher l'ingestion si le buffer est plein ou si le timeout est atteint
-        if len(article_buffer) >= BATCH_SIZE or (time.time() - last_ingestion_time > BATCH_TIMEOUT_SECONDS and article_buffer):
-            print(f"🔥 Seuil atteint ({len(article_buffer)} articles). Lancement de l'ingestion par lot dans Milvus...")
-            run_ingestion()
-            print("✅ Ingestion par lot terminée. Nettoyage du buffer et des fichiers.")
+        due = len(article_buffer) >= BATCH_SIZE or (time.time() - last_ingestion_time > BATCH_TIMEOUT_SECONDS and article_buffer)
+        if due and time.time() >= retry_at:
+            log.info("🔥 Seuil atteint. Lancement de l'ingestion par lot dans Milvus...", articles=len(article_buffer))
+            with span("ingester_batch") as batch:
+                succeeded = run_ingestion()
+            if not succeeded:
+                # Les offsets Kafka sont déjà validés: les fichiers sont la seule copie des articles
+                log.error("❌ Ingestion par lot en échec. Fichiers conservés pour une nouvelle tentative.",
+                          articles=len(article_buffer), retry_in_s=RETRY_DELAY_SECONDS)
+                retry_at = time.time() + RETRY_DELAY_SECONDS
+                continue
+            log.info("✅ Ingestion par lot terminée. Nettoyage du buffer et des fichiers.",
+                     articles=len(article_buffer), duration_s=round(batch.elapsed, 2))
             article_buffer.clear()
             # Nettoyer les fichiers traités du dossier
             for filename in os.listdir(INGESTION_DIR):
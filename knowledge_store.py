@@ -0,0 +1,170 @@
+# Fichier: knowledge_store.py
+# Description: Schéma explicite de la collection Milvus `medical_knowledge_base`, partagé par
+#              l'ingestion et les requêtes: champs scalaires (source, date, hash du document),
+#              index ANN paramétrable (HNSW ou IVF_PQ) et partitions par source et par année.
+
+import re
+import json
+from datetime import datetime, timezone
+from pymilvus import connections, utility, Collection, CollectionSchema, FieldSchema, DataType
+
+# --- CONFIGURATION ---
+COLLECTION_NAME = "medical_knowledge_base"
+EMBEDDING_DIM = 768 # models/text-embedding-004
+METRIC_TYPE = "COSINE"
+INDEX_TYPE = "HNSW" # HNSW (< quelques millions de vecteurs) ou IVF_PQ (très gros volumes, mémoire contrainte)
+INDEX_PARAMS = {
+    "HNSW": {"M": 16, "efConstruction": 200},
+    "IVF_PQ": {"nlist": 1024, "m": EMBEDDING_DIM // 8, "nbits": 8},
+}
+SEARCH_PARAMS = {
+    "HNSW": {"ef": 64},
+    "IVF_PQ": {"nprobe": 32},
+}
+UNDATED = "undated"
+
+FIELDS = [
+    FieldSchema("pk", DataType.INT64, is_primary=True, auto_id=True),
+    FieldSchema("text", DataType.VARCHAR, max_length=65535),
+    FieldSchema("vector", DataType.FLOAT_VECTOR, dim=EMBEDDING_DIM),
+    FieldSchema("source", DataType.VARCHAR, max_length=64),       # Flux d'origine: PubMed, WHO, local...
+    FieldSchema("source_uri", DataType.VARCHAR, max_length=1024), # URL de l'article ou chemin du fichier
+    FieldSchema("published_ts", DataType.INT64),                  # Date de publication (epoch s, 0 = inconnue)
+    FieldSchema("doc_hash", DataType.VARCHAR, max_length=64),     # SHA-256 du document complet
+    FieldSchema("chunk_index", DataType.INT64),
+]
+OUTPUT_FIELDS = ["text", "source", "source_uri", "published_ts", "doc_hash", "chunk_index"]
+
+def connect(host, port):
+    connections.connect("default", host=host, port=port)
+
+def _slug(value):
+    return re.sub(r"[^a-z0-9]+", "_", value.lower()).strip("_") or "unknown"
+
+def partition_name(source, published_ts):
+    """Une partition par (source, année). Les noms Milvus doivent commencer par une lettre."""
+    year = datetime.fromtimestamp(published_ts, timezone.utc).year if published_ts else UNDATED
+    return f"p_{_slug(source)}_{year}"
+
+def _parse_partition_name(name):
+    match = re.fullmatch(r"p_(.+)_(\d{4}|" + UNDATED + ")", name)
+    if not match:
+        return None, None
+    year = match.group(2)
+    return match.group(1), None if year == UNDATED else int(year)
+
+def ensure_collection(index_type=INDEX_TYPE, recreate=False):
+    """Crée la collection (schéma, index vectoriel et scalaires) si besoin et la charge en mémoire."""
+    if utility.has_collection(COLLECTION_NAME):
+        collection = Collection(COLLECTION_NAME)
+        existing = {field.name for field in collection.schema.fields}
+        if existing == {field.name for field in FIELDS} and not recreate:
+            collection.load()
+            return collection
+        if not recreate:
+            # Collection créée par l'ancien Milvus.from_documents (schéma implicite de LangChain)
+            raise RuntimeError(
+                f"La collection '{COLLECTION_NAME}' a un schéma différent ({sorted(existing)}). "
+                "Relancez `python ingest.py --recreate` pour la reconstruire."
+            )
+        print(f"♻️  Suppression de l'ancienne collection '{COLLECTION_NAME}'...")
+        collection.drop()
+
+    schema = CollectionSchema(FIELDS, description="Base de connaissances médicale (RAG)")
+    collection = Collection(COLLECTION_NAME, schema)
+    collection.create_index("vector", {"index_type": index_type, "metric_type": METRIC_TYPE, "params": INDEX_PARAMS[index_type]})
+    # Index scalaires: filtres et déduplication par hash sans scan complet
+    collection.create_index("source", {"index_type": "INVERTED"})
+    collection.create_index("published_ts", {"index_type": "INVERTED"})
+    collection.create_index("doc_hash", {"index_type": "INVERTED"})
+    collection.load()
+    print(f"✅ Collection '{COLLECTION_NAME}' créée (index {index_type}, métrique {METRIC_TYPE}).")
+    return collection
+
+def existing_doc_hashes(collection, doc_hashes):
+    """Sous-ensemble des hash de documents déjà présents dans la collection."""
+    found = set()
+    doc_hashes = list(doc_hashes)
+    for i in range(0, len(doc_hashes), 500):
+        batch = doc_hashes[i:i + 500]
+        rows = collection.query(expr=f"doc_hash in {json.dumps(batch)}", output_fields=["doc_hash"])
+        found.update(row["doc_hash"] for row in rows)
+    return found
+
+def collection_id(collection):
+    """Identifiant attribué par Milvus à la création: distingue une collection reconstruite de l'ancienne."""
+    return str(collection.describe().get("collection_id"))
+
+def is_empty(collection):
+    """Requête plutôt que num_entities: les lignes pas encore flushées comptent aussi."""
+    return not collection.query(expr="chunk_index >= 0", output_fields=["chunk_index"], limit=1)
+
+def delete_documents(collection, doc_hashes):
+    """Supprime tous les morceaux des documents donnés (ingestion interrompue, à refaire en entier)."""
+    doc_hashes = list(doc_hashes)
+    for i in range(0, len(doc_hashes), 500):
+        collection.delete(expr=f"doc_hash in {json.dumps(doc_hashes[i:i + 500])}")
+
+def insert_chunks(collection, rows):
+    """Insère des lignes {text, vector, source, source_uri, published_ts, doc_hash, chunk_index} dans leur partition."""
+    by_partition = {}
+    for row in rows:
+        by_partition.setdefault(partition_name(row["source"], row["published_ts"]), []).append(row)
+    for name, partition_rows in by_partition.items():
+        if not collection.has_partition(name):
+            collection.create_partition(name)
+        collection.insert(partition_rows, partition_name=name)
+    return sorted(by_partition)
+
+def build_filter(sources=None, since=None, until=None):
+    """Traduit des filtres de métadonnées en expression Milvus (`since`/`until` sont des datetime)."""
+    clauses = []
+    if sources:
+        clauses.append(f"source in {json.dumps(list(sources))}")
+    if since:
+        clauses.append(f"published_ts >= {int(since.timestamp())}")
+    if until:
+        clauses.append(f"published_ts < {int(until.timestamp())}")
+    return " and ".join(clauses) or None
+
+def prune_partitions(collection, sources=None, since=None, until=None):
+    """Partitions compatibles avec les filtres de source et d'années (None = toutes)."""
+    if not (sources or since or until):
+        return None
+    wanted_sources = {_slug(s) for s in sources} if sources else None
+    selected = []
+    for partition in collection.partitions:
+        source, year = _parse_partition_name(partition.name)
+        if source is None:
+            continue # _default: aucune donnée n'y est écrite
+        if wanted_sources is not None and source not in wanted_sources:
+            continue
+        if (since or until) and year is None:
+            continue
+        if since and year < since.year:
+            continue
+        if until and year > until.year:
+            continue
+        selected.append(partition.name)
+    return selected
+
+def vector_index_type(collection):
+    index = next((i for i in collection.indexes if i.field_name == "vector"), None)
+    return index.params.get("index_type", INDEX_TYPE) if index else INDEX_TYPE
+
+def search(collection, query_vector, k=3, sources=None, since=None, until=None):
+    """Recherche ANN limitée aux partitions pertinentes; retourne des dicts (score + champs scalaires)."""
+    index_type = vector_index_type(collection)
+    partitions = prune_partitions(collection, sources, since, until)
+    if partitions == []:
+        return []
+    results = collection.search(
+        data=[query_vector],
+        anns_field="vector",
+        param={"metric_type": METRIC_TYPE, "params": SEARCH_PARAMS.get(index_type, {})},
+        limit=k,
+        expr=build_filter(sources, since, until),
+        partition_names=partitions,
+        output_fields=OUTPUT_FIELDS,
+    )
+    return [{"score": hit.distance, **{field: hit.entity.get(field) for field in OUTPUT_FIELDS}} for hit in results[0]]
@@ -4,8 +4,8 @@
 
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from kafka import KafkaConsumer, KafkaProducer
-import google.generativeai as genai
 
 # --- CONFIGURATION ---
 KAFKA_BOOTSTRAP_SERVERS = 'kafka:9092'
@@ -16,6 +16,12 @@ EVENTS_TOPIC = 'system_events'
 # car il est découplé de l'application C# qui utilise Vertex AI.
 GOOGLE_API_KEY = os.environ.get('GEMINI_API_KEY')
 
+def build_model():
+    """Import du SDK Gemini (gRPC, protobuf: lent à importer à froid) et création du modèle."""
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel('gemini-1.5-pro-latest') # Utilise le meilleur modèle disponible via l'API Key
+
 def main():
     """Boucle principale du Meta-Prompter."""
     if not GOOGLE_API_KEY:
@@ -23,8 +29,8 @@ def main():
         return
 
     print("🤖 Démarrage du Meta-Cognitive Prompter...")
-    genai.configure(api_key=GOOGLE_API_KEY)
-    model = genai.GenerativeModel('gemini-1.5-pro-latest') # Utilise le meilleur modèle disponible via l'API Key
+    # Le SDK se charge en arrière-plan pendant la connexion à Kafka; le modèle n'est attendu qu'au premier objectif
+    model_future = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-warm-up").submit(build_model)
 
     consumer = KafkaConsumer(
         META_PROMPT_TOPIC,
@@ -47,7 +53,22 @@ def main():
         prompt = goal_data.get('prompt_for_gemini')
 
         print(f"🧠 [META_PROMPTER] Nouvel objectif reçu ({goal_id}). Interrogation de Gemini Pro...")
-        
+
+        try:
+            model = model_future.result()
+        except Exception as e:
+            # Le future garde son exception: sans reconstruction, chaque objectif échouerait de la même façon
+            print(f"⚠️ [META_PROMPTER] Préchargement du SDK Gemini en échec ({e}). Nouvelle tentative...")
+            model_future = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-warm-up").submit(build_model)
+            try:
+                model = model_future.result()
+            except Exception as e:
+                # Arrêt sans valider l'offset: l'objectif sera relu au redémarrage du service
+                print(f"❌ [META_PROMPTER] SDK Gemini indisponible: {e}. Arrêt du service.")
+                consumer.close(autocommit=False)
+                producer.close()
+                return
+
         try:
             # Pose la question à Gemini
             response = model.generate_content(prompt)
@@ -6,8 +6,7 @@ import time
 from datetime import datetime, timedelta
 import numpy as np
 from prometheus_api_client import PrometheusConnect
-from sklearn.linear_model import LinearRegression
-from kubernetes import client, config
+from instrumentation import get_logger, counter, gauge, span, start_metrics_server
 
 # --- CONFIGURATION ---
 PROMETHEUS_URL = "http://prometheus-service.monitoring.svc.cluster.local:9090"
@@ -19,9 +18,14 @@ PREDICTION_HORIZON_MINUTES = 60 # Prédire la charge pour la prochaine heure
 PRE_SCALE_THRESHOLD = 100      # Si on prédit un lag > 100, on pré-scale
 PRE_SCALE_REPLICAS = 10        # Nombre de répliques à démarrer en prévision du pic
 
+log = get_logger("metrics_analyzer")
+PREDICTED_LAG = gauge("analyzer_predicted_lag", "Lag Kafka prédit à l'horizon de prédiction.")
+SCALE_ACTIONS = counter("analyzer_scale_actions", "Mises à jour du minReplicaCount KEDA.", ("replicas", "outcome"))
+
+@span("analyzer_fetch")
 def get_historical_data(prom):
     """Récupère les données historiques de lag Kafka depuis Prometheus."""
-    print("📊 Récupération des données historiques de lag Kafka...")
+    log.info("📊 Récupération des données historiques de lag Kafka...")
     try:
         # Récupérer les données des 7 derniers jours, avec une résolution de 15 minutes
         result = prom.custom_query_range(
@@ -37,15 +41,17 @@ def get_historical_data(prom):
         points = result[0]['values']
         timestamps = np.array([p[0] for p in points]).reshape(-1, 1)
         values = np.array([float(p[1]) for p in points])
-        print(f"✅ {len(points)} points de données récupérés.")
+        log.info("✅ Points de données récupérés.", points=len(points))
         return timestamps, values
     except Exception as e:
-        print(f"❌ Erreur lors de la récupération des données Prometheus: {e}")
+        log.error("❌ Erreur lors de la récupération des données Prometheus.", error=str(e))
         return None
 
+@span("analyzer_forecast")
 def train_and_predict(timestamps, values):
     """Entraîne un modèle de régression simple et prédit le futur lag."""
-    print("🧠 Entraînement du modèle de prédiction...")
+    from sklearn.linear_model import LinearRegression # Chargé au premier usage (démarrage plus rapide)
+    log.info("🧠 Entraînement du modèle de prédiction...")
     model = LinearRegression()
     model.fit(timestamps, values)
     
@@ -53,12 +59,14 @@ def train_and_predict(timestamps, values):
     future_timestamp = (datetime.now() + timedelta(minutes=PREDICTION_HORIZON_MINUTES)).timestamp()
     predicted_lag = model.predict(np.array([[future_timestamp]]))[0]
     
-    print(f"🔮 Prédiction: Lag estimé dans {PREDICTION_HORIZON_MINUTES} min = {predicted_lag:.2f}")
+    PREDICTED_LAG.set(predicted_lag)
+    log.info("🔮 Prédiction du lag.", horizon_min=PREDICTION_HORIZON_MINUTES, predicted_lag=round(float(predicted_lag), 2))
     return predicted_lag
 
 def pre_scale_deployment(replicas):
     """Met à jour le minReplicaCount de l'objet KEDA pour forcer un scaling prédictif."""
-    print(f"🚀 Action AIOps: Pré-scaling à {replicas} répliques...")
+    from kubernetes import client, config # Chargé au premier usage (démarrage plus rapide)
+    log.info("🚀 Action AIOps: Pré-scaling...", replicas=replicas)
     try:
         # Charger la configuration Kubernetes (fonctionne à l'intérieur d'un pod)
         config.load_incluster_config()
@@ -74,28 +82,32 @@ def pre_scale_deployment(replicas):
             namespace=TARGET_NAMESPACE,
             body=patch
         )
-        print(f"✅ ScaledObject '{TARGET_SCALEDOBJECT}' mis à jour avec minReplicaCount = {replicas}.")
+        SCALE_ACTIONS.labels(replicas=replicas, outcome="ok").inc()
+        log.info("✅ ScaledObject mis à jour.", scaled_object=TARGET_SCALEDOBJECT, min_replica_count=replicas)
     except Exception as e:
-        print(f"❌ Erreur lors de la mise à jour de KEDA via l'API K8s: {e}")
+        SCALE_ACTIONS.labels(replicas=replicas, outcome="error").inc()
+        log.error("❌ Erreur lors de la mise à jour de KEDA via l'API K8s.", error=str(e))
 
 def main():
-    print("🤖 Démarrage du service d'analyse de métriques AIOps...")
+    log.info("🤖 Démarrage du service d'analyse de métriques AIOps...")
+    start_metrics_server()
     prom = PrometheusConnect(url=PROMETHEUS_URL, disable_ssl=True)
     
     while True:
-        data = get_historical_data(prom)
-        if data:
-            timestamps, values = data
-            predicted_lag = train_and_predict(timestamps, values)
-            
-            if predicted_lag > PRE_SCALE_THRESHOLD:
-                pre_scale_deployment(PRE_SCALE_REPLICAS)
-            else:
-                # S'assurer de revenir à la normale si le pic est passé
-                print("📉 Aucune action requise. Le lag prédit est sous le seuil.")
-                pre_scale_deployment(1) # Retour au minReplicaCount par défaut
-        
-        print(f"😴 Attente de 30 minutes avant la prochaine analyse...")
+        with span("analyzer_cycle"):
+            data = get_historical_data(prom)
+            if data:
+                timestamps, values = data
+                predicted_lag = train_and_predict(timestamps, values)
+
+                if predicted_lag > PRE_SCALE_THRESHOLD:
+                    pre_scale_deployment(PRE_SCALE_REPLICAS)
+                else:
+                    # S'assurer de revenir à la normale si le pic est passé
+                    log.info("📉 Aucune action requise. Le lag prédit est sous le seuil.", threshold=PRE_SCALE_THRESHOLD)
+                    pre_scale_deployment(1) # Retour au minReplicaCount par défaut
+
+        log.info("😴 Attente de 30 minutes avant la prochaine analyse...")
         time.sleep(1800)
 
 if __name__ == "__main__":
@@ -1,35 +1,50 @@
 # Fichier: query_knowledge.py
 # Description: Script interactif pour interroger la base de connaissances Milvus.
+#              Filtres de métadonnées optionnels (source, période) qui élaguent les partitions.
 
-import os
+import argparse
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import Milvus
+import knowledge_store
 
 load_dotenv()
 
 # --- CONFIGURATION ---
 MILVUS_HOST = "localhost"
 MILVUS_PORT = "19530"
-COLLECTION_NAME = "medical_knowledge_base"
+TOP_K = 3
+
+def _date(value):
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Interrogation de la base de connaissances médicale.")
+    parser.add_argument("--source", action="append", help="Limite aux sources données (ex: --source WHO --source PubMed).")
+    parser.add_argument("--since", type=_date, help="Publications à partir de cette date (AAAA-MM-JJ).")
+    parser.add_argument("--until", type=_date, help="Publications avant cette date (AAAA-MM-JJ).")
+    parser.add_argument("-k", type=int, default=TOP_K, help="Nombre de morceaux retournés.")
+    return parser.parse_args()
 
 def main():
     """
     Lance une session interactive pour interroger la base de connaissances.
     """
+    args = parse_args()
     print("🧠 Initialisation de l'interface de requête de la base de connaissances...")
-    
+
     try:
         # Utilise le même modèle d'embedding que pour l'ingestion
         embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
 
         # Se connecte à la base de données vectorielle existante
-        vector_store = Milvus(
-            embedding_function=embeddings,
-            collection_name=COLLECTION_NAME,
-            connection_args={"host": MILVUS_HOST, "port": MILVUS_PORT},
-        )
+        knowledge_store.connect(MILVUS_HOST, MILVUS_PORT)
+        collection = knowledge_store.ensure_collection()
         print("✅ Connecté à la base de connaissances Milvus.")
+        partitions = knowledge_store.prune_partitions(collection, args.source, args.since, args.until)
+        if partitions is not None:
+            print(f"🔎 Filtres actifs: {knowledge_store.build_filter(args.source, args.since, args.until)} "
+                  f"({len(partitions)} partition(s) interrogée(s) sur {len(collection.partitions) - 1}).")
         print("❓ Posez une question (ex: 'Quels sont les traitements pour le diabète de type 2 ?') ou tapez 'quitter'.")
 
     except Exception as e:
@@ -42,19 +57,21 @@ def main():
         query = input("\nVotre question > ")
         if query.lower() in ['quitter', 'exit', 'q']:
             break
-        
+
         print("   Recherche des documents similaires...")
-        # Fait une recherche de similarité dans Milvus
-        similar_docs = vector_store.similarity_search(query, k=3) # Trouve les 3 morceaux les plus pertinents
-        
+        # Fait une recherche de similarité dans Milvus, restreinte aux partitions pertinentes
+        similar_docs = knowledge_store.search(collection, embeddings.embed_query(query), k=args.k,
+                                              sources=args.source, since=args.since, until=args.until)
+
         print("\n--- RÉSULTATS TROUVÉS DANS LA BASE DE CONNAISSANCES ---")
         for i, doc in enumerate(similar_docs):
-            print(f"\n📄 Document {i+1} (Source: {doc.metadata.get('source', 'N/A')})")
+            published = datetime.fromtimestamp(doc["published_ts"], timezone.utc).date() if doc["published_ts"] else "date inconnue"
+            print(f"\n📄 Document {i+1} (Source: {doc['source']}, {published}, {doc['source_uri'] or 'N/A'})")
             print("-" * 20)
-            print(doc.page_content)
+            print(doc["text"])
         print("\n" + "="*60)
 
     print("👋 Session terminée.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -3,10 +3,12 @@
 
 import asyncio
 import feedparser
-import time
 import httpx
 import json
+import os
+from datetime import datetime, timezone
 from kafka import KafkaProducer
+from instrumentation import get_logger, counter, gauge, span, start_metrics_server
 
 # --- CONFIGURATION ---
 SOURCES = {
@@ -18,74 +20,118 @@ GEMINI_VALIDATION_ENDPOINT = "http://gemini-consumer-app:8080/validate-source" #
 MAX_CONCURRENT_TASKS = 50 # Nombre de tâches parallèles (scan, validation)
 KAFKA_BOOTSTRAP_SERVERS = 'kafka:9092'
 INGESTION_TOPIC = 'knowledge_ingestion_queue'
+HEARTBEAT_FILE = "state/scout_heartbeat.json" # Lu par le Cognitive Supervisor (fraîcheur du dernier cycle)
+
+log = get_logger("scout")
+ARTICLES_FETCHED = counter("scout_articles_fetched", "Articles bruts récupérés par source.", ("source",))
+VALIDATIONS = counter("scout_validations", "Résultats de validation cognitive.", ("outcome",))
+LAST_CYCLE_ARTICLES = gauge("scout_last_cycle_articles", "Articles du dernier cycle.", ("stage",))
 
 async def fetch_source(session, source_name, url):
     """Scanne un seul flux RSS de manière asynchrone."""
-    print(f"   -> Scan asynchrone de {source_name}...")
+    log.debug("Scan asynchrone du flux.", source=source_name)
     try:
-        response = await session.get(url, timeout=15)
-        feed = feedparser.parse(response.text)
+        with span("scout_fetch", source=source_name) as timer:
+            response = await session.get(url, timeout=15)
+            feed = feedparser.parse(response.text)
+        for entry in feed.entries:
+            entry["feed_name"] = source_name # Devient le champ `source` (et la partition) dans Milvus
+        ARTICLES_FETCHED.labels(source=source_name).inc(len(feed.entries))
+        log.info("Flux scanné.", source=source_name, articles=len(feed.entries), duration_s=round(timer.elapsed, 3))
         return feed.entries
     except httpx.RequestError as e:
-        print(f"   [WARN] Échec du scan de {source_name}: {e}")
+        log.warning("Échec du scan du flux.", source=source_name, error=str(e))
         return []
 
 async def fetch_all_articles_concurrently():
     """Scanne TOUTES les sources en parallèle."""
-    print("🛰️  ScoutService: Recherche de nouvelles publications sur plusieurs sources...")
+    log.info("🛰️  Recherche de nouvelles publications sur plusieurs sources...", sources=len(SOURCES))
     async with httpx.AsyncClient() as session:
         tasks = [fetch_source(session, name, url) for name, url in SOURCES.items()]
         results = await asyncio.gather(*tasks)
         all_entries = [entry for feed_entries in results for entry in feed_entries]
-    print(f"✅ {len(all_entries)} articles bruts trouvés sur toutes les sources.")
+    log.info("✅ Articles bruts trouvés sur toutes les sources.", articles=len(all_entries))
     return all_entries
 
+def published_iso(entry):
+    """Date de publication du flux (struct_time UTC normalisée par feedparser), ISO 8601 ou None."""
+    parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+    if not parsed:
+        return None
+    return datetime(*parsed[:6], tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
+
 async def validate_and_queue_article(session, producer, entry):
     """Utilise l'IA elle-même pour valider la crédibilité d'un article."""
     try:
         payload = {"title": entry.title, "summary": entry.summary}
-        response = await session.post(GEMINI_VALIDATION_ENDPOINT, json=payload, timeout=60)
-        response.raise_for_status()
+        with span("scout_validation"):
+            response = await session.post(GEMINI_VALIDATION_ENDPOINT, json=payload, timeout=60)
+            response.raise_for_status()
         result = response.json()
         is_credible = result.get("isCredible", False)
+        VALIDATIONS.labels(outcome="credible" if is_credible else "rejected").inc()
         if is_credible:
-            print(f"     ✅ Article '{entry.title[:30]}...' jugé crédible. Envoi vers la file d'ingestion.")
-            article_data = {'title': entry.title, 'content': entry.summary, 'source': entry.link}
+            log.info("Article jugé crédible, envoyé vers la file d'ingestion.", title=entry.title[:80], source=entry.get("feed_name"))
+            article_data = {'title': entry.title, 'content': entry.summary, 'source': entry.link,
+                            'feed': entry.get('feed_name', 'unknown'), 'published': published_iso(entry)}
             producer.send(INGESTION_TOPIC, value=article_data)
         return is_credible
-    except httpx.RequestError as e:
-        print(f"   [WARN] Impossible de contacter le service de validation: {e}")
+    except httpx.HTTPError as e:
+        VALIDATIONS.labels(outcome="error").inc()
+        log.warning("Impossible de contacter le service de validation.", error=str(e))
         # En cas d'échec, on est conservateur et on refuse l'article.
         return False
 
+def write_heartbeat(articles_found, articles_queued, cycle_seconds):
+    """Enregistre la fin du cycle (écriture atomique: le superviseur ne lit jamais un fichier partiel)."""
+    heartbeat = {
+        "last_run": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
+        "articles_found": articles_found,
+        "articles_queued": articles_queued,
+        "cycle_seconds": round(cycle_seconds, 1),
+    }
+    os.makedirs(os.path.dirname(HEARTBEAT_FILE), exist_ok=True)
+    tmp_path = HEARTBEAT_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(heartbeat, f)
+    os.replace(tmp_path, HEARTBEAT_FILE)
+
 async def main():
     """Boucle principale du ScoutService."""
-    print("🤖 Démarrage du ScoutService (Chercheur Autonome)...")
+    log.info("🤖 Démarrage du ScoutService (Chercheur Autonome)...")
+    start_metrics_server()
     producer = KafkaProducer(
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
         value_serializer=lambda v: json.dumps(v).encode('utf-8')
     )
 
     while True:
-        # --- AMÉLIORATION "JAMAIS VUE": EXÉCUTION MASSIVEMENT PARALLÈLE ---
-        # 1. Scanner toutes les sources en même temps
-        all_entries = await fetch_all_articles_concurrently()
-        
-        # 2. Valider tous les articles trouvés en parallèle
-        print(f"🔬 Validation cognitive de {len(all_entries)} articles en parallèle (batchs de {MAX_CONCURRENT_TASKS})...")
-        async with httpx.AsyncClient() as session:
-            validation_tasks = [validate_and_queue_article(session, producer, entry) for entry in all_entries]
-            for i in range(0, len(validation_tasks), MAX_CONCURRENT_TASKS):
-                batch = validation_tasks[i:i+MAX_CONCURRENT_TASKS]
-                await asyncio.gather(*batch)
-        
-        # Forcer l'envoi de tous les messages en attente dans le buffer du producer
-        producer.flush()
-        print("👍 Cycle de validation terminé. Les articles crédibles sont dans la file d'attente Kafka.")
-            
+        with span("scout_cycle") as cycle:
+            # --- AMÉLIORATION "JAMAIS VUE": EXÉCUTION MASSIVEMENT PARALLÈLE ---
+            # 1. Scanner toutes les sources en même temps
+            all_entries = await fetch_all_articles_concurrently()
+
+            # 2. Valider tous les articles trouvés en parallèle
+            log.info("🔬 Validation cognitive en parallèle...", articles=len(all_entries), batch_size=MAX_CONCURRENT_TASKS)
+            queued = 0
+            async with httpx.AsyncClient() as session:
+                validation_tasks = [validate_and_queue_article(session, producer, entry) for entry in all_entries]
+                for i in range(0, len(validation_tasks), MAX_CONCURRENT_TASKS):
+                    batch = validation_tasks[i:i+MAX_CONCURRENT_TASKS]
+                    queued += sum(await asyncio.gather(*batch))
+
+            # Forcer l'envoi de tous les messages en attente dans le buffer du producer
+            producer.flush()
+
+        write_heartbeat(len(all_entries), queued, cycle.elapsed)
+        LAST_CYCLE_ARTICLES.labels(stage="found").set(len(all_entries))
+        LAST_CYCLE_ARTICLES.labels(stage="queued").set(queued)
+        log.info("👍 Cycle de validation terminé. Les articles crédibles sont dans la file d'attente Kafka.",
+                 articles=len(all_entries), queued=queued, duration_s=round(cycle.elapsed, 2))
+
         # --- AMÉLIORATION "JAMAIS VUE": RYTHME ADAPTATIF ---
         # Cycle rapide de 5 minutes pour une réactivité maximale sans surcharger les APIs.
-        print("⏱️  Cycle d'enrichissement terminé. Prochain cycle dans 5 minutes.")
+        log.info("⏱️  Cycle d'enrichissement terminé. Prochain cycle dans 5 minutes.")
         await asyncio.sleep(300)
 
 if __name__ == "__main__":
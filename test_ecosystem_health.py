@@ -0,0 +1,64 @@
+# Fichier: test_ecosystem_health.py
+# Description: Vérifie HealthProbeEngine.sweep sur des sondes factices (aucun service réel):
+#              exécution parallèle, timeout et exception rapportés DOWN, cache TTL.
+#              Lancement: python -m pytest test_ecosystem_health.py
+
+import asyncio
+import pytest
+from ecosystem_health import HealthProbe, HealthProbeEngine, STATUS_OK, STATUS_DOWN
+
+# --- CONFIGURATION ---
+PROBE_DELAY_S = 0.5
+TIMEOUT_S = 0.3
+
+class StandInProbe(HealthProbe):
+    """Sonde factice: attend `delay` secondes puis répond OK, ou lève `error`."""
+
+    def __init__(self, name, delay, error=None, timeout=5.0, ttl=30.0):
+        super().__init__(name, timeout, ttl)
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def check(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return STATUS_OK, {"delay_s": self.delay}
+
+@pytest.fixture
+def engine():
+    slow = [StandInProbe(f"lente_{i}", delay=PROBE_DELAY_S) for i in range(3)]
+    hanging = StandInProbe("bloquee", delay=30.0, timeout=TIMEOUT_S)
+    failing = StandInProbe("en_echec", delay=0.0, error=ConnectionError("refusé"))
+    return HealthProbeEngine([*slow, hanging, failing])
+
+def test_sweep_runs_probes_concurrently(engine):
+    report = engine.sweep_sync()
+    serial_ms = (3 * PROBE_DELAY_S + TIMEOUT_S) * 1000
+    # En série ~1.8s; en parallèle ~ la plus lente (0.5s). Marge large pour une machine chargée.
+    assert report["duration_ms"] < serial_ms * 0.75
+    assert all(component["status"] == STATUS_OK for name, component in report["components"].items() if name.startswith("lente_"))
+
+def test_timeout_and_failure_are_reported_down(engine):
+    report = engine.sweep_sync()
+    hanging, failing = report["components"]["bloquee"], report["components"]["en_echec"]
+    assert hanging["status"] == STATUS_DOWN
+    assert f"{TIMEOUT_S}s" in hanging["details"]["error"]
+    assert failing["status"] == STATUS_DOWN
+    assert "ConnectionError" in failing["details"]["error"]
+    assert report["overall"] == STATUS_DOWN
+
+def test_results_are_cached_until_ttl_expires(engine):
+    engine.sweep_sync()
+    report = engine.sweep_sync()
+    assert all(component["cached"] for component in report["components"].values())
+    assert all(probe.calls == 1 for probe in engine.probes)
+
+    # Expiration simulée en vieillissant l'entrée du cache (pas d'attente réelle)
+    for probe in engine.probes:
+        probe._cached_at -= probe.ttl
+    report = engine.sweep_sync()
+    assert not any(component["cached"] for component in report["components"].values())
+    assert all(probe.calls == 2 for probe in engine.probes)
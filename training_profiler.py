@@ -0,0 +1,120 @@
+# Fichier: training_profiler.py
+# Description: Profileur de débit pour l'entraînement Edge (callback du Trainer Hugging Face).
+#              Mesure tokens/s, décomposition du temps par pas (données, forward+backward,
+#              optimiseur) et pic de mémoire RSS, pour dimensionner le matériel des hôpitaux
+#              et détecter les régressions de débit en CI.
+
+import json
+import time
+import statistics
+from transformers import TrainerCallback
+
+try:
+    import resource # Indisponible sous Windows
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def current_rss_bytes():
+    return psutil.Process().memory_info().rss if psutil else 0
+
+def peak_rss_bytes():
+    """Pic de RSS du processus depuis son démarrage (ru_maxrss est en Ko sous Linux)."""
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    return 0
+
+class ThroughputProfiler(TrainerCallback):
+    """
+    Découpe chaque pas d'optimisation en trois phases:
+    - data: de la fin du pas précédent au début du suivant (chargement/collation, logging);
+    - compute: forward + backward de toutes les micro-batches accumulées;
+    - optimizer: pas de l'optimiseur, scheduler et remise à zéro des gradients.
+    Les premiers pas (préchauffage) sont exclus des statistiques. Les tokens sont lus dans
+    `state.num_input_tokens_seen` (TrainingArguments(include_num_input_tokens_seen=True)).
+    """
+
+    def __init__(self, warmup_steps=2):
+        self.warmup_steps = warmup_steps
+        self.steps = []
+        self._last_end = None
+        self._step_begin = None
+        self._optimizer_begin = None
+        self._tokens_seen = 0
+        self._peak_rss_sampled = 0
+
+    def _now(self):
+        return time.perf_counter()
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self._last_end = self._now()
+        self._tokens_seen = getattr(state, "num_input_tokens_seen", 0)
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._step_begin = self._now()
+        self._optimizer_begin = None
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._optimizer_begin = self._now()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        end = self._now()
+        optimizer_begin = self._optimizer_begin or end
+        tokens_seen = getattr(state, "num_input_tokens_seen", 0)
+        tokens, self._tokens_seen = tokens_seen - self._tokens_seen, tokens_seen
+        self.steps.append({
+            "data_s": self._step_begin - self._last_end,
+            "compute_s": optimizer_begin - self._step_begin,
+            "optimizer_s": end - optimizer_begin,
+            "total_s": end - self._last_end,
+            "tokens": tokens,
+        })
+        self._last_end = end
+        self._peak_rss_sampled = max(self._peak_rss_sampled, current_rss_bytes())
+
+    def report(self):
+        measured = self.steps[self.warmup_steps:] or self.steps
+        if not measured:
+            return {}
+        total_time = sum(s["total_s"] for s in measured)
+        total_tokens = sum(s["tokens"] for s in measured)
+        step_times = sorted(s["total_s"] for s in measured)
+        report = {
+            "steps_measured": len(measured),
+            "tokens_per_second": round(total_tokens / total_time, 1) if total_time else None,
+            "step_time_s": {
+                "mean": round(statistics.mean(step_times), 4),
+                "p50": round(step_times[len(step_times) // 2], 4),
+                "p95": round(step_times[min(len(step_times) - 1, int(len(step_times) * 0.95))], 4),
+            },
+            "breakdown_pct": {
+                phase: round(100 * sum(s[f"{phase}_s"] for s in measured) / total_time, 1) if total_time else None
+                for phase in ("data", "compute", "optimizer")
+            },
+            "peak_rss_mb": round(max(peak_rss_bytes(), self._peak_rss_sampled) / 1024 ** 2, 1),
+        }
+        return report
+
+    def print_report(self, json_path=None):
+        report = self.report()
+        if not report:
+            print("⚠️ [PROFILER] Aucun pas mesuré.")
+            return report
+        breakdown = report["breakdown_pct"]
+        print("📈 [PROFILER] Débit d'entraînement:")
+        print(f"   Tokens/s: {report['tokens_per_second']} | Pas: moyenne {report['step_time_s']['mean']}s, "
+              f"p95 {report['step_time_s']['p95']}s ({report['steps_measured']} pas mesurés)")
+        print(f"   Répartition: données {breakdown['data']}% | forward+backward {breakdown['compute']}% | optimiseur {breakdown['optimizer']}%")
+        print(f"   Pic mémoire RSS: {report['peak_rss_mb']} Mo")
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"   Rapport écrit dans '{json_path}'.")
+        return report